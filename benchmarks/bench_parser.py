@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Throughput of the record parsers.
+Compares the former regex path of UpdateData (decode, finditer, float() and
+list appends per field) with RegexParser and the bytes-level ProtocolParser,
+and the per-record and vectorised paths of ProtocolParser with each other.
+The crossover of the two paths is where ProtocolParser.small_readout should be.
+
+    python benchmarks/bench_parser.py
+    python benchmarks/bench_parser.py --crossover 1 64
+"""
+import argparse
+import re
+from time import perf_counter
+import numpy as np
+from htmon.RecordParser import ProtocolParser, RegexParser
+
+def LegacyParse(lines, regexp, sensor_data, measure_time):
+    """ Reference implementation of the former parsing in UpdateData """
+    for l_ in lines:
+        for iter in regexp.finditer(l_.decode('utf-8')):
+            sensor = iter.group('sensor')
+            if sensor not in sensor_data:
+                sensor_data[sensor] = {'T':[], 'RH':[], 'time':[]}
+            sensor_data[sensor]['T'].append(float(iter.group('T')))
+            sensor_data[sensor]['RH'].append(float(iter.group('RH')))
+            sensor_data[sensor]['time'].append(measure_time)
+        l_.decode('utf-8')
+
+def MakeReadouts(n_readouts, n_sensors):
+    T = np.random.normal(20, 2, size=(n_readouts, n_sensors))
+    RH = np.random.normal(40, 5, size=(n_readouts, n_sensors))
+    return [[(';'.join(f'{i:d}:T={T[r,i]:0.2f}C,RH={RH[r,i]:0.2f}%' for i in range(n_sensors)) + '\n').encode()]
+            for r in range(n_readouts)]
+
+def Time(parse, readouts):
+    """ Seconds per readout """
+    start = perf_counter()
+    for lines in readouts:
+        parse(lines)
+    return (perf_counter() - start)/len(readouts)
+
+def Run(name, parse, readouts, n_sensors):
+    elapsed = Time(parse, readouts)
+    print(f"{name:>22} {n_sensors/elapsed/1e3:>14.1f} {1e6*elapsed:>16.1f}")
+
+def PathParser(small_readout):
+    """ ProtocolParser which always takes the per-record path (large small_readout) or the vectorised one (0) """
+    parser = ProtocolParser()
+    parser.small_readout = small_readout
+    return parser
+
+def Crossover(n_min, n_max, n_readouts):
+    """ Readout size from which the vectorised path stays faster than the per-record one """
+    print(f"{'sensors':>8} {'per record [us]':>16} {'vectorised [us]':>16}")
+    crossover = n_min
+    for n_sensors in range(n_min, n_max + 1):
+        readouts = MakeReadouts(n_readouts, n_sensors)
+        small = Time(PathParser(n_max + 1).Parse, readouts)
+        vectorised = Time(PathParser(0).Parse, readouts)
+        print(f"{n_sensors:>8} {1e6*small:>16.1f} {1e6*vectorised:>16.1f}")
+        if small <= vectorised:
+            crossover = n_sensors + 1
+    print(f"Vectorised path faster from {crossover} sensors per readout, "
+            f"ProtocolParser.small_readout = {ProtocolParser.small_readout}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readouts", type=int, default=2000)
+    parser.add_argument("--sensors", type=int, nargs="+", default=[2, 5, 50, 500])
+    parser.add_argument("--crossover", type=int, nargs=2, metavar=("MIN", "MAX"), default=None,
+            help="scan readout sizes for the crossover of the two ProtocolParser paths instead")
+    args = parser.parse_args()
+    if args.crossover is not None:
+        Crossover(*args.crossover, args.readouts)
+        return
+    regexp = re.compile(RegexParser.default_regexp, re.IGNORECASE)
+    for n_sensors in args.sensors:
+        readouts = MakeReadouts(args.readouts, n_sensors)
+        print(f"{n_sensors} sensors per readout")
+        print(f"{'parser':>22} {'krecords/s':>14} {'us/readout':>16}")
+        Run("legacy regex", lambda lines: LegacyParse(lines, regexp, {}, 0.), readouts, n_sensors)
+        Run("RegexParser", RegexParser().Parse, readouts, n_sensors)
+        Run("ProtocolParser", ProtocolParser().Parse, readouts, n_sensors)
+        Run("  per-record path", PathParser(n_sensors).Parse, readouts, n_sensors)
+        Run("  vectorised path", PathParser(0).Parse, readouts, n_sensors)
+
+if __name__ == "__main__":
+    main()
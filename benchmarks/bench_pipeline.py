@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+End-to-end throughput of the acquisition pipeline with simulated devices.
+Every poll goes through the same stages as in the GUI:
+
+    ingest  request until the readout of all devices is complete (SerialReader)
+    parse   ProtocolParser on the received lines
+    store   appending the samples to the SampleStore
+    plot    HTMonitorWidget.UpdatePlots (decimation, drawing)
+    write   formatting and writing the new rows (CSV and binary, as the writer thread does)
+
+Latency percentiles per stage and the record throughput are printed and, with
+--json, saved for comparisons between releases (--compare old.json).
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/bench_pipeline.py --sensors 10 100 500
+    python benchmarks/bench_pipeline.py --pty --no-plot --sensors 100 --json results.json
+"""
+import os
+import sys
+import json
+import platform
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter, strftime, sleep
+import numpy as np
+from htmon.SampleStore import SampleStore
+from htmon.RecordParser import ProtocolParser
+from htmon.DataWriter import DataWriter
+from htmon.DummySerial import DummySerial, PtySimulator
+from htmon.SerialReader import SerialReader, SensorKey, OpenDevice
+
+STAGES = ["ingest", "parse", "store", "plot", "write"]
+PERCENTILES = [50, 90, 99]
+
+def OpenDevices(args, n_sensors):
+    """ Returns (serials dict, list of objects to stop afterwards) """
+    serials, simulators = {}, []
+    for i in range(args.devices):
+        options = dict(n_sensors=n_sensors, malformed_rate=args.malformed, partial_rate=args.partial, seed=i)
+        if args.pty:
+            simulator = PtySimulator(delay=args.delay, **options)
+            simulator.Start()
+            simulators.append(simulator)
+            serials[f"dev{i}"] = OpenDevice(simulator.port, 115200)
+        else:
+            serials[f"dev{i}"] = DummySerial(delay=args.delay, jitter=args.jitter, chunk_size=args.chunk_size, **options)
+    return serials, simulators
+
+def Stats(values):
+    values = np.asarray(values)
+    stats = {f"p{p}_ms":1e3*float(np.percentile(values, p)) for p in PERCENTILES}
+    stats["mean_ms"] = 1e3*float(values.mean())
+    stats["max_ms"] = 1e3*float(values.max())
+    return stats
+
+def RunCase(args, n_sensors, widget=None, app=None):
+    serials, simulators = OpenDevices(args, n_sensors)
+    reader = SerialReader(serials, timeout=args.timeout)
+    reader.Start()
+    parser = ProtocolParser()
+    store = SampleStore(max_samples=None) if widget is None else widget.sensor_data
+    outdir = tempfile.mkdtemp(prefix="htmon_bench_")
+    writer = DataWriter(outdir) # not started: batches are written synchronously to time them
+    timings = {stage:[] for stage in STAGES}
+    n_records = 0
+    # The first readout teaches the reader how many records to expect
+    reader.Request()
+    reader.results.get()
+    start = perf_counter()
+    for i in range(args.polls):
+        t0 = perf_counter()
+        reader.Request()
+        measurement = reader.results.get()
+        t1 = perf_counter()
+        parsed = {device:parser.Parse(lines) for device, lines in measurement.lines.items()}
+        t2 = perf_counter()
+        for device, records in parsed.items():
+            store.AppendBatch(SensorKey(device, records.sensors, len(serials)), measurement.request_time, records.T, records.RH)
+            n_records += len(records.sensors)
+        t3 = perf_counter()
+        if widget is not None:
+            widget.UpdatePlots()
+            app.processEvents()
+        t4 = perf_counter()
+        for device, records in parsed.items():
+            sensors = SensorKey(device, records.sensors, len(serials))
+            for sensor in np.unique(sensors):
+                mask = sensors == sensor
+                batch = [(np.full(np.count_nonzero(mask), measurement.request_time), records.T[mask], records.RH[mask])]
+                for fmt in writer.formats:
+                    writer.WriteBatch(fmt, sensor, batch)
+        t5 = perf_counter()
+        for stage, (a_, b_) in zip(STAGES, ((t0, t1), (t1, t2), (t2, t3), (t3, t4), (t4, t5))):
+            timings[stage].append(b_ - a_)
+        if args.interval > 0:
+            remaining = t0 + args.interval - perf_counter()
+            if remaining > 0:
+                sleep(remaining)
+    elapsed = perf_counter() - start
+    reader.Stop()
+    for file in writer.files.values():
+        file.Close()
+    for serial_ in serials.values():
+        serial_.close()
+    for simulator in simulators:
+        simulator.Stop()
+    result = {"sensors":n_sensors, "devices":args.devices, "polls":args.polls,
+            "records_per_s":n_records/elapsed, "polls_per_s":args.polls/elapsed,
+            "malformed_records":parser.n_malformed,
+            "stages":{stage:Stats(values) for stage, values in timings.items() if widget is not None or stage != "plot"}}
+    result["stages"]["total"] = Stats(np.sum([timings[s_] for s_ in STAGES], axis=0))
+    return result
+
+def Metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"date":strftime("%Y-%m-%d %H:%M:%S"), "commit":commit, "python":platform.python_version(),
+            "numpy":np.__version__, "platform":platform.platform(), "arguments":vars(args)}
+
+def PrintResult(result, reference=None):
+    print(f"{result['sensors']} sensors x {result['devices']} devices: "
+            f"{result['records_per_s']:0.0f} records/s, {result['polls_per_s']:0.1f} polls/s, "
+            f"{result['malformed_records']} malformed records")
+    header = "".join(f"{f'p{p}':>10}" for p in PERCENTILES) + f"{'max':>10}"
+    print(f"{'stage [ms]':>10}{header}" + (f"{'p50 vs ref':>12}" if reference else ""))
+    for stage, stats in result["stages"].items():
+        line = f"{stage:>10}" + "".join(f"{stats[f'p{p}_ms']:>10.3f}" for p in PERCENTILES) + f"{stats['max_ms']:>10.3f}"
+        if reference and stage in reference["stages"]:
+            line += f"{stats['p50_ms']/max(reference['stages'][stage]['p50_ms'], 1e-9):>11.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, nargs="+", default=[10, 100, 500], help="sensors per device")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--polls", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0., help="time between polls [s], 0 polls back to back")
+    parser.add_argument("--delay", type=float, default=0., help="response delay of the devices [s]")
+    parser.add_argument("--jitter", type=float, default=0., help="additional random delay of up to this [s]")
+    parser.add_argument("--chunk-size", type=int, default=None, help="send responses in pieces of this many bytes")
+    parser.add_argument("--malformed", type=float, default=0., help="fraction of malformed records")
+    parser.add_argument("--partial", type=float, default=0., help="fraction of readouts cut off")
+    parser.add_argument("--timeout", type=float, default=1., help="readout timeout of the reader [s]")
+    parser.add_argument("--pty", action="store_true", help="simulate the devices behind pseudo-terminals opened with pyserial")
+    parser.add_argument("--no-plot", action="store_true", help="skip the plot stage, which needs Qt")
+    parser.add_argument("--json", default=None, help="save the results to this file")
+    parser.add_argument("--compare", default=None, help="results of an earlier run to compare with")
+    args = parser.parse_args()
+    widget_factory, app = None, None
+    if not args.no_plot:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt5.QtWidgets import QApplication
+        app = QApplication([])
+        from htmon import HTMonitorWidget
+        def CreateWidget():
+            widget = HTMonitorWidget(max_samples=None)
+            widget.resize(1200, 500)
+            widget.show()
+            return widget
+        widget_factory = CreateWidget
+    references = {}
+    if args.compare is not None:
+        with open(args.compare) as f:
+            references = {(r_["sensors"], r_["devices"]):r_ for r_ in json.load(f)["results"]}
+    results = []
+    for n_sensors in args.sensors:
+        widget = None if widget_factory is None else widget_factory()
+        result = RunCase(args, n_sensors, widget, app)
+        if widget is not None:
+            widget.close()
+        PrintResult(result, references.get((n_sensors, args.devices)))
+        results.append(result)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"metadata":Metadata(args), "results":results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
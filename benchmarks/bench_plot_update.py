@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Per-update plotting latency as a function of history length.
+Compares the old behaviour of UpdatePlots (axes.clear() and re-plotting the
+full history) with the incremental mode (persistent lines and blitting).
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/bench_plot_update.py
+"""
+import argparse
+from time import perf_counter
+import numpy as np
+
+def FullReplot(widget):
+    """ Reference implementation of the old UpdatePlots """
+    for plot, column in ((widget.temperaturePlot, 'T'), (widget.humidityPlot, 'RH')):
+        plot.axes.clear()
+        st_time, end_time = widget.sensor_data.TimeRange()
+        for sensor in widget.sensor_data:
+            plot.axes.plot(widget.sensor_data.Get(sensor, 'time') - st_time,
+                    widget.sensor_data.Get(sensor, column), label = f"Sensor {sensor}")
+        plot.axes.legend(fontsize=6)
+        plot.draw()
+
+def Measure(widget, app, update, n_history, n_sensors, n_updates):
+    t0 = 1.7e9
+    for s_ in range(n_sensors):
+        t = t0 + 5.*np.arange(n_history)
+        widget.sensor_data.Append(str(s_), t, np.random.normal(20, 1, n_history), np.random.normal(40, 3, n_history))
+    update()
+    app.processEvents()
+    latencies = []
+    for i in range(n_updates):
+        t_new = t0 + 5.*(n_history + i)
+        for s_ in range(n_sensors):
+            widget.sensor_data.Append(str(s_), t_new, np.random.normal(20, 1), np.random.normal(40, 3))
+        start = perf_counter()
+        update()
+        app.processEvents()
+        latencies.append(perf_counter() - start)
+    return np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, default=5)
+    parser.add_argument("--updates", type=int, default=20)
+    parser.add_argument("--history", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    args = parser.parse_args()
+
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication([])
+    from htmon import HTMonitorWidget
+    def NewWidget():
+        widget = HTMonitorWidget(max_samples=None)
+        widget.resize(1200, 500)
+        widget.show()
+        return widget
+    print(f"{'history':>10} {'full [ms]':>12} {'incremental [ms]':>18}")
+    for n_history in args.history:
+        widget = NewWidget()
+        full = Measure(widget, app, lambda: FullReplot(widget), n_history, args.sensors, args.updates)
+        widget.close()
+        widget = NewWidget()
+        incremental = Measure(widget, app, widget.UpdatePlots, n_history, args.sensors, args.updates)
+        widget.close()
+        print(f"{n_history:>10d} {1e3*np.median(full):>12.2f} {1e3*np.median(incremental):>18.2f}")
+
+if __name__ == "__main__":
+    main()
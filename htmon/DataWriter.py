@@ -0,0 +1,255 @@
+import os
+import gzip
+import zlib
+import queue
+import logging
+import threading
+import numpy as np
+from time import time, strftime, localtime
+from htmon.RunFile import BinaryFile, SampleRecords, EventRecords, SampleFileName, EventFileName, SAMPLE_DTYPE, EVENT_DTYPE
+
+logger = logging.getLogger(__name__)
+
+ROW_FORMAT = "%0.2f,%0.2f,%0.2f\n"
+FORMATS = ("csv", "bin")
+
+def FormatRows(times, T, RH, row_format=ROW_FORMAT):
+    """ Formats CSV rows with a single string operation """
+    values = np.empty((len(times), 3))
+    values[:,0] = times
+    values[:,1] = T
+    values[:,2] = RH
+    return (row_format*len(times)) % tuple(values.ravel().tolist())
+
+def GzipChunks(path, chunk_size=1 << 20):
+    """
+    Decompressed data of a gzip file with any number of members (every reopening in append mode adds one).
+    Everything readable is yielded first, then EOFError is raised if the file is truncated or corrupt.
+    """
+    with open(path, "rb") as file:
+        decompressor = zlib.decompressobj(31)
+        in_member = False
+        while data := file.read(chunk_size):
+            while data:
+                try:
+                    yield decompressor.decompress(data)
+                except zlib.error as error:
+                    raise EOFError(f"{path} is corrupt: {error}") from error
+                in_member = True
+                if not decompressor.eof:
+                    break
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+                in_member = False
+        if in_member:
+            raise EOFError(f"{path} is truncated")
+
+class OutputFile:
+    """
+    One CSV output file, optionally gzip-compressed, which can be rotated.
+    When an existing file is reopened (e.g. after a crash), an incomplete last line
+    is cut off, so that new rows start on a line of their own.
+    """
+    def __init__(self, path, header, compress=False):
+        """ path has to end with .csv """
+        self.path = path + (".gz" if compress else "")
+        self.header = header
+        self.compress = compress
+        self.file = None
+        self.Open()
+    def Open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self.TrimPartialLine()
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        if self.compress:
+            self.file = gzip.open(self.path, "at")
+        else:
+            self.file = open(self.path, "a")
+        self.opened = time()
+        self.bytes_written = 0
+        if new:
+            self.Write(self.header)
+    def TrimPartialLine(self):
+        if self.compress:
+            self.TrimCompressed()
+            return
+        with open(self.path, "r+b") as file:
+            size = end = file.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - 4096)
+                file.seek(start)
+                i = file.read(end - start).rfind(b"\n")
+                if i >= 0:
+                    end = start + i + 1
+                    break
+                end = start
+            if end < size:
+                file.truncate(end)
+    def TrimCompressed(self):
+        """ A truncated gzip stream can not be appended to, the complete lines are written to a new file """
+        size = keep = 0
+        complete = True
+        try:
+            for chunk in GzipChunks(self.path):
+                i = chunk.rfind(b"\n")
+                if i >= 0:
+                    keep = size + i + 1
+                size += len(chunk)
+        except EOFError:
+            complete = False
+        if complete and keep == size:
+            return
+        if keep == 0:
+            os.unlink(self.path)
+            return
+        partial = self.path + ".partial"
+        written = 0
+        with gzip.open(partial, "wb") as file:
+            chunks = GzipChunks(self.path)
+            while written < keep:
+                chunk = next(chunks)[:keep - written]
+                file.write(chunk)
+                written += len(chunk)
+            chunks.close()
+        os.replace(partial, self.path)
+    def Write(self, text):
+        self.file.write(text)
+        self.bytes_written += len(text)
+    def Flush(self, fsync=False):
+        self.file.flush()
+        if fsync:
+            fileobj = self.file.buffer.fileobj if self.compress else self.file
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+    def Rotate(self):
+        """ Moves the current file aside with a time stamp and starts a new one """
+        self.file.close()
+        ext = ".csv.gz" if self.compress else ".csv"
+        stamp = strftime("%Y%m%d-%H%M%S", localtime(self.opened))
+        target = f"{self.path[:-len(ext)]}.{stamp}{ext}"
+        n = 1
+        while os.path.exists(target):
+            target = f"{self.path[:-len(ext)]}.{stamp}-{n}{ext}"
+            n += 1
+        os.replace(self.path, target)
+        self.Open()
+    def Close(self):
+        self.file.close()
+
+class DataWriter:
+    """
+    Writes sensor data and manual events to CSV files from a background thread.
+    Rows are handed over through a queue, collected into batches and formatted
+    with a single string operation per batch. Files are flushed every
+    ``flush_interval`` seconds (with os.fsync if ``fsync`` is set) and rotated
+    when they exceed ``rotate_bytes`` or get older than ``rotate_seconds``.
+    With ``compress`` the files are written as gzip streams.
+    ``formats`` selects CSV text files ("csv") and/or the binary run format ("bin",
+    see RunFile), which is not rotated.
+    """
+    def __init__(self, outdir, flush_interval=5., fsync=False, rotate_bytes=None, rotate_seconds=None, compress=False,
+            formats=("csv", "bin")):
+        unknown = [f_ for f_ in formats if f_ not in FORMATS]
+        if unknown:
+            raise ValueError(f"Unknown output format(s) {', '.join(unknown)}, expected {', '.join(FORMATS)}")
+        self.outdir = outdir
+        self.formats = formats
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.queue = queue.Queue()
+        self.files = {}
+        self.thread = None
+        self.error = None
+    def Start(self):
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+    def Stop(self):
+        """ Writes everything that was queued and closes the files """
+        if self.thread is None:
+            return
+        self.queue.put(("stop",))
+        self.thread.join()
+        self.thread = None
+    def WriteRows(self, sensor, times, T, RH):
+        """ Queues rows of a sensor. Arrays are copied, so views of the sample store can be passed """
+        if len(times) > 0:
+            self.queue.put(("rows", sensor, np.array(times, dtype=np.float64), np.array(T), np.array(RH)))
+    def WriteEvent(self, time_, name, description=""):
+        self.queue.put(("event", time_, name, description))
+    def Flush(self):
+        self.queue.put(("flush",))
+    def File(self, fmt, key):
+        if (fmt, key) not in self.files:
+            if fmt == "bin" and key == "events":
+                file = BinaryFile(EventFileName(self.outdir), EVENT_DTYPE)
+            elif fmt == "bin":
+                file = BinaryFile(SampleFileName(self.outdir, key), SAMPLE_DTYPE)
+            elif key == "events":
+                file = OutputFile(f"{self.outdir}/events.csv", "time,name,description\n", self.compress)
+            else:
+                file = OutputFile(f"{self.outdir}/sensor_{key}.csv", "time,T,RH\n", self.compress)
+            self.files[(fmt, key)] = file
+        return self.files[(fmt, key)]
+    def WriteBatch(self, fmt, key, batch):
+        file = self.File(fmt, key)
+        if key == "events":
+            if fmt == "csv":
+                file.Write("".join(f"{time_:0.2f},{name},{description}\n" for time_, name, description in batch))
+            else:
+                file.Write(EventRecords(*zip(*batch)))
+            return
+        times, T, RH = (np.concatenate(c) for c in zip(*batch))
+        if fmt == "csv":
+            file.Write(FormatRows(times, T, RH))
+        else:
+            file.Write(SampleRecords(times, T, RH))
+        if fmt == "csv" and ((self.rotate_bytes is not None and file.bytes_written > self.rotate_bytes) or
+                (self.rotate_seconds is not None and time() - file.opened > self.rotate_seconds)):
+            file.Rotate()
+    def Run(self):
+        last_flush = time()
+        running = True
+        while running:
+            try:
+                items = [self.queue.get(timeout=max(0.01, last_flush + self.flush_interval - time()))]
+            except queue.Empty:
+                items = []
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = {}
+            flush = False
+            for item in items:
+                if item[0] == "rows":
+                    rows.setdefault(item[1], []).append(item[2:])
+                elif item[0] == "event":
+                    rows.setdefault("events", []).append(item[1:])
+                elif item[0] == "flush":
+                    flush = True
+                elif item[0] == "stop":
+                    running = False
+                    flush = True
+            try:
+                for key, batch in rows.items():
+                    for fmt in self.formats:
+                        self.WriteBatch(fmt, key, batch)
+                if flush or time() >= last_flush + self.flush_interval:
+                    for file in self.files.values():
+                        file.Flush(self.fsync)
+                    last_flush = time()
+            except Exception as error:
+                # Reported to the GUI thread, which can not be reached from here; the thread keeps draining the queue
+                logger.exception("Could not write output to %s", self.outdir)
+                self.error = error
+        for file in self.files.values():
+            try:
+                file.Close()
+            except Exception as error:
+                logger.exception("Could not close %s", file.path)
+                self.error = error
+        self.files = {}
@@ -0,0 +1,135 @@
+import numpy as np
+from htmon.SampleStore import ColumnBuffer
+
+class MinMaxPyramid:
+    """
+    Min/max decimation pyramid of a single sensor.
+    Level k groups ``factor**(k+1)`` raw samples into one bin and keeps the bin start/end
+    time together with the minimum and maximum of every column and the times at which they
+    occurred. Every bin is later drawn as two points, so short spikes stay visible at
+    any zoom level.
+    Levels are built incrementally: only complete groups of the level below are
+    reduced, and the rest waits for the next update.
+    """
+    def __init__(self, columns=('T', 'RH'), factor=4, capacity=None):
+        self.columns = columns
+        self.factor = factor
+        self.capacity = capacity
+        self.dtypes = {'t':np.float64, 't_end':np.float64}
+        for c in columns:
+            self.dtypes.update({f'{c}_lo':np.float32, f'{c}_lo_t':np.float64, f'{c}_hi':np.float32, f'{c}_hi_t':np.float64})
+        self.levels = [] # ColumnBuffer per level
+        self.done = [] # done[k]: absolute index in the source of level k up to which it was reduced
+    def AddLevel(self):
+        capacity = None
+        if self.capacity is not None:
+            capacity = max(2, self.capacity // self.factor**(len(self.levels)+1) + 2)
+        self.levels.append(ColumnBuffer(self.dtypes, capacity=capacity, initial_size=64))
+        self.done.append(0)
+    def BinSize(self, level):
+        return self.factor**(level+1)
+    def Update(self, source):
+        """ source is the ColumnBuffer with raw samples (columns 'time' and self.columns) """
+        f = self.factor
+        if len(self.levels) == 0:
+            self.AddLevel()
+        first = max(self.done[0], source.first_index)
+        n = (source.total - first)//f*f
+        if n > 0:
+            t = source.View('time', first, first+n).reshape(-1, f)
+            bins = {'t':t[:,0], 't_end':t[:,-1]}
+            for c in self.columns:
+                v = source.View(c, first, first+n).reshape(-1, f)
+                i_lo = np.argmin(v, axis=1)[:,None]
+                i_hi = np.argmax(v, axis=1)[:,None]
+                bins[f'{c}_lo'] = np.take_along_axis(v, i_lo, axis=1)[:,0]
+                bins[f'{c}_lo_t'] = np.take_along_axis(t, i_lo, axis=1)[:,0]
+                bins[f'{c}_hi'] = np.take_along_axis(v, i_hi, axis=1)[:,0]
+                bins[f'{c}_hi_t'] = np.take_along_axis(t, i_hi, axis=1)[:,0]
+            self.levels[0].Append(**bins)
+            self.done[0] = first + n
+        k = 0
+        while k < len(self.levels):
+            lower = self.levels[k]
+            if k+1 == len(self.levels):
+                if len(lower) < 2*f:
+                    break
+                self.AddLevel()
+            first = max(self.done[k+1], lower.first_index)
+            n = (lower.total - first)//f*f
+            if n > 0:
+                view = lambda name: lower.View(name, first, first+n).reshape(-1, f)
+                bins = {'t':view('t')[:,0], 't_end':view('t_end')[:,-1]}
+                for c in self.columns:
+                    for side, reduce_ in (('lo', np.argmin), ('hi', np.argmax)):
+                        v = view(f'{c}_{side}')
+                        i_ = reduce_(v, axis=1)[:,None]
+                        bins[f'{c}_{side}'] = np.take_along_axis(v, i_, axis=1)[:,0]
+                        bins[f'{c}_{side}_t'] = np.take_along_axis(view(f'{c}_{side}_t'), i_, axis=1)[:,0]
+                self.levels[k+1].Append(**bins)
+                self.done[k+1] = first + n
+            k += 1
+    def BinPoints(self, level, column, first=None, t_min=-np.inf, t_max=np.inf):
+        """ Bins of a level (starting at absolute index first) within [t_min, t_max] as (time, value) points """
+        buf = self.levels[level]
+        t = buf.View('t', first)
+        t_end = buf.View('t_end', first)
+        i0 = np.searchsorted(t_end, t_min, side='left')
+        i1 = np.searchsorted(t, t_max, side='right')
+        offset = buf.total - len(t)
+        sl = lambda name: buf.View(name, offset+i0, offset+max(i0, i1))
+        lo, lo_t, hi, hi_t = sl(f'{column}_lo'), sl(f'{column}_lo_t'), sl(f'{column}_hi'), sl(f'{column}_hi_t')
+        lo_first = lo_t <= hi_t
+        times = np.empty(2*len(lo), dtype=np.float64)
+        values = np.empty(2*len(lo), dtype=np.float32)
+        times[0::2] = np.where(lo_first, lo_t, hi_t)
+        times[1::2] = np.where(lo_first, hi_t, lo_t)
+        values[0::2] = np.where(lo_first, lo, hi)
+        values[1::2] = np.where(lo_first, hi, lo)
+        return times, values
+    def Render(self, source, column, t_min=-np.inf, t_max=np.inf, max_points=2000):
+        """
+        Returns (time, value) arrays of a column within [t_min, t_max] with at most about
+        max_points points. Raw data is returned as zero-copy views if it is short enough.
+        Otherwise the finest sufficient level is used, completed with the not yet reduced
+        bins of the lower levels and the newest raw samples.
+        """
+        t_raw = source.View('time')
+        i0 = np.searchsorted(t_raw, t_min, side='left')
+        i1 = np.searchsorted(t_raw, t_max, side='right')
+        if i1 - i0 <= max_points or len(self.levels) == 0:
+            return t_raw[i0:i1], source.View(column)[i0:i1]
+        level = len(self.levels) - 1
+        for k in range(len(self.levels)):
+            if 2*(i1 - i0)/self.BinSize(k) <= max_points:
+                level = k
+                break
+        pieces = [self.BinPoints(level, column, t_min=t_min, t_max=t_max)]
+        for k in range(level-1, -1, -1):
+            pieces.append(self.BinPoints(k, column, first=self.done[k+1], t_min=t_min, t_max=t_max))
+        i_tail = max(self.done[0] - source.first_index, i0)
+        pieces.append((t_raw[i_tail:i1], source.View(column)[i_tail:i1]))
+        return np.concatenate([p[0] for p in pieces]), np.concatenate([p[1] for p in pieces])
+
+class Decimator:
+    """
+    Keeps a MinMaxPyramid for every sensor of a SampleStore, so that plots can be
+    drawn with a number of points given by the plot width rather than by the
+    length of the run.
+    """
+    def __init__(self, store, factor=4):
+        self.store = store
+        self.factor = factor
+        self.pyramids = {}
+    def Update(self):
+        """ Reduces samples added to the store since the last call """
+        for sensor in self.store:
+            if sensor not in self.pyramids:
+                self.pyramids[sensor] = MinMaxPyramid(columns=('T', 'RH'), factor=self.factor, capacity=self.store.max_samples)
+            self.pyramids[sensor].Update(self.store.buffers[sensor])
+    def Render(self, sensor, column, t_min=-np.inf, t_max=np.inf, max_points=2000):
+        if sensor not in self.pyramids:
+            return self.store.Get(sensor, 'time'), self.store.Get(sensor, column)
+        return self.pyramids[sensor].Render(self.store.buffers[sensor], column, t_min, t_max, max_points)
+    def Clear(self):
+        self.pyramids = {}
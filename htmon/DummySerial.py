@@ -1,26 +1,178 @@
+import os
+import select
+import socket
+import threading
 import numpy as np
-from copy import deepcopy
+from time import sleep, time
+
+class SensorSimulator:
+    """
+    Generates readouts of the Arduino protocol for ``n_sensors`` sensors (2 to 5 at random by default).
+    Values of all sensors are drawn at once and formatted with a single string operation.
+    A fraction ``malformed_rate`` of the records is corrupted, and a fraction ``partial_rate``
+    of the readouts is cut off at a random position, as happens when a transfer gets interrupted.
+    """
+    record_format = "%d:T=%0.2fC,RH=%0.2f%%;"
+    def __init__(self, n_sensors=None, malformed_rate=0., partial_rate=0., seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.n_sens = self.rng.integers(2, 6) if n_sensors is None else n_sensors
+        self.mean_t = self.rng.uniform(-3,3, size = self.n_sens)
+        self.mean_h = self.rng.uniform(20,60, size = self.n_sens)
+        self.std_t = self.rng.uniform(0.3,3, size = self.n_sens)
+        self.std_h = self.rng.uniform(0.5,3, size = self.n_sens)
+        self.malformed_rate = malformed_rate
+        self.partial_rate = partial_rate
+        self.n_readouts = 0
+        self.n_malformed = 0
+        self.n_partial = 0
+    def Readout(self):
+        """ One readout line as bytes """
+        values = np.empty((self.n_sens, 3))
+        values[:,0] = np.arange(self.n_sens)
+        values[:,1] = self.rng.normal(self.mean_t, self.std_t)
+        values[:,2] = self.rng.normal(self.mean_h, self.std_h)
+        line = (self.record_format*self.n_sens) % tuple(values.ravel().tolist())
+        if self.malformed_rate > 0:
+            malformed = np.flatnonzero(self.rng.random(self.n_sens) < self.malformed_rate)
+            if len(malformed) > 0:
+                records = line.split(';')
+                for i in malformed:
+                    # Lose the end of the record, e.g. "3:T=21.05C,RH"
+                    records[i] = records[i][:self.rng.integers(1, len(records[i]))]
+                line = ';'.join(records)
+                self.n_malformed += len(malformed)
+        line = line[:-1]
+        if self.partial_rate > 0 and self.rng.random() < self.partial_rate:
+            line = line[:self.rng.integers(0, len(line))]
+            self.n_partial += 1
+        self.n_readouts += 1
+        return (line + "\n").encode()
 
 class DummySerial:
     """
     This is dummy serial class, which is used for testing the GUI without the Arduino.
+    Responses are passed through a socket pair, so that the dummy can be read
+    byte-wise and waited for with select() like a real serial port.
+    A response is sent ``delay`` seconds (plus up to ``jitter`` seconds) after the
+    command, in pieces of ``chunk_size`` bytes if given. After ``start_command`` the
+    dummy streams readouts at ``stream_rate`` per second until ``stop_command``.
+    Other keyword arguments configure the SensorSimulator.
     """
-    def __init__(self, dev = 'dummy', baud = '0'):
-        self.n_sens = np.random.randint(2,6)
-        self.mean_t = np.random.uniform(-3,3, size = self.n_sens)
-        self.mean_h = np.random.uniform(20,60, size = self.n_sens)
-        self.std_t = np.random.uniform(0.3,3, size = self.n_sens) 
-        self.std_h = np.random.uniform(0.5,3, size = self.n_sens) 
-        self.lines = []
+    def __init__(self, dev = 'dummy', baud = '0', command=b'r', delay=0., jitter=0., chunk_size=None,
+            start_command=b's', stop_command=b'x', stream_rate=10., **kwargs):
+        self.simulator = SensorSimulator(**kwargs)
+        self.n_sens = self.simulator.n_sens
+        self.command = command
+        self.delay = delay
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.host, self.device = socket.socketpair()
+        self.host.setblocking(False)
+        self.timers = []
+        self.start_command = start_command
+        self.stop_command = stop_command
+        self.stream_rate = stream_rate
+        self.streaming = threading.Event()
+        self.stream_thread = None
     def write(self, message=''):
-        if message == b'r':
-            outline = ';'.join([f'{i:d}:T={np.random.normal(self.mean_t[i],self.std_t[i]):0.2f}C,RH={np.random.normal(self.mean_h[i],self.std_h[i]):0.2f}%' for i in range(self.n_sens)])
-            outline+="\n"
-            self.lines.append(outline.encode())
-    def readlines(self):
-        output=deepcopy(self.lines)
-        self.lines = []
-        return output
+        if message == self.start_command:
+            self.StartStreaming()
+            return
+        if message == self.stop_command:
+            self.streaming.clear()
+            return
+        if message != self.command:
+            return
+        data = self.simulator.Readout()
+        delay = self.delay + (self.simulator.rng.uniform(0, self.jitter) if self.jitter > 0 else 0.)
+        if delay <= 0 and self.chunk_size is None:
+            self.device.sendall(data)
+            return
+        # Answering must not block the caller, which is the reader thread
+        timer = threading.Timer(delay, self.Send, args=(data,))
+        timer.daemon = True
+        timer.start()
+        self.timers = [t_ for t_ in self.timers if t_.is_alive()] + [timer]
+    def StartStreaming(self):
+        if self.streaming.is_set():
+            return
+        self.streaming.set()
+        self.stream_thread = threading.Thread(target=self.Stream, daemon=True)
+        self.stream_thread.start()
+    def Stream(self):
+        next_time = time()
+        while self.streaming.is_set():
+            self.Send(self.simulator.Readout())
+            next_time += 1./self.stream_rate
+            sleep(max(0., next_time - time()))
+    def Send(self, data):
+        chunk_size = len(data) if self.chunk_size is None else self.chunk_size
+        try:
+            for i in range(0, len(data), chunk_size):
+                self.device.sendall(data[i:i+chunk_size])
+        except OSError:
+            pass # closed in the meantime
+    @property
+    def in_waiting(self):
+        try:
+            return len(self.host.recv(65536, socket.MSG_PEEK))
+        except BlockingIOError:
+            return 0
+    def read(self, size=1):
+        try:
+            return self.host.recv(size)
+        except BlockingIOError:
+            return b''
+    def fileno(self):
+        return self.host.fileno()
     def close(self):
-        pass
-            
\ No newline at end of file
+        for timer in self.timers:
+            timer.cancel()
+        self.streaming.clear()
+        if self.stream_thread is not None:
+            self.stream_thread.join()
+        self.host.close()
+        self.device.close()
+
+class PtySimulator:
+    """
+    Simulated device behind a pseudo-terminal, so that the real serial.Serial code path
+    can be used: open ``port`` like a serial device. Answers every ``command`` byte
+    from a background thread. Keyword arguments configure the SensorSimulator.
+    """
+    def __init__(self, command=b'r', delay=0., **kwargs):
+        self.simulator = SensorSimulator(**kwargs)
+        self.n_sens = self.simulator.n_sens
+        self.command = command
+        self.delay = delay
+        self.master, self.slave = os.openpty()
+        self.port = os.ttyname(self.slave)
+        self.running = False
+        self.thread = None
+    def Start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+    def Stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        os.close(self.master)
+        os.close(self.slave)
+    def Run(self):
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                break
+            for _ in range(data.count(self.command)):
+                if self.delay > 0:
+                    sleep(self.delay)
+                response = self.simulator.Readout()
+                while response:
+                    # The pty buffer is small, long readouts go in several writes
+                    response = response[os.write(self.master, response):]
@@ -0,0 +1,75 @@
+from bisect import bisect_left, bisect_right
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QDateTime
+
+class EventModel(QAbstractTableModel):
+    """
+    Manual events (epoch time, name, description), kept sorted by time.
+    Views and the monitor follow changes through the standard model signals
+    (rowsInserted, rowsRemoved, modelReset), which only carry the affected rows.
+    Times() returns the event times as an array, cached until the next change.
+    """
+    headers = ["Time", "Event", "Description"]
+    time_format = "yyyy-MM-dd HH:mm:ss"
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.times = []
+        self.names = []
+        self.descriptions = []
+        self.time_array = None
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.times)
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        row, column = index.row(), index.column()
+        if column == 0:
+            return QDateTime.fromSecsSinceEpoch(int(self.times[row])).toString(self.time_format)
+        return self.names[row] if column == 1 else self.descriptions[row]
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+    def AddEvent(self, time_, name, description=""):
+        """ Inserts an event at its place in time, after events with the same time. Returns its row """
+        row = bisect_right(self.times, time_)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.times.insert(row, float(time_))
+        self.names.insert(row, name)
+        self.descriptions.insert(row, description)
+        self.time_array = None
+        self.endInsertRows()
+        return row
+    def RemoveRows(self, rows):
+        """ Removes events by row, one signal per contiguous block """
+        rows = sorted(set(rows), reverse=True)
+        while rows:
+            last = first = rows.pop(0)
+            while rows and rows[0] == first - 1:
+                first = rows.pop(0)
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.times[first:last + 1], self.names[first:last + 1], self.descriptions[first:last + 1]
+            self.time_array = None
+            self.endRemoveRows()
+    def SetEvents(self, times, names, descriptions):
+        """ Replaces all events, e.g. when a recorded run is loaded """
+        order = np.argsort(np.asarray(times, dtype=np.float64), kind='stable').tolist()
+        self.beginResetModel()
+        self.times = [float(times[i]) for i in order]
+        self.names = [names[i] for i in order]
+        self.descriptions = [descriptions[i] for i in order]
+        self.time_array = None
+        self.endResetModel()
+    def Event(self, row):
+        return self.times[row], self.names[row], self.descriptions[row]
+    def Range(self, start, end):
+        """ Rows of the events with start <= time <= end, as (first, last + 1) """
+        return bisect_left(self.times, start), bisect_right(self.times, end)
+    def Times(self):
+        if self.time_array is None:
+            self.time_array = np.array(self.times, dtype=np.float64)
+        return self.time_array
+    def __len__(self):
+        return len(self.times)
@@ -1,22 +1,34 @@
 from PyQt5.QtWidgets import (
     QWidget, QLabel, QLineEdit, QPushButton, 
     QVBoxLayout, QHBoxLayout, QGridLayout, 
-    QMessageBox, QFileDialog, QDateTimeEdit, QTableWidgetItem, QTableWidget
+    QMessageBox, QFileDialog, QCheckBox
 )
-import os, sys 
-import re
+import os
+import logging
 import numpy as np
-from PyQt5.QtGui import QIntValidator
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject, QDateTime
-import serial
-import threading
+from PyQt5.QtGui import QIntValidator, QDoubleValidator
+from PyQt5.QtCore import QTimer, pyqtSignal
 from time import time
-from copy import copy 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
+from htmon.SnapshotRenderer import EventMarkers, SetEventMarkers, EventLegend
 
 class PlotWidget(FigureCanvasQTAgg):
+    """
+    Canvas with persistent line artists, updated incrementally.
+    Data lines and the legend are animated artists: on a regular update only
+    the plot area is restored from a cached background and the lines are
+    re-drawn on top of it (blitting). A full redraw is done only when the axes
+    limits, the set of lines or the event markers change.
+    All event markers are one LineCollection, updated in place.
+    By default the x range follows the data. The mouse wheel zooms and dragging pans the
+    time axis, which stops following until a double click; view_changed is emitted so that
+    the data of the new range can be loaded.
+    """
+    view_changed = pyqtSignal()
+    x_headroom = 0.25 # fraction of the x range kept free on the right, to avoid rescaling on every sample
+    y_margin = 0.1
+    zoom_step = 1.25
     def __init__(self, parent=None, width=6, height=4, dpi=100):
         fig = Figure(figsize=(width, height), dpi=dpi)
         self.axes = fig.add_axes([0.12, 0.12, 0.85, 0.85])
@@ -24,28 +36,200 @@ class PlotWidget(FigureCanvasQTAgg):
         self.axes.yaxis.set_tick_params(labelsize=8)
         self.xlabel=None
         self.ylabel=None
+        self.lines = {}
+        self.event_markers = EventMarkers(self.axes)
+        self.event_labels = []
+        self.legend = None
+        self.legend_image = None
+        self.background = None
+        self.needs_full_draw = True
+        self.follow = True
+        self.pan_start = None
         super(PlotWidget, self).__init__(fig)
+        self.setToolTip("Wheel: zoom, drag: pan, double click: follow the data")
+        self.mpl_connect('draw_event', self.OnDraw)
+        self.mpl_connect('scroll_event', self.OnScroll)
+        self.mpl_connect('button_press_event', self.OnPress)
+        self.mpl_connect('motion_notify_event', self.OnMotion)
+        self.mpl_connect('button_release_event', self.OnRelease)
     def SetXYLabels(self, xlabel=None, ylabel=None):
         if not xlabel is None:self.xlabel = xlabel
         if not ylabel is None:self.ylabel = ylabel
         self.axes.set_xlabel(self.xlabel, fontsize=9)
         self.axes.set_ylabel(self.ylabel, fontsize=9)
+    def MaxPoints(self):
+        """ Number of points worth drawing per line: two (min and max) per horizontal pixel """
+        return max(200, 2*int(self.axes.bbox.width))
+    def SetLineData(self, key, x, y, label=None):
+        """ Updates data of a line, creating the line if it does not exist yet """
+        if key not in self.lines:
+            self.lines[key], = self.axes.plot(x, y, label=label, animated=True)
+            self.needs_full_draw = True
+        else:
+            self.lines[key].set_data(x, y)
+    def Clear(self):
+        """ Removes all lines and event markers """
+        for line in self.lines.values():
+            line.remove()
+        self.lines = {}
+        self.SetEvents([], [])
+        self.follow = True
+    def SetEvents(self, positions, labels):
+        """ Replaces the manual event markers """
+        SetEventMarkers(self.event_markers, positions)
+        self.event_labels = labels
+        self.needs_full_draw = True
+    def RescaleIfNeeded(self):
+        """
+        Extends the axes limits if some data is outside of them. Returns True if limits changed.
+        When not following the data, the x range is kept and y is fitted to the visible data.
+        """
+        x_min, x_max, y_min, y_max = np.inf, -np.inf, np.inf, -np.inf
+        xlim = self.axes.get_xlim()
+        for line in self.lines.values():
+            x, y = line.get_xdata(), line.get_ydata()
+            if not self.follow:
+                visible = (x >= xlim[0]) & (x <= xlim[1])
+                x, y = x[visible], y[visible]
+            if len(x) == 0:
+                continue
+            x_min, x_max = min(x_min, x[0]), max(x_max, x[-1])
+            y_min, y_max = min(y_min, np.nanmin(y)), max(y_max, np.nanmax(y))
+        if not np.isfinite(x_min):
+            return False
+        changed = False
+        if self.follow and (self.needs_full_draw or x_min < xlim[0] or x_max > xlim[1]):
+            span = max(x_max - x_min, 1.)
+            self.axes.set_xlim(x_min, x_min + span*(1 + self.x_headroom))
+            changed = True
+        ylim = self.axes.get_ylim()
+        if self.needs_full_draw or y_min < ylim[0] or y_max > ylim[1] or not np.isfinite(y_min):
+            span = max(y_max - y_min, 1.)
+            if np.isfinite(span):
+                self.axes.set_ylim(y_min - span*self.y_margin, y_max + span*self.y_margin)
+            changed = True
+        return changed
+    def Refresh(self, full=False):
+        """ Redraws the plot, using blitting unless a full redraw is needed """
+        full = self.RescaleIfNeeded() or full or self.needs_full_draw or self.background is None
+        if full:
+            self.legend = EventLegend(self.axes, self.event_markers, self.event_labels, fontsize=6)
+            if self.legend is not None:
+                self.legend.set_animated(True)
+            self.needs_full_draw = False
+            self.draw()
+            return
+        self.restore_region(self.background)
+        for line in self.lines.values():
+            self.axes.draw_artist(line)
+        if self.legend_image is not None:
+            # The legend does not change between full redraws: paste its pixels instead of rendering it
+            self.restore_region(self.legend_image)
+        self.blit(self.axes.bbox)
+    def SetView(self, x_min, x_max):
+        """ Shows the x range [x_min, x_max] and stops following the data """
+        self.follow = False
+        self.axes.set_xlim(x_min, x_max)
+        self.needs_full_draw = True
+    def Follow(self):
+        self.follow = True
+        self.needs_full_draw = True
+    def OnScroll(self, event):
+        if event.inaxes is not self.axes or event.xdata is None:
+            return
+        x_min, x_max = self.axes.get_xlim()
+        scale = 1./self.zoom_step if event.button == 'up' else self.zoom_step
+        self.SetView(event.xdata - (event.xdata - x_min)*scale, event.xdata + (x_max - event.xdata)*scale)
+        self.draw_idle()
+        self.view_changed.emit()
+    def OnPress(self, event):
+        if event.inaxes is not self.axes or event.button != 1:
+            return
+        if event.dblclick:
+            self.Follow()
+            self.view_changed.emit()
+            return
+        self.pan_start = (event.x, self.axes.get_xlim())
+    def OnMotion(self, event):
+        if self.pan_start is None or event.x is None:
+            return
+        x_pixel, (x_min, x_max) = self.pan_start
+        shift = (event.x - x_pixel)*(x_max - x_min)/self.axes.bbox.width
+        self.SetView(x_min - shift, x_max - shift)
+        # The lines loaded so far are shown while dragging, the range is reloaded on release
+        self.draw_idle()
+    def OnRelease(self, event):
+        if self.pan_start is None:
+            return
+        moved = self.axes.get_xlim() != self.pan_start[1]
+        self.pan_start = None
+        if moved:
+            self.view_changed.emit()
+    def OnDraw(self, event):
+        """ After every full draw: caches the background and draws animated artists on top """
+        self.background = self.copy_from_bbox(self.axes.bbox)
+        for line in self.lines.values():
+            self.axes.draw_artist(line)
+        self.legend_image = None
+        if self.legend is not None:
+            self.axes.draw_artist(self.legend)
+            self.legend_image = self.copy_from_bbox(self.legend.get_window_extent())
+
 
 
 from htmon.ManualEventWidget import ManualEventWidget
 from htmon.SerialThreadHandler import SerialThreadHandler
-from htmon.DummySerial import DummySerial
+from htmon.SerialReader import DeviceLabels, SensorKey, OpenDevice
+from htmon.SampleStore import SampleStore
+from htmon.Decimator import Decimator
+from htmon.RecordParser import ProtocolParser, RegexParser
+from htmon.DataWriter import DataWriter
+from htmon.RunFile import RunFile
+from htmon.SnapshotRenderer import SnapshotRenderer, PlotSnapshot
+from htmon.Instrumentation import Instrumentation
+from htmon.StatsWidget import StatsWidget
+from htmon.SharedRing import SharedRing, RECORD_DTYPE
+from htmon.StreamReader import StreamReader
+from htmon.OnlineStats import OnlineStats
+from htmon.SensorStatsWidget import SensorStatsWidget
+from htmon.SegmentStore import SegmentStore
+from htmon.MetricsServer import MetricsServer
+
+logger = logging.getLogger(__name__)
 
 class HTMonitorWidget(QWidget):
+    min_update_interval = 1 # [s], the reader returns as soon as the readout is complete
+    stream_frame_rate = 10 # [1/s], plot updates while streaming, whatever the sample rate
+    stream_write_interval = 1. # [s], between hand-overs to the writer while streaming
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, max_samples=1000000, writer_options=None, snapshot_options=None, alarms=(), stats_window=600., history_dir=None,
+            metrics_port=None, metrics_host="127.0.0.1", metrics_window=300., device="/dev/ttyACM0", baud=115200,
+            interval=10, regexp=None, stream=False, frame_rate=10., timeout=5., instrumentation=None):
         super().__init__(parent=parent)
         self.timer=None
-        self.sensor_data = {}
-        self.manual_events = None 
-        self.outfiles = {}
+        self.sensor_data = SampleStore(max_samples=max_samples, policy="spill", spill_callback=self.SpillSamples)
+        self.decimator = Decimator(self.sensor_data)
+        # Samples evicted from memory are paged out to disk, so that the whole run can still be shown
+        self.history = SegmentStore(history_dir)
+        self.view = None # (t_min, t_max) shown when zoomed, None while following the data
+        self.view_timer = QTimer(self)
+        self.view_timer.setSingleShot(True)
+        self.view_timer.timeout.connect(self.UpdatePlots)
+        self.events_changed = False
+        self.plot_time_base = None
+        self.writer = None
+        self.writer_options = {} if writer_options is None else writer_options
+        self.snapshot_renderer = SnapshotRenderer(**({} if snapshot_options is None else snapshot_options))
+        self.snapshot_renderer.Start()
         self.outdir = None
         self.lines_written = {}
+        self.events_written = set()
+        self.events_pending = []
+        self.replay = None
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.timeout = timeout
+        self.stream_frame_rate = frame_rate
+        self.online_stats = OnlineStats(window=stats_window, alarms=alarms)
         self.serial_thread_handler = SerialThreadHandler(self)
         self.serial_thread_handler.received.connect(self.UpdateData)
         self.setWindowTitle("Humidity/Temperature Monitor")
@@ -54,13 +238,36 @@ class HTMonitorWidget(QWidget):
         self.layout.addLayout(self.CreatePlots() )
         self.layout.addLayout(self.CreateControls() )
         self.setLayout(self.layout)
-        self.SetRegExp()
+        self.input_addr.setText(device)
+        self.input_baud.setText(str(baud))
+        self.updIntervalInput.setText(str(max(self.min_update_interval, int(round(interval)))))
+        self.streamCheckBox.setChecked(stream)
+        self.SetRegExp(regexp)
         self.connected = False
         self.active= False
-        self.serial = None
+        self.serials = {}
+        self.shared_ring = None
+        self.shared_next = 0
+        self.stream_reader = None
+        self.last_write = 0.
+        self.stream_dropped = 0
         self.manualEventsWidget = ManualEventWidget(self)
-        self.manualEventsWidget.events_updated.connect(self.GetEventList)
+        self.event_model = self.manualEventsWidget.model
+        self.event_model.rowsInserted.connect(self.EventsInserted)
+        self.event_model.rowsRemoved.connect(self.EventsChanged)
+        self.event_model.modelReset.connect(self.EventsReset)
+        self.statsWidget = StatsWidget(self.instrumentation, self)
+        self.sensorStatsWidget = SensorStatsWidget(self.online_stats, self)
         self.autosave_timer = None
+        # Latest readings served over HTTP, from a snapshot taken after every update
+        self.metrics = None
+        if metrics_port is not None:
+            self.metrics = MetricsServer(metrics_port, metrics_host, metrics_window)
+            try:
+                self.metrics.Start()
+            except OSError as error:
+                self.metrics = None
+                self.WarnUser(text = f"Could not serve metrics on port {metrics_port}: {error}", title = "ERROR!")
     def CreateSerialControls(self):
         self.label_addr = QLabel("Serial device:")
         self.input_addr = QLineEdit('/dev/ttyACM0')
@@ -75,6 +282,8 @@ class HTMonitorWidget(QWidget):
         self.button_disconnect = QPushButton("Disconnect")
         self.button_disconnect.clicked.connect(self.Disconnect)
         self.button_disconnect.setEnabled(False)
+        self.streamCheckBox = QCheckBox("Stream")
+        self.streamCheckBox.setToolTip("The devices send readouts continuously instead of being polled")
         self.input_addr.returnPressed.connect(self.Connect)
         self.input_baud.returnPressed.connect(self.Connect)
         self.setup_layout = QHBoxLayout()
@@ -82,6 +291,7 @@ class HTMonitorWidget(QWidget):
         self.setup_layout.addWidget(self.input_addr)
         self.setup_layout.addWidget(self.label_baud)
         self.setup_layout.addWidget(self.input_baud)
+        self.setup_layout.addWidget(self.streamCheckBox)
         self.setup_layout.addWidget(self.button_connect)
         self.setup_layout.addWidget(self.button_disconnect)
         return self.setup_layout
@@ -93,12 +303,15 @@ class HTMonitorWidget(QWidget):
         self.humidityPlot.SetXYLabels("Time", "Relative humidity [%]")
         self.plot_layout.addWidget(self.temperaturePlot)
         self.plot_layout.addWidget(self.humidityPlot)
+        self.temperaturePlot.view_changed.connect(lambda: self.ViewChanged(self.temperaturePlot))
+        self.humidityPlot.view_changed.connect(lambda: self.ViewChanged(self.humidityPlot))
         return self.plot_layout
     def SetRegExp(self, regexp=None):
+        """ Without a custom regular expression the fast parser of the standard protocol is used """
         if regexp is None:
-            self.regexp = re.compile('(?P<sensor>[0-9]*):T=(?P<T>[+-]?[0-9]*.?[0-9]*)C,RH=(?P<RH>[+-]?[0-9]*.?[0-9]*)%', re.IGNORECASE)
+            self.parser = ProtocolParser()
         else:
-            self.regexp = re.compile(regexp, re.IGNORECASE)
+            self.parser = RegexParser(regexp)
     def CreateControls(self):
         self.controls_layout = QGridLayout()
         layout_interval = QHBoxLayout()
@@ -113,6 +326,11 @@ class HTMonitorWidget(QWidget):
         layout_interval.addWidget(self.updIntervalButton)
         self.controls_layout.addLayout(layout_interval, 0,0)
         right_layout = QHBoxLayout()
+        self.latencyLabel = QLabel("Round trip: -")
+        right_layout.addWidget(self.latencyLabel)
+        self.alarmLabel = QLabel("")
+        self.alarmLabel.setStyleSheet("color: red")
+        right_layout.addWidget(self.alarmLabel)
         self.buttonUpdate = QPushButton("Update now")
         self.buttonUpdate.clicked.connect(self.RequestMeasurement)
         right_layout.addWidget(self.buttonUpdate)
@@ -121,6 +339,12 @@ class HTMonitorWidget(QWidget):
         self.eventButton = QPushButton("Manual events")
         self.eventButton.clicked.connect(self.ShowManualEvents)
         right_layout.addWidget(self.eventButton)
+        self.statsButton = QPushButton("Statistics")
+        self.statsButton.clicked.connect(lambda: self.statsWidget.show())
+        right_layout.addWidget(self.statsButton)
+        self.sensorStatsButton = QPushButton("Sensor statistics")
+        self.sensorStatsButton.clicked.connect(lambda: self.sensorStatsWidget.show())
+        right_layout.addWidget(self.sensorStatsButton)
         self.controls_layout.addLayout(right_layout, 0,1)
 
         self.fileNameLabel = QLabel("Output:")
@@ -136,42 +360,81 @@ class HTMonitorWidget(QWidget):
         save_layout.addWidget(self.fileNameButton)
         save_layout.addWidget(self.writeOutputButton)
         self.controls_layout.addLayout(save_layout, 1,0, 1,2)
+
+        self.openRunButton = QPushButton("Open run")
+        self.openRunButton.clicked.connect(lambda: self.OpenRun())
+        self.continueRunButton = QPushButton("Continue run")
+        self.continueRunButton.clicked.connect(lambda: self.OpenRun(continue_run=True))
+        self.replaySpeedLabel = QLabel("Replay speed:")
+        self.replaySpeedInput = QLineEdit('10')
+        self.replaySpeedInput.setValidator(QDoubleValidator(0.001, 1e6, 3))
+        self.replaySpeedInput.setFixedWidth(100)
+        self.replaySpeedInput.returnPressed.connect(self.SetReplaySpeed)
+        self.replayButton = QPushButton("Replay run")
+        self.replayButton.clicked.connect(lambda: self.StartReplay())
+        self.stopReplayButton = QPushButton("Stop replay")
+        self.stopReplayButton.clicked.connect(self.StopReplay)
+        self.stopReplayButton.setEnabled(False)
+        run_layout = QHBoxLayout()
+        run_layout.addWidget(self.openRunButton)
+        run_layout.addWidget(self.continueRunButton)
+        run_layout.addWidget(self.replaySpeedLabel)
+        run_layout.addWidget(self.replaySpeedInput)
+        run_layout.addWidget(self.replayButton)
+        run_layout.addWidget(self.stopReplayButton)
+        self.controls_layout.addLayout(run_layout, 2,0, 1,2)
         ###
         return self.controls_layout
     def SetUpdateInterval(self):
         interval = int(self.updIntervalInput.text())
+        if self.stream_reader is not None:
+            self.WarnUser(text = "Streaming devices set the rate themselves", title = "ERROR!")
+            return
         if not self.connected:
             self.WarnUser(text = "Not connected to serial device", title = "ERROR!")
             self.updIntervalInput.setText("10")
             return
-        if interval < 5:
-            interval=5
+        if interval < self.min_update_interval:
+            interval=self.min_update_interval
             self.WarnUser(text = "Update interval is too small", title = "ERROR!")
-            self.updIntervalInput.setText("5")
+            self.updIntervalInput.setText(f"{self.min_update_interval}")
             return
         self.timer.setInterval(interval*1000)
 
     def Connect(self):
-        address = self.input_addr.text()
-        baud = self.input_baud.text()
-        if address == "dummy":
-            self.serial = DummySerial()
-        elif not os.path.exists(address):
-            self.WarnUser(text = "Serial device does not exist", title = "ERROR!")
+        # Several devices can be given as a comma-separated list
+        addresses = [a_.strip() for a_ in self.input_addr.text().split(',') if a_.strip() != ""]
+        if len(addresses) == 1 and addresses[0].startswith("shm:"):
+            self.Attach(addresses[0][len("shm:"):])
             return
-        else:
-            try:
-                self.serial = serial.Serial(address, baud, timeout = 5)
-            except Exception as error:
-                print("An exception occurred:", error) # An exception occurred: division by zero:
-                self.button_connect.setEnabled(True)
-                self.button_disconnect.setEnabled(False)
-                self.WarnUser(text = "Could not connect to serial device", title = "ERROR!")
+        baud = self.input_baud.text()
+        self.serials = {}
+        for label, address in zip(DeviceLabels(addresses), addresses):
+            if address != "dummy" and not os.path.exists(address):
+                self.CloseSerials()
+                self.WarnUser(text = f"Serial device {address} does not exist", title = "ERROR!")
                 return
+            else:
+                try:
+                    self.serials[label] = OpenDevice(address, baud)
+                except Exception as error:
+                    logger.error("Could not open %s: %s", address, error)
+                    self.CloseSerials()
+                    self.button_connect.setEnabled(True)
+                    self.button_disconnect.setEnabled(False)
+                    self.WarnUser(text = f"Could not connect to serial device {address}", title = "ERROR!")
+                    return
+        if len(self.serials) == 0:
+            self.WarnUser(text = "No serial device given", title = "ERROR!")
+            return
         self.button_connect.setEnabled(False)
         self.button_disconnect.setEnabled(True)
         self.connected = True
         self.active = False
+        if self.streamCheckBox.isChecked():
+            self.StartStream()
+            return
+        self.serial_thread_handler.Start(self.serials, timeout=self.timeout)
         self.RequestMeasurement()
         self.timer = QTimer()
         self.timer.timeout.connect(self.RequestMeasurement)
@@ -179,95 +442,394 @@ class HTMonitorWidget(QWidget):
         #self.update_timer = QTimer()
         #self.update_timer.timeout.connect(self.UpdateData)
 
+    def StartStream(self):
+        """ Reads continuously streamed readouts; plots and output are updated at a fixed rate """
+        self.stream_reader = StreamReader(self.serials)
+        self.stream_dropped = 0
+        self.stream_reader.Start()
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.UpdateStream)
+        self.timer.start(int(1000/self.stream_frame_rate))
+    def UpdateStream(self):
+        """ Ingests everything which arrived since the last frame """
+        chunks = self.stream_reader.Drain()
+        for device, arrival_time, lines in chunks:
+            self.IngestLines(device, lines, arrival_time)
+        n_dropped = self.stream_reader.n_dropped
+        if n_dropped > self.stream_dropped:
+            self.instrumentation.Count("dropped lines", n_dropped - self.stream_dropped)
+            self.stream_dropped = n_dropped
+        if len(chunks) == 0:
+            return
+        self.PublishMetrics()
+        self.latencyLabel.setText(f"Streaming: {self.stream_reader.n_lines} lines, dropped: {n_dropped}, "
+                f"malformed records: {self.parser.n_malformed}")
+        with self.instrumentation.Stage("plot"):
+            self.UpdatePlots()
+        if not (self.outdir is None) and time() >= self.last_write + self.stream_write_interval:
+            self.last_write = time()
+            with self.instrumentation.Stage("write"):
+                self.WriteData()
+    def Attach(self, name):
+        """
+        Shows the samples of an acquisition process (htmongui --headless --shared-memory NAME)
+        instead of polling serial devices. The acquisition keeps its schedule and writes the
+        samples itself, whatever happens in this window; several windows can attach to it.
+        """
+        try:
+            self.shared_ring = SharedRing.Attach(name)
+        except (FileNotFoundError, ValueError) as error:
+            self.WarnUser(text = f"Could not attach to acquisition {name}: {error}", title = "ERROR!")
+            return
+        self.input_addr.setText(f"shm:{name}")
+        # Start with the history still in the ring
+        self.shared_next = max(0, self.shared_ring.write_index - self.shared_ring.capacity)
+        self.button_connect.setEnabled(False)
+        self.button_disconnect.setEnabled(True)
+        self.connected = True
+        self.ReadShared()
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.ReadShared)
+        self.timer.start(int(self.updIntervalInput.text())*1000)
+    def ReadShared(self):
+        """ Takes the new samples from the shared ring buffer """
+        with self.instrumentation.Stage("read"):
+            segments, end, n_lost = self.shared_ring.Read(self.shared_next)
+            names = self.shared_ring.SensorNames()
+            # The records are copied out of the ring first; those the writer overwrote meanwhile are dropped
+            records = np.concatenate(segments) if segments else np.empty(0, dtype=RECORD_DTYPE)
+            n_overwritten = min(len(records), self.shared_ring.Overwritten(self.shared_next + n_lost))
+            records = records[n_overwritten:]
+            n_lost += n_overwritten
+            if len(records) > 0:
+                self.IngestSamples(names[records['sensor']], records['time'], records['T'], records['RH'])
+        if n_lost > 0:
+            self.instrumentation.Count("lost samples", n_lost)
+            logger.warning("%d samples were overwritten in the shared ring buffer before they were read", n_lost)
+        self.shared_next = end
+        if len(records) > 0:
+            self.ProcessNewData()
+        if self.shared_ring.closed:
+            self.Disconnect()
+            self.WarnUser(text = "The acquisition process stopped", title = "WARNING! ")
     def RequestMeasurement(self):
         #print("RequestMeasurement called")
+        if self.shared_ring is not None:
+            self.ReadShared()
+            return
+        if self.stream_reader is not None:
+            self.UpdateStream()
+            return
         if self.active: 
-            print("WARNING: UpdateData called while active")
+            self.instrumentation.Count("skipped polls (active)")
+            logger.warning("RequestMeasurement called while active")
             return 
         if not self.connected: 
-            print("WARNING: UpdateData called while not connected")
-            return
-        if not self.serial_thread_handler.GetStatus() == "idle":
-            print("WARNING: UpdateData called while serial thread is busy")
+            self.instrumentation.Count("skipped polls (not connected)")
+            logger.warning("RequestMeasurement called while not connected")
             return
         self.active = True
+        if not self.serial_thread_handler.RequestMeasurement():
+            # Happens on every poll while a device is slow, so it is counted rather than reported each time
+            self.instrumentation.Count("skipped polls (busy)")
+            logger.debug("RequestMeasurement called while serial thread is busy")
+            self.active = False
+            return
         self.buttonUpdate.setEnabled(False)
-        self.measure_time = time()
-        threading.Thread(target=self.serial_thread_handler.ListenForRepsonce, args=(self.serial,)).start()
-        #self.update_timer.start(100)
-        #self.UpdateData()
         self.active = False
     def UpdateData(self):
         #print ("UpdateData called")
-        if not self.serial_thread_handler.GetStatus() == "received":
+        n_received = 0
+        while (measurement := self.serial_thread_handler.GetResponce()) is not None:
+            response = measurement.lines
+            logger.debug("Serial response: %s", response)
+            self.buttonUpdate.setEnabled(True)
+            self.instrumentation.Record("round trip", max(measurement.latency.values()))
+            if not measurement.complete:
+                self.instrumentation.Count("incomplete readouts")
+            if sum(len(lines) for lines in response.values()) == 0:
+                self.instrumentation.Count("empty readouts")
+                logger.warning("No responce received")
+                continue
+            self.measure_time = measurement.request_time
+            for device, lines in response.items():
+                self.IngestLines(device, lines, self.measure_time)
+            self.latencyLabel.setText(f"Round trip: {1e3*max(measurement.latency.values()):0.0f} ms, "
+                    f"malformed records: {self.parser.n_malformed}")
+            n_received += 1
+        if n_received == 0:
             return
-        #self.update_timer.stop()
-        response = self.serial_thread_handler.GetResponce()
-        print("Serial response: ", response)
-        self.buttonUpdate.setEnabled(True)
-        if len(response) == 0:
-            print("WARNING: No responce received")
-            return
-        self.active = False
-        for l_ in response:
-            for iter in self.regexp.finditer(l_.decode('utf-8')):
-                sensor = iter.group('sensor')
-                if sensor not in self.sensor_data:
-                    self.sensor_data[sensor] = {'T':[], 'RH':[], 'time':[]}
-                self.sensor_data[sensor]['T'].append(float(iter.group('T')))
-                self.sensor_data[sensor]['RH'].append(float(iter.group('RH')))
-                self.sensor_data[sensor]['time'].append(self.measure_time)
-            l_.decode('utf-8')
+        self.ProcessNewData()
+    def IngestLines(self, device, lines, time_):
+        """ Parses lines of a device and stores them with the given time stamp """
+        with self.instrumentation.Stage("parse"):
+            records = self.parser.Parse(lines)
+        self.instrumentation.Count("malformed records", records.n_malformed)
+        with self.instrumentation.Stage("store"):
+            self.IngestSamples(SensorKey(device, records.sensors, len(self.serials)), time_, records.T, records.RH)
+    def IngestSamples(self, sensors, times, T, RH):
+        """ Common entry point of new samples, from serial readouts as well as from replays """
+        self.sensor_data.AppendBatch(sensors, times, T, RH)
+        if self.metrics is not None:
+            self.metrics.Append(sensors, times, T, RH)
+        with self.instrumentation.Stage("stats"):
+            alarm_events = self.online_stats.Update(sensors, times, T, RH)
+        if alarm_events:
+            self.instrumentation.Count("alarms", sum(e_.active for e_ in alarm_events))
+            active = self.online_stats.ActiveAlarms()
+            self.alarmLabel.setText("" if len(active) == 0 else
+                    "Alarms: " + ", ".join(f"{alarm} ({sensor})" for sensor, alarm in active[:3]) + (" ..." if len(active) > 3 else ""))
+    def ProcessNewData(self):
         #print(self.sensor_data)
-        self.UpdatePlots()
+        self.PublishMetrics()
+        with self.instrumentation.Stage("plot"):
+            self.UpdatePlots()
         #print(self.outdir)
         if not (self.outdir is None):
-            self.WriteData()
+            with self.instrumentation.Stage("write"):
+                self.WriteData()
+    def PublishMetrics(self):
+        if self.metrics is not None:
+            with self.instrumentation.Stage("metrics"):
+                self.metrics.Publish(self.online_stats, self.instrumentation.counters)
+    def ClearData(self):
+        self.sensor_data.Clear()
+        self.decimator.Clear()
+        self.history.Clear()
+        self.view = None
+        self.online_stats.Clear()
+        if self.metrics is not None:
+            self.metrics.Clear()
+        self.alarmLabel.setText("")
+        self.plot_time_base = None
+        self.temperaturePlot.Clear()
+        self.humidityPlot.Clear()
+    def StopOutput(self):
+        if self.autosave_timer is not None:
+            self.autosave_timer.stop()
+            self.autosave_timer = None
+        if self.writer is not None:
+            self.writer.Stop()
+            self.writer = None
+        self.outdir = None
+        self.fileNameField.setText("<no file selected>")
+    def SelectRun(self):
+        run_dir = QFileDialog.getExistingDirectory(self, "Select run folder", os.getcwd())
+        if run_dir == "":
+            return None
+        try:
+            return RunFile(run_dir)
+        except (ValueError, OSError) as error:
+            self.WarnUser(text = f"Could not open run: {error}", title = "ERROR!")
+            return None
+    def LoadRunEvents(self, run):
+        self.manualEventsWidget.SetEvents(*run.Events())
+    def OpenRun(self, run=None, continue_run=False):
+        """
+        Loads a run written in the binary format. With continue_run, new data is appended
+        to the same run, e.g. to continue after a crash.
+        """
+        if self.connected or self.replay is not None:
+            self.WarnUser(text = "Disconnect or stop the replay first", title = "ERROR!")
+            return
+        if run is None:
+            run = self.SelectRun()
+            if run is None:
+                return
+        self.StopOutput()
+        self.ClearData()
+        for sensor in run.sensors:
+            records = run.Samples(sensor)
+            self.sensor_data.Append(sensor, records['time'], records['T'], records['RH'])
+        self.LoadRunEvents(run)
+        if continue_run:
+            self.StartOutput(run.run_dir, continue_run=True)
+        self.UpdatePlots()
+    def StartReplay(self, run=None):
+        """ Feeds a recorded run through IngestSamples, with the speed given in the replay speed field """
+        if self.connected or self.replay is not None:
+            self.WarnUser(text = "Disconnect or stop the replay first", title = "ERROR!")
+            return
+        if run is None:
+            run = self.SelectRun()
+            if run is None:
+                return
+        # Replayed samples must not end up in the output of the live acquisition
+        self.StopOutput()
+        self.ClearData()
+        self.LoadRunEvents(run)
+        self.replay = run.Timeline()
+        if len(self.replay[1]) == 0:
+            self.replay = None
+            return
+        self.replay_index = 0
+        self.replay_speed = float(self.replaySpeedInput.text())
+        self.replay_start = (time(), self.replay[1][0])
+        self.replay_timer = QTimer()
+        self.replay_timer.timeout.connect(self.ReplayStep)
+        self.replay_timer.start(100)
+        self.replayButton.setEnabled(False)
+        self.stopReplayButton.setEnabled(True)
+    def SetReplaySpeed(self):
+        if self.replay is not None:
+            # Continue from the current replay position with the new speed
+            self.replay_start = (time(), self.ReplayPosition())
+        self.replay_speed = float(self.replaySpeedInput.text())
+    def ReplayPosition(self):
+        return self.replay_start[1] + (time() - self.replay_start[0])*self.replay_speed
+    def ReplayStep(self):
+        sensors, times, T, RH = self.replay
+        end = np.searchsorted(times, self.ReplayPosition(), side='right')
+        if end > self.replay_index:
+            self.IngestSamples(sensors[self.replay_index:end], times[self.replay_index:end], 
+                    T[self.replay_index:end], RH[self.replay_index:end])
+            self.replay_index = end
+            self.ProcessNewData()
+        if self.replay_index >= len(times):
+            self.StopReplay()
+    def StopReplay(self):
+        if self.replay is None:
+            return
+        self.replay_timer.stop()
+        self.replay = None
+        self.replayButton.setEnabled(True)
+        self.stopReplayButton.setEnabled(False)
 
+    def TimeRange(self):
+        """ (first, last) time of the samples in memory and on disk, None if there are none """
+        ranges = [r_ for r_ in (self.sensor_data.TimeRange(), self.history.TimeRange()) if r_ is not None]
+        if len(ranges) == 0:
+            return None
+        return min(r_[0] for r_ in ranges), max(r_[1] for r_ in ranges)
+    def RenderSensor(self, sensor, column, t_min=-np.inf, t_max=np.inf, max_points=2000):
+        """ Samples of a sensor within [t_min, t_max], decimated to about max_points, from memory and from disk """
+        times, values = self.decimator.Render(sensor, column, t_min, t_max, max_points = max_points)
+        if sensor in self.history:
+            # The history holds the samples older than those in memory
+            in_memory = self.sensor_data.Get(sensor, 'time')
+            upper = min(t_max, in_memory[0]) if len(in_memory) > 0 else t_max
+            if len(in_memory) > 0:
+                # Coarse pyramid levels still hold bins of evicted samples, which come from the history instead
+                recent = times >= in_memory[0]
+                times, values = times[recent], values[recent]
+            if t_min < upper:
+                old_times, old_values = self.history.Render(sensor, column, t_min, upper, max_points)
+                old = old_times < upper
+                times, values = np.concatenate([old_times[old], times]), np.concatenate([old_values[old], values])
+        return times, values
+    def ViewChanged(self, plot):
+        """ A plot was zoomed or panned: the other one follows, and the data of the new range is loaded """
+        if self.plot_time_base is None:
+            return
+        st_time, unit, mult = self.plot_time_base
+        other = self.humidityPlot if plot is self.temperaturePlot else self.temperaturePlot
+        if plot.follow:
+            self.view = None
+            other.Follow()
+        else:
+            x_min, x_max = plot.axes.get_xlim()
+            self.view = (st_time + x_min/mult, st_time + x_max/mult)
+            other.SetView(x_min, x_max)
+            other.draw_idle()
+        # Wheel and drag events come in bursts, the data is loaded once they stop
+        self.view_timer.start(100)
     def UpdatePlots(self):
-        if len(self.sensor_data) == 0:
+        time_range = self.TimeRange()
+        if len(self.sensor_data) == 0 or time_range is None:
             return
-        self.temperaturePlot.axes.clear()
-        self.humidityPlot.axes.clear()
         unit = 's'
         mult = 1.
-        times = {sensor:np.array(self.sensor_data[sensor]['time']) for sensor in self.sensor_data}
-        st_time = min([min(times[sensor]) for sensor in times])
-        max_dur = max([max(times[sensor]) for sensor in times]) - st_time
-        if max_dur > 180:
-            unit = 'min'
-            mult = 1./60.
-        elif max_dur > 10800:
+        st_time, end_time = time_range
+        if self.plot_time_base is not None and self.plot_time_base[0] <= st_time:
+            # Keep the time origin when old samples get evicted from the store
+            st_time = self.plot_time_base[0]
+        t_min, t_max = (-np.inf, np.inf) if self.view is None else self.view
+        max_dur = end_time - st_time if self.view is None else t_max - t_min
+        if max_dur > 10800:
             unit = 'h'
             mult = 1./3600.
+        elif max_dur > 180:
+            unit = 'min'
+            mult = 1./60.
+        # Changing the time origin or unit moves everything, including the event markers
+        full = (st_time, unit, mult) != self.plot_time_base
+        self.plot_time_base = (st_time, unit, mult)
+        self.decimator.Update()
         for sensor in self.sensor_data:
-            self.temperaturePlot.axes.plot( (times[sensor] - st_time)*mult, self.sensor_data[sensor]['T'], label = f"Sensor {sensor}")
-            self.humidityPlot.axes.plot( (times[sensor]- st_time)*mult, self.sensor_data[sensor]['RH'], label = f"Sensor {sensor}")
-        
-        if not (self.manual_events is None):
-            color_cycle = plt.rcParams['axes.prop_cycle']()
-            for i in range(len(self.manual_events["time"])):
-                l_ = self.temperaturePlot.axes.axvline((self.manual_events["time"][i] - st_time)*mult, linestyle = '--', 
-                        label = f"{self.manual_events['name'][i]}", **(next(color_cycle)))
-                self.humidityPlot.axes.axvline((self.manual_events["time"][i] - st_time)*mult, linestyle = '--',
-                        label = f"{self.manual_events['name'][i]}", color = l_.get_color())
-                pass
-        self.temperaturePlot.axes.legend(fontsize=6)
-        self.humidityPlot.axes.legend(fontsize=6)
-        self.temperaturePlot.SetXYLabels(xlabel = f"Time [{unit}]", ylabel = "Temperature [C]")
-        self.humidityPlot.SetXYLabels(xlabel = f"Time [{unit}]", ylabel = "Relative humidity [%]")
-        self.temperaturePlot.draw()
-        self.humidityPlot.draw()
+            for plot, column in ((self.temperaturePlot, 'T'), (self.humidityPlot, 'RH')):
+                times, values = self.RenderSensor(sensor, column, t_min, t_max, max_points = plot.MaxPoints())
+                plot.SetLineData(sensor, (times - st_time)*mult, values, label = f"Sensor {sensor}")
+        if full or self.events_changed:
+            positions, labels = self.EventMarkers()
+            self.temperaturePlot.SetEvents(positions, labels)
+            self.humidityPlot.SetEvents(positions, labels)
+            self.events_changed = False
+        if full and self.view is not None:
+            # Same range in the new time base
+            for plot in (self.temperaturePlot, self.humidityPlot):
+                plot.SetView((t_min - st_time)*mult, (t_max - st_time)*mult)
+        if full:
+            self.temperaturePlot.SetXYLabels(xlabel = f"Time [{unit}]", ylabel = "Temperature [C]")
+            self.humidityPlot.SetXYLabels(xlabel = f"Time [{unit}]", ylabel = "Relative humidity [%]")
+        self.temperaturePlot.Refresh(full)
+        self.humidityPlot.Refresh(full)
+    def EventMarkers(self):
+        """ Positions and labels of the manual events in the current plot time base """
+        if self.plot_time_base is None:
+            return np.array([]), []
+        st_time, unit, mult = self.plot_time_base
+        # Events before the time origin are drawn too, they can be reached by panning
+        return (self.event_model.Times() - st_time)*mult, list(self.event_model.names)
+    def PlotSnapshots(self):
+        """ Copies of the plotted data, decimated for the export resolution """
+        if self.plot_time_base is None:
+            return []
+        st_time, unit, mult = self.plot_time_base
+        events = self.EventMarkers()
+        snapshots = []
+        for name, column, ylabel in (("temperature", 'T', "Temperature [C]"), ("humidity", 'RH', "Relative humidity [%]")):
+            lines = []
+            for sensor in self.sensor_data:
+                times, values = self.RenderSensor(sensor, column, max_points = self.snapshot_renderer.MaxPoints())
+                # Render may return views of the store, which keeps changing while the renderer works
+                lines.append((f"Sensor {sensor}", (times - st_time)*mult, np.array(values)))
+            snapshots.append(PlotSnapshot(name, lines, events, f"Time [{unit}]", ylabel))
+        return snapshots
     def SelectOutdir(self):
+        if self.replay is not None:
+            self.WarnUser(text = "Stop the replay first, replayed data is not written", title = "ERROR!")
+            return
         outdir = QFileDialog.getExistingDirectory(self, "Select output folder", os.getcwd())
         if outdir == "":
             return
+        # The samples in memory are not those of a run already in the directory
+        try:
+            RunFile(outdir)
+            self.WarnUser(text = "The folder already holds a run, use \"Continue run\" to append to it", title = "ERROR!")
+            return
+        except ValueError:
+            pass
+        self.StopOutput()
+        self.StartOutput(outdir)
+    def StartOutput(self, outdir, continue_run=False):
+        """
+        Starts writing to outdir. With continue_run, the samples in memory were loaded from
+        the run in outdir, and data and events already written there are not written again.
+        """
         self.outdir=outdir
-        print(self.outdir)
+        logger.info("Writing output to %s", self.outdir)
         self.fileNameField.setText(self.outdir)
-        self.outfiles = {}
-        for sensor in self.sensor_data:
-            self.lines_written[sensor] = 0
+        self.writer = DataWriter(self.outdir, **self.writer_options)
+        self.writer.Start()
+        self.lines_written = {}
+        self.events_written = set()
+        if continue_run:
+            run = RunFile(outdir)
+            for sensor in run.sensors:
+                if sensor in self.sensor_data:
+                    self.lines_written[sensor] = min(len(run.Samples(sensor)), self.sensor_data.Count(sensor))
+            self.events_written = set(zip(*run.Events()))
+        self.events_pending = [self.event_model.Event(r_) for r_ in range(len(self.event_model))]
         self.WriteData()
         self.CloseAndOpenIntermediate()
         self.autosave_timer = QTimer()
@@ -279,52 +841,95 @@ class HTMonitorWidget(QWidget):
             self.WarnUser(text = "No output directory selected", title = "ERROR!")
             if not (self.autosave_timer is None):
                 self.autosave_timer.stop()
-                return
-        for sensor in self.sensor_data:
-            if not sensor in self.outfiles:
-                self.outfiles[sensor] = open(f"{self.outdir}/sensor_{sensor}.csv", "w")
-                self.outfiles[sensor].writelines("time,T,RH\n")
-                self.lines_written[sensor] = 0 
-            for i in range(self.lines_written[sensor], len(self.sensor_data[sensor]['T'])):
-                self.outfiles[sensor].writelines(f"{self.sensor_data[sensor]['time'][i]:0.2f},{self.sensor_data[sensor]['T'][i]:0.2f},{self.sensor_data[sensor]['RH'][i]:0.2f}\n")
-            self.lines_written[sensor] = len(self.sensor_data[sensor]['T'])
-        ## Writing events
-        if not 'events' in self.outfiles:
-            self.outfiles['events'] = open(f"{self.outdir}/events.csv", "w")
-        self.outfiles['events'].writelines("time,name,description\n")
-        if not (self.manual_events is None):
-            for i in range(len(self.manual_events["time"])):
-                self.outfiles['events'].write(f"{self.manual_events['time'][i]:0.2f},{self.manual_events['name'][i]},{self.manual_events['description'][i]}\n")
-            self.lines_written['events'] = len(self.manual_events["time"])
+            return
+        if self.writer.error is not None:
+            error, self.writer.error = self.writer.error, None
+            self.WarnUser(text = f"Could not write output: {error}", title = "ERROR!")
+        # Rows are handed to the writer thread, which does the formatting and disk I/O.
+        # An acquisition process attached through shared memory writes the samples itself.
+        for sensor in (self.sensor_data if self.shared_ring is None else []):
+            first = self.lines_written.get(sensor, 0)
+            self.writer.WriteRows(sensor, self.sensor_data.Get(sensor, 'time', first), 
+                    self.sensor_data.Get(sensor, 'T', first), self.sensor_data.Get(sensor, 'RH', first))
+            self.lines_written[sensor] = self.sensor_data.Count(sensor)
+        ## Writing events added since the last call, each of them only once
+        for event in self.events_pending:
+            if event not in self.events_written:
+                self.writer.WriteEvent(*event)
+                self.events_written.add(event)
+        self.events_pending = []
+    def SpillSamples(self, sensor, first, times, T, RH):
+        """
+        Called by the sample store before samples are evicted from memory.
+        They are paged out to the history on disk, and those of them which did not make it
+        to the output file yet are written out.
+        """
+        self.history.Append(sensor, times, T, RH)
+        if self.writer is None or self.shared_ring is not None:
+            return
+        n_new = first + len(times) - self.lines_written.get(sensor, 0)
+        if n_new <= 0:
+            return
+        self.writer.WriteRows(sensor, times[-n_new:], T[-n_new:], RH[-n_new:])
+        self.lines_written[sensor] = first + len(times)
     def ShowManualEvents(self):
         self.manualEventsWidget.show()
 
-    def GetEventList(self):
-        self.manual_events = self.manualEventsWidget.GetEvents()        
-        for i in range(len(self.manual_events["time"])):
-            self.manual_events['time'][i] = QDateTime.fromString(
-                    self.manual_events['time'][i], 
-                    "yyyy-MM-dd HH:mm:ss").toSecsSinceEpoch() 
+    def EventsInserted(self, parent, first, last):
+        self.events_pending += [self.event_model.Event(r_) for r_ in range(first, last + 1)]
+        self.EventsChanged()
+    def EventsReset(self):
+        self.events_pending = [self.event_model.Event(r_) for r_ in range(len(self.event_model))]
+        self.EventsChanged()
+    def EventsChanged(self):
+        # Several changes in a row, e.g. a bulk removal, lead to one redraw
+        if not self.events_changed:
+            self.events_changed = True
+            QTimer.singleShot(0, self.RefreshEvents)
+    def RefreshEvents(self):
         self.UpdatePlots()
+        if not (self.outdir is None):
+            self.WriteData()
     def CloseAndOpenIntermediate(self):
         #print("Autosaving files")
-        for sensor in self.sensor_data:
-            self.outfiles[sensor].close()
-            self.outfiles[sensor] = open(f"{self.outdir}/sensor_{sensor}.csv", "a")
-        self.outfiles['events'].close()
-        self.outfiles['events'] = open(f"{self.outdir}/events.csv", "a")
-        ## And saving plots
-        self.temperaturePlot.figure.savefig(f"{self.outdir}/plot_temperature.png", dpi=300)
-        self.humidityPlot.figure.savefig(f"{self.outdir}/plot_humidity.png", dpi=300)
-        self.temperaturePlot.figure.savefig(f"{self.outdir}/plot_temperature.pdf", dpi=300)
-        self.humidityPlot.figure.savefig(f"{self.outdir}/plot_humidity.pdf", dpi=300)
+        if self.outdir is None:
+            self.WarnUser(text = "No output directory selected", title = "ERROR!")
+            return
+        if self.snapshot_renderer.error is not None:
+            error, self.snapshot_renderer.error = self.snapshot_renderer.error, None
+            self.WarnUser(text = f"Could not save plots: {error}", title = "ERROR!")
+        with self.instrumentation.Stage("autosave"):
+            self.writer.Flush()
+            ## And saving plots, rendered in the background
+            self.decimator.Update()
+            self.snapshot_renderer.Request(self.outdir, self.PlotSnapshots())
     def Disconnect(self):
         self.connected = False
         self.button_connect.setEnabled(True)
         self.button_disconnect.setEnabled(False)
-        self.serial.close()
-        self.serial = None
+        self.serial_thread_handler.Stop()
+        if self.stream_reader is not None:
+            self.stream_reader.Stop()
+            self.stream_reader = None
+        self.CloseSerials()
+        if self.shared_ring is not None:
+            self.shared_ring.Close()
+            self.shared_ring = None
         self.timer.stop()
+    def closeEvent(self, event):
+        if self.connected:
+            self.Disconnect()
+        self.StopReplay()
+        self.StopOutput()
+        self.snapshot_renderer.Stop()
+        self.history.Close()
+        if self.metrics is not None:
+            self.metrics.Stop()
+        super().closeEvent(event)
+    def CloseSerials(self):
+        for serial_ in self.serials.values():
+            serial_.close()
+        self.serials = {}
     def WarnUser(self, text = "Warning", title="WARNING! "):
         alert = QMessageBox(self)
         alert.setWindowTitle(title)
@@ -0,0 +1,349 @@
+import os
+import sys
+import queue
+import signal
+import logging
+import argparse
+import configparser
+import numpy as np
+from time import time, sleep
+from htmon.SerialReader import SerialReader, DeviceLabels, SensorKey, OpenDevice
+from htmon.RecordParser import ProtocolParser, RegexParser
+from htmon.DataWriter import DataWriter, FORMATS
+from htmon.Instrumentation import Instrumentation
+from htmon.SharedRing import SharedRing
+from htmon.StreamReader import StreamReader
+from htmon.OnlineStats import OnlineStats, ParseAlarms
+from htmon.MetricsServer import MetricsServer
+
+logger = logging.getLogger(__name__)
+
+class HeadlessMonitor:
+    """
+    Acquisition without GUI: polls the devices every ``interval`` seconds, parses
+    the readouts and hands the samples to a DataWriter. Neither Qt nor matplotlib
+    is imported. Samples are not kept in memory once they are queued for writing.
+    With ``shared_memory`` the samples are also published in a SharedRing of that name,
+    which GUI viewers can attach to while the acquisition keeps its own schedule.
+    With ``stream`` the devices send readouts continuously (see StreamReader); they are
+    time stamped on arrival and handed to the writer ``frame_rate`` times per second.
+    With ``metrics_port`` the latest readings, statistics and recent samples are served
+    over HTTP (see MetricsServer), from a snapshot taken after every measurement.
+    """
+    def __init__(self, addresses, outdir, baud=115200, interval=10., regexp=None, timeout=5.,
+            status_interval=60., writer_options=None, instrumentation=None, shared_memory=None, shared_capacity=1000000,
+            stream=False, frame_rate=10., alarms=(), stats_window=600., sensor_stats=False,
+            metrics_port=None, metrics_host="127.0.0.1", metrics_window=300.):
+        self.addresses = addresses
+        self.outdir = outdir
+        self.baud = baud
+        self.interval = interval
+        self.timeout = timeout
+        self.status_interval = status_interval
+        self.parser = ProtocolParser() if regexp is None else RegexParser(regexp)
+        self.writer = DataWriter(outdir, **({} if writer_options is None else writer_options))
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.shared_memory = shared_memory
+        self.shared_capacity = shared_capacity
+        self.ring = None
+        self.stream = stream
+        self.online_stats = OnlineStats(window=stats_window, alarms=alarms)
+        self.sensor_stats = sensor_stats
+        self.metrics = None if metrics_port is None else MetricsServer(metrics_port, metrics_host, metrics_window)
+        self.frame_rate = frame_rate
+        self.serials = {}
+        self.reader = None
+        self.running = False
+        self.n_measurements = 0
+        self.n_records = 0
+        self.last_latency = None
+    def Start(self):
+        os.makedirs(self.outdir, exist_ok=True)
+        for label, address in zip(DeviceLabels(self.addresses), self.addresses):
+            try:
+                self.serials[label] = OpenDevice(address, self.baud)
+            except Exception:
+                self.CloseSerials()
+                raise
+        if self.shared_memory is not None:
+            try:
+                self.ring = SharedRing.Create(self.shared_memory, self.shared_capacity)
+            except Exception:
+                self.CloseSerials()
+                raise
+            logger.info("Publishing samples in shared memory %s", self.shared_memory)
+        if self.metrics is not None:
+            try:
+                self.metrics.Start()
+            except OSError:
+                self.CloseSerials()
+                if self.ring is not None:
+                    self.ring.Close()
+                    self.ring = None
+                raise
+        self.writer.Start()
+        if self.stream:
+            self.reader = StreamReader(self.serials)
+        else:
+            self.reader = SerialReader(self.serials, timeout=self.timeout)
+        self.reader.Start()
+        self.running = True
+    def Stop(self):
+        self.running = False
+        if self.reader is not None:
+            self.reader.Stop()
+            # Data which arrived in the meantime is still written
+            if self.stream:
+                self.ProcessChunks(self.reader.Drain())
+            while not self.reader.results.empty():
+                self.ProcessMeasurement(self.reader.results.get_nowait())
+            self.reader = None
+        self.writer.Stop()
+        if self.ring is not None:
+            self.ring.Close()
+            self.ring = None
+        if self.metrics is not None:
+            self.metrics.Stop()
+        self.CloseSerials()
+    def CloseSerials(self):
+        for serial_ in self.serials.values():
+            serial_.close()
+        self.serials = {}
+    def ProcessMeasurement(self, measurement):
+        logger.debug("Serial response: %s", measurement.lines)
+        self.last_latency = max(measurement.latency.values())
+        self.instrumentation.Record("round trip", self.last_latency)
+        if not measurement.complete:
+            self.instrumentation.Count("incomplete readouts")
+        for device, lines in measurement.lines.items():
+            self.ProcessLines(device, lines, measurement.request_time)
+        self.n_measurements += 1
+        self.PublishMetrics()
+    def ProcessChunks(self, chunks):
+        """ Streamed (device, arrival time, lines) chunks """
+        for device, arrival_time, lines in chunks:
+            logger.debug("Serial data: %s", lines)
+            self.ProcessLines(device, lines, arrival_time)
+            self.n_measurements += 1
+        if chunks:
+            self.PublishMetrics()
+    def ProcessLines(self, device, lines, time_):
+        with self.instrumentation.Stage("parse"):
+            records = self.parser.Parse(lines)
+        self.instrumentation.Count("malformed records", records.n_malformed)
+        sensors = SensorKey(device, records.sensors, len(self.serials))
+        with self.instrumentation.Stage("stats"):
+            # Alarms are logged by OnlineStats
+            self.online_stats.Update(sensors, time_, records.T, records.RH)
+        if self.ring is not None:
+            with self.instrumentation.Stage("publish"):
+                self.ring.Write(sensors, time_, records.T, records.RH)
+        if self.metrics is not None:
+            self.metrics.Append(sensors, time_, records.T, records.RH)
+        with self.instrumentation.Stage("write"):
+            for sensor in np.unique(sensors):
+                mask = sensors == sensor
+                self.writer.WriteRows(sensor, np.full(np.count_nonzero(mask), time_), records.T[mask], records.RH[mask])
+        self.n_records += len(sensors)
+    def PublishMetrics(self):
+        if self.metrics is None:
+            return
+        with self.instrumentation.Stage("metrics"):
+            self.metrics.Publish(self.online_stats, dict(self.instrumentation.counters,
+                    measurements=self.n_measurements, records=self.n_records))
+    def LogStatus(self):
+        latency = "-" if self.last_latency is None else f"{1e3*self.last_latency:0.0f} ms"
+        logger.info("Measurements: %d, records: %d, malformed records: %d, skipped polls: %d, round trip: %s",
+                self.n_measurements, self.n_records, self.parser.n_malformed,
+                self.instrumentation.counters.get("skipped polls (busy)", 0), latency)
+        if self.stream and self.reader is not None:
+            logger.info("Streamed lines: %d, dropped: %d", self.reader.n_lines, self.reader.n_dropped)
+        if self.sensor_stats:
+            logger.info("Sensor statistics\n%s", self.online_stats.FormatSummary())
+        if self.instrumentation.enabled:
+            self.instrumentation.LogSummary()
+    def Run(self, duration=None):
+        """ Polls (or streams) until Stop() is called, the duration [s] is over, or the process is interrupted """
+        self.Start()
+        end = np.inf if duration is None else time() + duration
+        if self.stream:
+            self.RunStream(end)
+            return
+        next_poll = time()
+        next_status = time() + self.status_interval
+        try:
+            while self.running and time() < end:
+                now = time()
+                if now >= next_poll:
+                    if not self.reader.Request():
+                        self.instrumentation.Count("skipped polls (busy)")
+                        logger.warning("Poll skipped, the previous measurement is still running")
+                    # Polls keep their schedule, unless we fell behind by more than one interval
+                    next_poll = max(next_poll + self.interval, now)
+                if now >= next_status:
+                    self.LogStatus()
+                    next_status += self.status_interval
+                if self.writer.error is not None:
+                    error, self.writer.error = self.writer.error, None
+                    logger.error("Could not write output: %s", error)
+                try:
+                    measurement = self.reader.results.get(timeout=max(0., min(next_poll, next_status, end) - time()))
+                except queue.Empty:
+                    continue
+                self.ProcessMeasurement(measurement)
+        finally:
+            self.Stop()
+            self.LogStatus()
+
+    def RunStream(self, end):
+        next_frame = time()
+        next_status = time() + self.status_interval
+        try:
+            while self.running and time() < end:
+                sleep(max(0., min(next_frame, next_status, end) - time()))
+                now = time()
+                if now >= next_frame:
+                    self.ProcessChunks(self.reader.Drain())
+                    next_frame = max(next_frame + 1./self.frame_rate, now)
+                if now >= next_status:
+                    self.LogStatus()
+                    next_status += self.status_interval
+                if self.writer.error is not None:
+                    error, self.writer.error = self.writer.error, None
+                    logger.error("Could not write output: %s", error)
+        finally:
+            reader = self.reader
+            self.Stop()
+            self.LogStatus()
+            logger.info("Streamed lines: %d, dropped: %d", reader.n_lines, reader.n_dropped)
+
+# Options without a value, which are read as booleans from the config file
+FLAGS = {"fsync", "compress", "stats", "stream", "sensor_stats"}
+# Options of only one mode, an error on the command line of the other one (a config file can serve both)
+HEADLESS_ONLY = {"duration", "status_interval", "shared_memory", "shared_capacity", "sensor_stats", "profile"}
+GUI_ONLY = {"attach", "max_samples", "history_dir", "plot_formats", "plot_dpi"}
+
+def ParseFormats(text):
+    """ Output formats from a comma-separated list like "csv,bin" """
+    formats = tuple(f_.strip() for f_ in text.split(',') if f_.strip())
+    unknown = [f_ for f_ in formats if f_ not in FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(f"invalid format(s) {', '.join(unknown) or repr(text)}, expected {', '.join(FORMATS)}")
+    return formats
+
+def ParseArguments(argv=None):
+    """
+    Command line options; any of them can also be given in the [htmon] section of an
+    INI file passed with --config, with dashes replaced by underscores. The command line wins.
+    """
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("--config", help="INI file with an [htmon] section")
+    known, _ = config_parser.parse_known_args(argv)
+    parser = argparse.ArgumentParser(description="Humidity/temperature monitor", parents=[config_parser])
+    parser.add_argument("--headless", action="store_true", help="run the acquisition without GUI")
+    parser.add_argument("--device", default="/dev/ttyACM0", help="serial device(s), comma-separated; 'dummy' for a simulated device")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--interval", type=float, default=10., help="polling interval [s]")
+    parser.add_argument("--timeout", type=float, default=5., help="timeout of a readout [s]")
+    parser.add_argument("--outdir", help="output directory (required with --headless, the GUI starts writing to it)")
+    parser.add_argument("--regexp", default=None, help="regular expression with groups sensor, T and RH for non-standard protocols")
+    parser.add_argument("--stream", action="store_true", help="the devices send readouts continuously instead of being polled")
+    parser.add_argument("--frame-rate", type=float, default=10., help="hand-overs of streamed data per second")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--status-interval", type=float, default=60., help="interval of the status line [s]")
+    parser.add_argument("--flush-interval", type=float, default=5.)
+    parser.add_argument("--fsync", action="store_true")
+    parser.add_argument("--rotate-bytes", type=int, default=None)
+    parser.add_argument("--rotate-seconds", type=float, default=None)
+    parser.add_argument("--compress", action="store_true", help="gzip CSV output")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--log-file", default=None, help="log to this file instead of stderr")
+    parser.add_argument("--stats", action="store_true", help="time the stages and log the statistics with the status")
+    parser.add_argument("--profile", default=None, help="profile the acquisition loop and dump the cProfile data to this file")
+    parser.add_argument("--shared-memory", default=None, metavar="NAME",
+            help="publish the samples in a shared memory ring buffer, which GUIs can attach to with --attach NAME")
+    parser.add_argument("--shared-capacity", type=int, default=1000000, help="samples kept in the shared ring buffer")
+    parser.add_argument("--attach", default=None, metavar="NAME", help="GUI only: show the acquisition publishing in shared memory NAME")
+    parser.add_argument("--max-samples", type=int, default=1000000,
+            help="GUI only: samples per sensor kept in memory, older ones are paged out to disk")
+    parser.add_argument("--history-dir", default=None,
+            help="GUI only: where samples paged out of memory are kept (default: the temporary directory)")
+    parser.add_argument("--plot-formats", type=lambda s: tuple(f_.strip() for f_ in s.split(',')), default=("png", "pdf"),
+            help="GUI only: comma-separated formats of the plots saved in the output directory, e.g. png,pdf,svg")
+    parser.add_argument("--plot-dpi", type=int, default=300, help="GUI only: resolution of the saved plots")
+    parser.add_argument("--alarms", type=ParseAlarms, default=[],
+            help="comma-separated alarms like T>30,RH<10,dT>0.5 (rate per minute); DP and AH are dew point and absolute humidity")
+    parser.add_argument("--stats-window", type=float, default=600., help="window of the running minimum and maximum [s]")
+    parser.add_argument("--sensor-stats", action="store_true", help="log the statistics of every sensor with the status")
+    parser.add_argument("--metrics-port", type=int, default=None,
+            help="serve the latest readings over HTTP on this port: /metrics (Prometheus), /metrics.json, /recent.json")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="address the metrics endpoint listens on")
+    parser.add_argument("--metrics-window", type=float, default=300., help="samples of the last seconds served in /recent.json")
+    parser.add_argument("--formats", type=ParseFormats, default=FORMATS,
+            help="comma-separated output formats: " + ", ".join(FORMATS))
+    if known.config is not None:
+        config = configparser.ConfigParser()
+        if not config.read(known.config) or not config.has_section("htmon"):
+            parser.error(f"No [htmon] section found in {known.config}")
+        options = {a_.dest for a_ in parser._actions}
+        defaults = {}
+        for key in config["htmon"]:
+            dest = key.replace('-', '_')
+            if dest not in options or dest in ("config", "headless"):
+                parser.error(f"Unknown option {key} in {known.config}")
+            # String defaults go through the type conversion of their option
+            defaults[dest] = config["htmon"].getboolean(key) if dest in FLAGS else config["htmon"][key]
+        parser.set_defaults(**defaults)
+    args = parser.parse_args(argv)
+    if args.headless and args.outdir is None:
+        parser.error("--outdir is required with --headless")
+    other_mode = GUI_ONLY if args.headless else HEADLESS_ONLY
+    # Defaults are only taken for attributes missing from the namespace
+    unset = object()
+    explicit = parser.parse_args(argv, namespace=argparse.Namespace(**{dest:unset for dest in other_mode}))
+    given = sorted(dest for dest in other_mode if getattr(explicit, dest) is not unset)
+    if given:
+        parser.error(", ".join("--" + d_.replace('_', '-') for d_ in given)
+                + (" can only be used without --headless" if args.headless else " can only be used with --headless"))
+    return args
+
+def WriterOptions(args):
+    """ DataWriter options from the command line """
+    return dict(flush_interval=args.flush_interval, fsync=args.fsync, rotate_bytes=args.rotate_bytes,
+            rotate_seconds=args.rotate_seconds, compress=args.compress, formats=args.formats)
+
+def SetUpLogging(args):
+    """ --log-level and --log-file, for the headless mode and the GUI """
+    logging.basicConfig(level=args.log_level, filename=args.log_file,
+            format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+def main(argv=None):
+    args = ParseArguments(argv)
+    SetUpLogging(args)
+    instrumentation = Instrumentation(enabled=args.stats)
+    monitor = HeadlessMonitor([a_.strip() for a_ in args.device.split(',') if a_.strip() != ""], args.outdir,
+            baud=args.baud, interval=args.interval, regexp=args.regexp, timeout=args.timeout,
+            status_interval=args.status_interval,
+            writer_options=WriterOptions(args),
+            instrumentation=instrumentation, shared_memory=args.shared_memory, shared_capacity=args.shared_capacity,
+            stream=args.stream, frame_rate=args.frame_rate, alarms=args.alarms, stats_window=args.stats_window,
+            sensor_stats=args.sensor_stats, metrics_port=args.metrics_port, metrics_host=args.metrics_host,
+            metrics_window=args.metrics_window)
+    # Stopping the daemon with SIGTERM closes the files like Ctrl+C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if args.profile is not None:
+        instrumentation.StartProfiling(memory=False)
+    try:
+        monitor.Run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as error:
+        logger.error("%s", error)
+        return 1
+    finally:
+        if args.profile is not None:
+            logger.info("Profile written to %s\n%s", args.profile, instrumentation.StopProfiling(args.profile))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import io
+import logging
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import nullcontext
+from time import perf_counter
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class StageTimer:
+    """ Context manager adding the duration of its block to a stage """
+    __slots__ = ("stats", "start")
+    def __init__(self, stats):
+        self.stats = stats
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+    def __exit__(self, *exc):
+        self.stats.Add(perf_counter() - self.start)
+        return False
+
+class StageStats:
+    """ Count, total and maximum of all durations of a stage, and the last ``history`` of them for percentiles """
+    def __init__(self, history=1024):
+        self.durations = np.zeros(history)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.timer = StageTimer(self)
+    def Add(self, duration):
+        self.durations[self.count % len(self.durations)] = duration
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+    def Summary(self):
+        recent = self.durations[:min(self.count, len(self.durations))]
+        if len(recent) == 0:
+            return {"count":0}
+        p50, p90, p99 = np.percentile(recent, [50, 90, 99])
+        return {"count":self.count, "mean_ms":1e3*self.total/self.count, "p50_ms":1e3*p50, "p90_ms":1e3*p90,
+                "p99_ms":1e3*p99, "max_ms":1e3*self.max}
+
+class Instrumentation:
+    """
+    Stage timers and event counters of the acquisition.
+    Stages are timed with ``with instrumentation.Stage("parse"):``, or with Record() for
+    durations measured elsewhere (e.g. the serial round trip). When ``enabled`` is False,
+    Stage() returns a shared no-op context and Record() returns immediately.
+    Counters (skipped polls, malformed records, ...) are always kept, they cost a dict update.
+    cProfile and tracemalloc can be switched on at run time with StartProfiling().
+    """
+    no_timer = nullcontext()
+    def __init__(self, enabled=False, history=1024):
+        self.enabled = enabled
+        self.history = history
+        self.stages = {}
+        self.counters = {}
+        self.profiler = None
+    def Stage(self, name):
+        if not self.enabled:
+            return self.no_timer
+        if name not in self.stages:
+            self.stages[name] = StageStats(self.history)
+        return self.stages[name].timer
+    def Record(self, name, duration):
+        if not self.enabled:
+            return
+        if name not in self.stages:
+            self.stages[name] = StageStats(self.history)
+        self.stages[name].Add(duration)
+    def Count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+    def Reset(self):
+        self.stages = {}
+        self.counters = {}
+    def Summary(self):
+        return {"stages":{name:stats.Summary() for name, stats in self.stages.items()}, "counters":dict(self.counters)}
+    def FormatSummary(self):
+        lines = [f"{'stage':<12}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  [ms]"]
+        for name, s_ in self.Summary()["stages"].items():
+            if s_["count"] == 0:
+                continue
+            lines.append(f"{name:<12}{s_['count']:>8d}{s_['mean_ms']:>10.2f}{s_['p50_ms']:>10.2f}"
+                    f"{s_['p90_ms']:>10.2f}{s_['p99_ms']:>10.2f}{s_['max_ms']:>10.2f}")
+        lines += [f"{name}: {value}" for name, value in self.counters.items()]
+        return "\n".join(lines)
+    def LogSummary(self, level=logging.INFO):
+        logger.log(level, "Statistics\n%s", self.FormatSummary())
+    @property
+    def profiling(self):
+        return self.profiler is not None
+    def StartProfiling(self, memory=True):
+        """ Profiles everything run in this thread until StopProfiling(); with memory, allocations are traced too """
+        if self.profiler is not None:
+            return
+        self.profiler = cProfile.Profile()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.profiler.enable()
+    def StopProfiling(self, path=None, n_lines=20):
+        """ Returns a text report of the top functions and allocations; the full profile is dumped to path """
+        if self.profiler is None:
+            return ""
+        self.profiler.disable()
+        if path is not None:
+            self.profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(self.profiler, stream=report).sort_stats("cumulative").print_stats(n_lines)
+        self.profiler = None
+        if tracemalloc.is_tracing():
+            report.write("Top allocations:\n")
+            for stat in tracemalloc.take_snapshot().statistics("lineno")[:n_lines]:
+                report.write(f"{stat}\n")
+            tracemalloc.stop()
+        return report.getvalue()
@@ -1,23 +1,29 @@
 from PyQt5.QtWidgets import (
-            QWidget, QTableWidget, QTableWidgetItem, 
+            QWidget, QTableView, QHeaderView, QAbstractItemView,
             QVBoxLayout, QHBoxLayout, QPushButton, 
             QLabel, QLineEdit, QDateTimeEdit
             )
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject, QDateTime
-from copy import copy, deepcopy
+from PyQt5.QtCore import Qt, pyqtSignal, QDateTime
+from htmon.EventModel import EventModel
 
 class ManualEventWidget(QWidget):
-    events_updated = pyqtSignal()
+    """ Window to add and remove manual events; the events themselves live in ``model`` (EventModel) """
     window_shown = pyqtSignal()
     def __init__(self, parent=None):
         super().__init__(parent, Qt.Window)
         self.setWindowTitle("Manual events")
         self.layout = QVBoxLayout()
-        self.events = {"time":[], "name":[], "description":[]}
-        self.table = QTableWidget()
-        self.table.setColumnCount(3)
-        self.table.setRowCount(0)
-        self.table.setHorizontalHeaderLabels(["Time", "Event", "Description"])
+        self.model = EventModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        # Row numbers would be queried for every row on each insertion
+        self.table.verticalHeader().hide()
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setColumnWidth(0, 150)
+        self.table.setColumnWidth(1, 150)
         self.layout.addWidget(self.table)
         self.datetimeedit = QDateTimeEdit(self)
         self.datetimeedit.setDateTime(QDateTime.currentDateTime())
@@ -33,7 +39,7 @@ class ManualEventWidget(QWidget):
         self.removeSelectedButton = QPushButton("Remove selected")
         self.removeSelectedButton.setEnabled(False)
         self.removeSelectedButton.clicked.connect(self.RemoveSelected)
-        self.table.itemSelectionChanged.connect(lambda: self.removeSelectedButton.setEnabled(True) if len(self.table.selectedIndexes()) > 0 else self.removeSelectedButton.setEnabled(False))
+        self.table.selectionModel().selectionChanged.connect(lambda: self.removeSelectedButton.setEnabled(self.table.selectionModel().hasSelection()))
         addeventlayout = QHBoxLayout()
         addeventlayout.addWidget(self.datetimeedit)
         addeventlayout.addWidget(self.eventTextLabel)
@@ -47,7 +53,7 @@ class ManualEventWidget(QWidget):
         self.setLayout(self.layout)
         self.window_shown.connect(self.UpdateCurrentTime)
     def AddEventButtonAction(self):
-        time = self.datetimeedit.dateTime().toString("yyyy-MM-dd HH:mm:ss")
+        time = self.datetimeedit.dateTime().toSecsSinceEpoch()
         text = self.eventNameEdit.text()
         description = self.eventDescriptionEdit.text()
         self.AddEvent(time, text, description)
@@ -59,32 +65,17 @@ class ManualEventWidget(QWidget):
         selected = self.table.selectedIndexes()
         if len(selected) == 0:
             return
-        rows = sorted(set([selected[i].row() for i in range(len(selected))]))
-        for r_ in rows[::-1]:
-            self.events["time"].pop(r_)
-            self.events["name"].pop(r_)
-            self.events["description"].pop(r_)
-        self.events_updated.emit()
-        self.UpdateTable()
+        self.model.RemoveRows([index.row() for index in selected])
         self.UpdateCurrentTime()
     def AddEvent(self, time, name, description = ""):
-        self.events["time"].append(time)
-        self.events["name"].append(name)
-        self.events["description"].append(description)
-        self.events_updated.emit()
-        self.UpdateTable()
-    def UpdateTable(self):
-        self.table.setRowCount(len(self.events["time"]))
-        for i in range(len(self.events["time"])):
-            self.table.setItem(i, 0, QTableWidgetItem(self.events["time"][i]))
-            self.table.setItem(i, 1, QTableWidgetItem(self.events["name"][i]))
-            self.table.setItem(i, 2, QTableWidgetItem(self.events["description"][i]))
-        self.table.resizeColumnsToContents()
-        self.table.resizeRowsToContents()
+        """ time is in seconds since the epoch """
+        row = self.model.AddEvent(time, name, description)
+        self.table.scrollTo(self.model.index(row, 0))
+    def SetEvents(self, times, names, descriptions):
+        """ Replaces all events, e.g. when a recorded run is loaded """
+        self.model.SetEvents(times, names, descriptions)
     def UpdateCurrentTime(self):
         self.datetimeedit.setDateTime(QDateTime.currentDateTime())
     def show(self):
         super().show()
         self.window_shown.emit()
-    def GetEvents(self):
-        return deepcopy(self.events)
@@ -0,0 +1,195 @@
+import re
+import json
+import logging
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import time
+import numpy as np
+from htmon.OnlineStats import QUANTITIES, UNITS
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metric and description of every quantity of OnlineStats
+METRICS = {"T":("htmon_temperature_celsius", "Temperature"),
+        "RH":("htmon_relative_humidity_percent", "Relative humidity"),
+        "DP":("htmon_dew_point_celsius", "Dew point"),
+        "AH":("htmon_absolute_humidity_grams_per_cubic_meter", "Absolute humidity")}
+GAUGE_STATS = ("last", "mean", "std", "min", "max", "ewma")
+
+def LabelValue(text):
+    return str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def MetricName(text):
+    return re.sub(r'[^a-z0-9_]+', '_', text.lower()).strip('_')
+
+def PrometheusLines(name, labels, values):
+    """ Sample lines of one metric, one per label set, formatted with a single string operation """
+    text = (f"{name}{{%s}} %r\n"*len(labels)) % tuple(v_ for pair in zip(labels, values) for v_ in pair)
+    # repr() of the special values differs from the exposition format
+    return text.replace(" nan\n", " NaN\n").replace(" inf\n", " +Inf\n").replace(" -inf\n", " -Inf\n")
+
+def JsonValues(values):
+    """ Floats as a list, NaN (no data) as None """
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isfinite(values), values, None).tolist()
+
+class MetricsSnapshot:
+    """
+    State of the acquisition at one moment: the statistics of OnlineStats.Snapshot(), the counters
+    and the samples since ``start``. It is not modified once built. Each response is encoded
+    on its first request and then served from the cache to every scraper.
+    """
+    def __init__(self, time_, stats, counters, chunks, start, stats_window):
+        self.time = time_
+        self.stats = stats
+        self.counters = counters
+        self.chunks = chunks
+        self.start = start
+        self.stats_window = stats_window
+        self.bodies = {}
+        self.lock = threading.Lock()
+        self.encoders = {"prometheus":self.Prometheus, "json":self.Json, "recent":self.Recent}
+    def Body(self, kind):
+        with self.lock:
+            if kind not in self.bodies:
+                self.bodies[kind] = self.encoders[kind]()
+            return self.bodies[kind]
+    def Prometheus(self):
+        stats = self.stats
+        sensors = [f'sensor="{LabelValue(s_)}"' for s_ in stats["sensors"]]
+        last_time = np.fmax.reduce(stats["last_time"], axis=1) if len(sensors) > 0 else np.array([])
+        text = []
+        for i, q_ in enumerate(QUANTITIES):
+            name, description = METRICS[q_]
+            text.append(f"# HELP {name} {description} [{UNITS[q_]}]: last reading, mean, standard deviation and "
+                    f"exponentially weighted average since the start, minimum and maximum over the last {self.stats_window:g} s\n"
+                    f"# TYPE {name} gauge\n")
+            for s_ in GAUGE_STATS:
+                text.append(PrometheusLines(name, [f'{l_},stat="{s_}"' for l_ in sensors], stats[s_][:,i].tolist()))
+            text.append(f"# HELP {name}_per_minute Rate of change of the {description.lower()}\n# TYPE {name}_per_minute gauge\n")
+            text.append(PrometheusLines(f"{name}_per_minute", sensors, stats["rate"][:,i].tolist()))
+        text.append("# HELP htmon_samples_total Valid temperature samples\n# TYPE htmon_samples_total counter\n")
+        text.append(PrometheusLines("htmon_samples_total", sensors, stats["n"][:,0].tolist()))
+        text.append("# HELP htmon_last_sample_timestamp_seconds Time of the last sample\n"
+                "# TYPE htmon_last_sample_timestamp_seconds gauge\n")
+        text.append(PrometheusLines("htmon_last_sample_timestamp_seconds", sensors, last_time.tolist()))
+        if stats["alarms"]:
+            text.append("# HELP htmon_alarm_active 1 while the alarm condition holds\n# TYPE htmon_alarm_active gauge\n")
+            labels = [f'{l_},alarm="{LabelValue(a_)}"' for l_ in sensors for a_ in stats["alarms"]]
+            text.append(PrometheusLines("htmon_alarm_active", labels, stats["active"].astype(int).ravel().tolist()))
+        for counter, value in self.counters.items():
+            name = f"htmon_{MetricName(counter)}_total"
+            text.append(f"# HELP {name} {counter}\n# TYPE {name} counter\n{name} {value}\n")
+        text.append("# HELP htmon_snapshot_timestamp_seconds Time the values were taken\n"
+                f"# TYPE htmon_snapshot_timestamp_seconds gauge\nhtmon_snapshot_timestamp_seconds {self.time!r}\n")
+        return "".join(text).encode()
+    def Json(self):
+        stats = self.stats
+        columns = {s_:[JsonValues(stats[s_][:,i]) for i in range(len(QUANTITIES))] for s_ in GAUGE_STATS + ("rate",)}
+        n = stats["n"].tolist()
+        last_time = JsonValues(np.fmax.reduce(stats["last_time"], axis=1) if len(n) > 0 else [])
+        sensors = {}
+        for row, sensor in enumerate(stats["sensors"]):
+            sensors[sensor] = {"last_time":last_time[row], **{q_:{"unit":UNITS[q_], "n":n[row][i],
+                    **{s_:columns[s_][i][row] for s_ in columns}} for i, q_ in enumerate(QUANTITIES)}}
+        rows, alarms = np.nonzero(stats["active"])
+        return json.dumps({"time":self.time, "stats_window":self.stats_window, "sensors":sensors,
+                "alarms":[{"sensor":stats["sensors"][r_], "alarm":stats["alarms"][a_]} for r_, a_ in zip(rows.tolist(), alarms.tolist())],
+                "counters":self.counters}, default=lambda v_: v_.item()).encode()
+    def Recent(self):
+        recent = {}
+        if self.chunks:
+            sensors, times, T, RH = (np.concatenate(c_) for c_ in list(zip(*self.chunks))[1:])
+            keep = times >= self.start
+            sensors, times, T, RH = sensors[keep], times[keep], T[keep], RH[keep]
+            # Grouped by sensor, in order of arrival within each sensor
+            names, index, counts = np.unique(sensors, return_inverse=True, return_counts=True)
+            order = np.argsort(index, kind='stable')
+            bounds = np.r_[0, np.cumsum(counts)].tolist()
+            for k, name in enumerate(names.tolist()):
+                rows = order[bounds[k]:bounds[k + 1]]
+                recent[name] = {"time":times[rows].tolist(), "T":JsonValues(T[rows]), "RH":JsonValues(RH[rows])}
+        return json.dumps({"time":self.time, "start":self.start, "sensors":recent}).encode()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """ Serves the current snapshot of server.metrics (a MetricsServer) """
+    routes = {"/metrics":("prometheus", "text/plain; version=0.0.4; charset=utf-8"),
+            "/metrics.json":("json", "application/json"),
+            "/recent.json":("recent", "application/json")}
+    def do_GET(self):
+        route = self.routes.get(self.path.split('?', 1)[0])
+        if route is None:
+            self.send_error(404, "Use " + ", ".join(self.routes))
+            return
+        snapshot = self.server.metrics.snapshot
+        if snapshot is None:
+            self.send_error(503, "No samples yet")
+            return
+        kind, content_type = route
+        body = snapshot.Body(kind)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, format, *args):
+        logger.debug("%s " + format, self.address_string(), *args)
+
+class MetricsServer:
+    """
+    Local HTTP endpoint with the live readings, for dashboards and Prometheus:
+    /metrics (Prometheus text format), /metrics.json (statistics, active alarms and counters)
+    and /recent.json (the samples of the last ``window`` seconds of every sensor).
+    The acquisition hands new samples to Append() and calls Publish() after every batch, which
+    builds a MetricsSnapshot. Requests are answered from the latest snapshot by a
+    ThreadingHTTPServer on its own threads, so scrapes never run on the GUI or serial
+    threads, and many scrapers cost one encoding per snapshot.
+    It only listens on ``host`` (localhost by default); port 0 picks a free port.
+    """
+    def __init__(self, port=9100, host="127.0.0.1", window=300.):
+        self.host = host
+        self.port = port
+        self.window = window
+        self.chunks = deque() # (last time, sensors, times, T, RH) of the recent window, as they arrived
+        self.latest = -np.inf
+        self.snapshot = None
+        self.server = None
+        self.thread = None
+    @property
+    def address(self):
+        return self.server.server_address[:2] if self.server is not None else (self.host, self.port)
+    def Start(self):
+        """ Raises OSError if the port cannot be bound """
+        self.server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info("Serving metrics on http://%s:%d/metrics", *self.address)
+    def Stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+    def Append(self, sensors, times, T, RH):
+        """ New samples (times can be a single time stamp); they are copied, the arrays may be views of a buffer """
+        n = len(sensors)
+        if n == 0:
+            return
+        times = np.array(np.broadcast_to(np.asarray(times, dtype=np.float64), (n,)))
+        last = float(times.max())
+        self.chunks.append((last, np.array(sensors), times, np.array(T, dtype=np.float64), np.array(RH, dtype=np.float64)))
+        self.latest = max(self.latest, last)
+        # Chunks arrive in time order, whole chunks older than the window are dropped
+        while self.chunks[0][0] < self.latest - self.window:
+            self.chunks.popleft()
+    def Publish(self, online_stats, counters=None):
+        """ Builds the snapshot served until the next call """
+        self.snapshot = MetricsSnapshot(time(), online_stats.Snapshot(), dict(counters or {}), tuple(self.chunks),
+                self.latest - self.window, online_stats.window)
+    def Clear(self):
+        self.chunks = deque()
+        self.latest = -np.inf
+        self.snapshot = None
@@ -0,0 +1,275 @@
+import re
+import logging
+from collections import deque, namedtuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTITIES = ("T", "RH", "DP", "AH")
+UNITS = {"T":"C", "RH":"%", "DP":"C", "AH":"g/m3"}
+# Statistics of every quantity besides the number of samples
+STATS = ("mean", "std", "min", "max", "ewma", "last", "rate")
+
+# quantity is one of QUANTITIES; with rate the limit is on |d quantity/dt| per minute
+Alarm = namedtuple("Alarm", ["quantity", "op", "limit", "rate"])
+# One transition of an alarm for a sensor; active is False when the condition cleared
+AlarmEvent = namedtuple("AlarmEvent", ["time", "sensor", "alarm", "value", "active"])
+
+def DewPoint(T, RH):
+    """ Dew point [C] from temperature [C] and relative humidity [%] (Magnus formula) """
+    T = np.asarray(T, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = np.log(np.asarray(RH, dtype=np.float64)/100.) + 17.62*T/(243.12 + T)
+        return 243.12*gamma/(17.62 - gamma)
+
+def AbsoluteHumidity(T, RH):
+    """ Absolute humidity [g/m3] from temperature [C] and relative humidity [%] """
+    T = np.asarray(T, dtype=np.float64)
+    return 6.112*np.exp(17.67*T/(T + 243.5))*np.asarray(RH, dtype=np.float64)*2.1674/(273.15 + T)
+
+def ParseAlarms(text):
+    """
+    Alarms from a comma-separated list like "T>30,RH<10,dT>0.5": a quantity (T, RH, DP, AH),
+    < or >, and a limit. A leading 'd' sets a limit on the rate of change per minute (either sign).
+    """
+    alarms = []
+    for spec in text.split(','):
+        spec = spec.strip()
+        if spec == "":
+            continue
+        match = re.fullmatch(r'(d?)(T|RH|DP|AH)\s*([<>])\s*([+-]?[0-9.]+(?:[eE][+-]?[0-9]+)?)', spec)
+        if match is None:
+            raise ValueError(f"Invalid alarm {spec}, expected e.g. T>30, RH<10 or dT>0.5")
+        rate, quantity, op, limit = match.groups()
+        alarms.append(Alarm(quantity, op, float(limit), rate == 'd'))
+    return alarms
+
+def AlarmName(alarm):
+    return f"{'d' if alarm.rate else ''}{alarm.quantity}{alarm.op}{alarm.limit:g}"
+
+class WindowExtremes:
+    """ Minimum and maximum over the last ``window`` seconds, with monotonic deques (amortized O(1) per value) """
+    def __init__(self, window):
+        self.window = window
+        self.lows = deque()
+        self.highs = deque()
+    def Add(self, time_, value):
+        if value != value: # NaN
+            return
+        while self.lows and self.lows[-1][1] >= value:
+            self.lows.pop()
+        self.lows.append((time_, value))
+        while self.highs and self.highs[-1][1] <= value:
+            self.highs.pop()
+        self.highs.append((time_, value))
+        self.Expire(time_)
+    def AddBatch(self, times, values):
+        """ Same as Add() for every value in turn, but only values which can become an extreme are pushed """
+        valid = ~np.isnan(values)
+        times, values = times[valid], values[valid]
+        if len(values) == 0:
+            return
+        # A value stays in the lows only if every later value is higher, in the highs if every later one is lower
+        lowest = np.minimum.accumulate(values[::-1])[::-1]
+        highest = np.maximum.accumulate(values[::-1])[::-1]
+        while self.lows and self.lows[-1][1] >= lowest[0]:
+            self.lows.pop()
+        while self.highs and self.highs[-1][1] <= highest[0]:
+            self.highs.pop()
+        keep = np.r_[values[:-1] < lowest[1:], True]
+        self.lows.extend(zip(times[keep].tolist(), values[keep].tolist()))
+        keep = np.r_[values[:-1] > highest[1:], True]
+        self.highs.extend(zip(times[keep].tolist(), values[keep].tolist()))
+        self.Expire(times[-1])
+    def Expire(self, time_):
+        start = time_ - self.window
+        while self.lows[0][0] < start:
+            self.lows.popleft()
+        while self.highs[0][0] < start:
+            self.highs.popleft()
+    @property
+    def min(self):
+        return self.lows[0][1] if self.lows else np.nan
+    @property
+    def max(self):
+        return self.highs[0][1] if self.highs else np.nan
+
+class OnlineStats:
+    """
+    Per-sensor statistics updated with every batch of new samples, without looking at the history:
+    mean and standard deviation (Welford), minimum and maximum over the last ``window`` seconds,
+    exponentially weighted average with weight ``alpha``, and the rate of change per minute.
+    Besides T and RH, the dew point (DP) and absolute humidity (AH) are derived for each batch.
+    State is kept in arrays with one row per sensor. A batch is processed with a few vectorized
+    operations over all of its samples, however many of them belong to the same sensor.
+    ``alarms`` (see ParseAlarms) are checked on every new sample; Update() returns the
+    AlarmEvents of alarms which became active or cleared.
+    """
+    def __init__(self, window=600., alpha=0.1, alarms=()):
+        self.window = window
+        self.alpha = alpha
+        self.alarms = list(alarms)
+        self.alarm_names = [AlarmName(a_) for a_ in self.alarms]
+        self.n_alarms = 0
+        self.Clear()
+    def Clear(self):
+        self.rows = {}
+        self.names = []
+        self.extremes = []
+        self.Allocate(64, keep=False)
+    def Allocate(self, capacity, keep=True):
+        """ (Re)allocates the state arrays for capacity sensors; with keep the current state is copied """
+        shape = (capacity, len(QUANTITIES))
+        arrays = {"n":np.zeros(shape, dtype=np.int64), "mean":np.zeros(shape), "m2":np.zeros(shape),
+                "ewma":np.full(shape, np.nan), "last":np.full(shape, np.nan), "rate":np.full(shape, np.nan),
+                "last_time":np.full(shape, np.nan), "active":np.zeros((capacity, len(self.alarms)), dtype=bool)}
+        for name, array in arrays.items():
+            if keep:
+                old = getattr(self, name)
+                array[:len(old)] = old
+            setattr(self, name, array)
+    def Rows(self, sensors):
+        """ Row of each sensor, adding new sensors """
+        rows = np.empty(len(sensors), dtype=np.int64)
+        for i, sensor in enumerate(sensors.tolist()):
+            row = self.rows.get(sensor)
+            if row is None:
+                row = self.rows[sensor] = len(self.names)
+                self.names.append(sensor)
+                self.extremes.append([WindowExtremes(self.window) for q_ in QUANTITIES])
+                if row >= len(self.n):
+                    self.Allocate(2*len(self.n))
+            rows[i] = row
+        return rows
+    def Update(self, sensors, times, T, RH):
+        sensors = np.asarray(sensors).astype(str)
+        if len(sensors) == 0:
+            return []
+        times = np.broadcast_to(np.asarray(times, dtype=np.float64), sensors.shape)
+        T, RH = np.asarray(T, dtype=np.float64), np.asarray(RH, dtype=np.float64)
+        values = np.stack([T, RH, DewPoint(T, RH), AbsoluteHumidity(T, RH)], axis=1)
+        # Samples grouped by sensor, in the order they were taken within each group
+        rows = self.Rows(sensors)
+        order = np.argsort(rows, kind='stable')
+        rows, times, values = rows[order], times[order], values[order]
+        n = len(rows)
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        counts = np.diff(np.r_[starts, n])
+        ends = starts + counts - 1
+        group_rows = rows[starts]
+        group = np.repeat(np.arange(len(starts)), counts)
+        group_start = starts[group]
+        index = np.arange(n)
+        valid = ~np.isnan(values)
+        # Latest valid sample up to each sample, and before it, within the group
+        latest = np.maximum.accumulate(np.where(valid, index[:,None], -1), axis=0)
+        previous = np.vstack([np.full((1, values.shape[1]), -1), latest[:-1]])
+        before = previous >= group_start[:,None]
+        quantities = np.arange(values.shape[1])
+        previous_value = np.where(before, values[np.maximum(previous, 0), quantities], self.last[rows])
+        previous_time = np.where(before, times[np.maximum(previous, 0)], self.last_time[rows])
+        dt = times[:,None] - previous_time
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(dt > 0, 60.*(values - previous_value)/dt, np.nan)
+        events = self.CheckAlarms(rows, times, values, rate, order, group_start, starts, ends) if self.alarms else []
+        # Welford's state merged with the statistics of the batch (Chan et al.)
+        n_a, mean_a, m2_a = self.n[group_rows], self.mean[group_rows], self.m2[group_rows]
+        n_b = np.add.reduceat(valid.astype(np.int64), starts, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_b = np.add.reduceat(np.where(valid, values, 0.), starts, axis=0)/n_b
+            m2_b = np.add.reduceat(np.where(valid, (values - mean_b[group])**2, 0.), starts, axis=0)
+            n_ab = n_a + n_b
+            delta = mean_b - mean_a
+            update = n_b > 0
+            self.mean[group_rows] = np.where(update, mean_a + delta*n_b/n_ab, mean_a)
+            self.m2[group_rows] = np.where(update, m2_a + m2_b + delta**2*n_a*n_b/n_ab, m2_a)
+        self.n[group_rows] = n_ab
+        # Exponentially weighted average: sample j of k valid ones weighs alpha*(1 - alpha)**(k - 1 - j).
+        # Without a previous average the first sample starts it, which gives the same weights.
+        position = np.cumsum(valid, axis=0) - 1
+        position -= (position[starts] + 1 - valid[starts])[group]
+        first = valid & (position == 0)
+        ewma = self.ewma[group_rows]
+        for q_ in quantities:
+            missing = np.isnan(ewma[:,q_])
+            starting = first[:,q_] & missing[group]
+            ewma[group[starting], q_] = values[starting, q_]
+        weights = np.where(valid, self.alpha*(1. - self.alpha)**(n_b[group] - 1 - position), 0.)
+        self.ewma[group_rows] = np.where(update, (1. - self.alpha)**n_b*ewma +
+                np.add.reduceat(weights*np.where(valid, values, 0.), starts, axis=0), ewma)
+        # Latest value, time and rate
+        last = latest[ends]
+        self.last[group_rows] = np.where(last >= starts[:,None], values[np.maximum(last, 0), quantities], self.last[group_rows])
+        self.last_time[group_rows] = np.where(last >= starts[:,None], times[np.maximum(last, 0)],
+                self.last_time[group_rows])
+        with_rate = np.maximum.accumulate(np.where(valid & (dt > 0), index[:,None], -1), axis=0)[ends]
+        self.rate[group_rows] = np.where(with_rate >= starts[:,None], rate[np.maximum(with_rate, 0), quantities],
+                self.rate[group_rows])
+        for row, s_, e_ in zip(group_rows.tolist(), starts.tolist(), ends.tolist()):
+            for q_, extremes in enumerate(self.extremes[row]):
+                if s_ == e_:
+                    extremes.Add(times[s_], values[s_, q_])
+                else:
+                    extremes.AddBatch(times[s_:e_+1], values[s_:e_+1, q_])
+        return events
+    def CheckAlarms(self, rows, times, values, rate, order, group_start, starts, ends):
+        """ Alarm transitions of the samples grouped by sensor, returned in the order the samples arrived """
+        events = []
+        index = np.arange(len(rows))
+        for a_, (alarm, name) in enumerate(zip(self.alarms, self.alarm_names)):
+            q_ = QUANTITIES.index(alarm.quantity)
+            value = rate[:,q_] if alarm.rate else values[:,q_]
+            checked = np.abs(value) if alarm.rate else value
+            firing = checked > alarm.limit if alarm.op == '>' else checked < alarm.limit
+            # Without a value (e.g. no rate yet) the state does not change
+            decided = np.maximum.accumulate(np.where(np.isnan(value), -1, index))
+            initial = self.active[rows, a_]
+            state = np.where(decided >= group_start, firing[np.maximum(decided, 0)], initial)
+            previous = np.where(index > group_start, np.r_[False, state[:-1]], initial)
+            for i in np.flatnonzero(state != previous).tolist():
+                sensor = self.names[rows[i]]
+                events.append((order[i], a_, AlarmEvent(times[i], sensor, name, value[i], bool(state[i]))))
+                if state[i]:
+                    self.n_alarms += 1
+                    logger.warning("Alarm %s for sensor %s: %s = %0.2f", name, sensor, alarm.quantity, value[i])
+                else:
+                    logger.info("Alarm %s for sensor %s cleared", name, sensor)
+            self.active[rows[starts], a_] = state[ends]
+        return [e_ for _, _, e_ in sorted(events, key=lambda e_: e_[:2])]
+    @property
+    def sensors(self):
+        return self.names
+    def ActiveAlarms(self):
+        """ List of (sensor, alarm name) """
+        rows, alarms = np.nonzero(self.active[:len(self.names)])
+        return [(self.names[r_], self.alarm_names[a_]) for r_, a_ in zip(rows.tolist(), alarms.tolist())]
+    def Snapshot(self):
+        """
+        Copy of the state as arrays with one row per sensor and one column per quantity:
+        {sensors, alarms, n, mean, std, min, max, ewma, last, rate, last_time, active (sensor x alarm)}
+        """
+        n_sensors = len(self.names)
+        n = self.n[:n_sensors].copy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.where(n > 1, np.sqrt(self.m2[:n_sensors]/(n - 1)), np.nan)
+        extremes = np.array([[(e_.min, e_.max) for e_ in row] for row in self.extremes]).reshape(n_sensors, len(QUANTITIES), 2)
+        return {"sensors":list(self.names), "alarms":list(self.alarm_names), "n":n,
+                "mean":np.where(n > 0, self.mean[:n_sensors], np.nan), "std":std,
+                "min":extremes[:,:,0], "max":extremes[:,:,1], "ewma":self.ewma[:n_sensors].copy(),
+                "last":self.last[:n_sensors].copy(), "rate":self.rate[:n_sensors].copy(),
+                "last_time":self.last_time[:n_sensors].copy(), "active":self.active[:n_sensors].copy()}
+    def Summary(self):
+        """ {sensor:{quantity:{n, mean, std, min, max, ewma, last, rate}}} """
+        snapshot = self.Snapshot()
+        return {sensor:{q_:{"n":int(snapshot["n"][row, i]), **{s_:snapshot[s_][row, i] for s_ in STATS}}
+                for i, q_ in enumerate(QUANTITIES)} for row, sensor in enumerate(snapshot["sensors"])}
+    def FormatSummary(self):
+        lines = [f"{'sensor':<12}" + "".join(f"{q_+' ['+UNITS[q_]+']':>34}" for q_ in QUANTITIES)]
+        lines.append(f"{'':<12}" + f"{'mean+-std   min..max(window)':>34}"*len(QUANTITIES))
+        for sensor, stats in self.Summary().items():
+            cells = [f"{s_['mean']:>9.2f}+-{s_['std']:<6.2f}{s_['min']:>8.2f}..{s_['max']:<7.2f}" for s_ in stats.values()]
+            lines.append(f"{sensor:<12}" + "".join(f"{c_:>34}" for c_ in cells))
+        active = self.ActiveAlarms()
+        if active:
+            lines.append("Active alarms: " + ", ".join(f"{alarm} ({sensor})" for sensor, alarm in active))
+        return "\n".join(lines)
@@ -0,0 +1,134 @@
+import re
+import math
+from collections import namedtuple
+import numpy as np
+
+# sensors is an array of sensor IDs (str), T and RH are float arrays of the same length
+ParsedRecords = namedtuple("ParsedRecords", ["sensors", "T", "RH", "n_malformed"])
+
+def ToFloat(values):
+    """
+    Converts a list of byte strings to a float array in one go.
+    Values which can not be converted become NaN; returns (array, mask of valid values).
+    Non-finite values (e.g. "nan" printed by a sensor after a failed read) are not valid.
+    """
+    try:
+        array = np.array(values, dtype=bytes).astype(np.float64)
+        return array, np.isfinite(array)
+    except ValueError:
+        array = np.full(len(values), np.nan)
+        for i, v_ in enumerate(values):
+            try:
+                array[i] = float(v_)
+            except ValueError:
+                pass
+        return array, np.isfinite(array)
+
+class ProtocolParser:
+    """
+    Parses the Arduino protocol ``id:T=<T>C,RH=<RH>%`` with records separated by ';'
+    directly from bytes. A well-formed readout is turned into one whitespace-separated
+    string of numbers and converted by NumPy in a single call. Readouts of at most
+    ``small_readout`` records are converted record by record instead, which is faster
+    than the fixed cost of the NumPy calls (see benchmarks/bench_parser.py).
+    Readouts that fail the checks go through a slower per-record path, where records
+    which do not follow the protocol or have non-finite values are counted in ``n_malformed``.
+    """
+    small_readout = 24
+    def __init__(self):
+        self.n_malformed = 0
+    def Parse(self, lines):
+        data = b';'.join(l_.strip() for l_ in lines).strip(b';')
+        if not data:
+            return ParsedRecords(np.array([], dtype=str), np.array([]), np.array([]), 0)
+        if data.count(b';') < self.small_readout:
+            records = self.ParseSmall(data)
+        else:
+            records = self.ParseFast(data)
+        if records is None:
+            records = self.ParseRecords(data)
+        self.n_malformed += records.n_malformed
+        return records
+    def ParseFast(self, data):
+        """ Returns None if the readout is not entirely well-formed """
+        n_records = data.count(b';') + 1
+        if not (data.count(b':T=') == n_records and data.count(b'C,RH=') == n_records and data.count(b'%') == n_records):
+            return None
+        numbers = data.replace(b':T=', b' ').replace(b'C,RH=', b' ').replace(b'%', b'').replace(b';', b' ')
+        try:
+            values = np.fromstring(numbers, sep=' ')
+        except ValueError:
+            return None
+        if len(values) != 3*n_records:
+            return None
+        values = values.reshape(-1, 3)
+        if not np.all(np.isfinite(values[:,1:])):
+            return None
+        ids = values[:,0].astype(np.int64)
+        if np.any(ids != values[:,0]) or np.any(ids < 0):
+            return None
+        return ParsedRecords(ids.astype(str), values[:,1], values[:,2], 0)
+    def ParseSmall(self, data):
+        """ Same as ParseFast() with a loop over the records """
+        sensors, T, RH = [], [], []
+        for record in data.split(b';'):
+            sensor, sep, rest = record.partition(b':T=')
+            t_, sep2, rh = rest.partition(b'C,RH=')
+            if not (sep and sep2 and rh.endswith(b'%') and sensor.isdigit()):
+                return None
+            try:
+                T.append(float(t_))
+                RH.append(float(rh[:-1]))
+            except ValueError:
+                return None
+            if not (math.isfinite(T[-1]) and math.isfinite(RH[-1])):
+                return None
+            sensors.append(str(int(sensor)))
+        return ParsedRecords(np.array(sensors), np.array(T), np.array(RH), 0)
+    def ParseRecords(self, data):
+        sensors, T, RH = [], [], []
+        n_malformed = 0
+        for record in data.split(b';'):
+            if not record:
+                continue
+            sensor, sep, rest = record.partition(b':T=')
+            t_, sep2, rh = rest.partition(b'C,RH=')
+            if not (sep and sep2 and rh.endswith(b'%') and sensor.isdigit()):
+                n_malformed += 1
+                continue
+            sensors.append(sensor)
+            T.append(t_)
+            RH.append(rh[:-1])
+        T, valid_t = ToFloat(T)
+        RH, valid_rh = ToFloat(RH)
+        valid = valid_t & valid_rh
+        n_malformed += int(np.count_nonzero(~valid))
+        sensors = np.array(sensors, dtype=bytes).astype(np.int64).astype(str)
+        return ParsedRecords(sensors[valid], T[valid], RH[valid], n_malformed)
+
+class RegexParser:
+    """
+    Fallback parser for other protocols, based on a regular expression with the named
+    groups 'sensor', 'T' and 'RH'. Every ';'-separated record without a match is counted
+    as malformed.
+    """
+    default_regexp = '(?P<sensor>[0-9]*):T=(?P<T>[+-]?[0-9]*.?[0-9]*)C,RH=(?P<RH>[+-]?[0-9]*.?[0-9]*)%'
+    def __init__(self, regexp=None):
+        self.regexp = re.compile(self.default_regexp if regexp is None else regexp, re.IGNORECASE)
+        self.n_malformed = 0
+    def Parse(self, lines):
+        sensors, T, RH = [], [], []
+        n_records = 0
+        for l_ in lines:
+            text = l_.decode('utf-8', errors='replace')
+            n_records += sum(1 for r_ in text.strip().split(';') if r_)
+            for match in self.regexp.finditer(text):
+                sensors.append(match.group('sensor'))
+                T.append(match.group('T'))
+                RH.append(match.group('RH'))
+        T, valid_t = ToFloat([t_.encode() for t_ in T])
+        RH, valid_rh = ToFloat([rh.encode() for rh in RH])
+        valid = valid_t & valid_rh
+        n_malformed = max(0, n_records - len(sensors)) + int(np.count_nonzero(~valid))
+        self.n_malformed += n_malformed
+        return ParsedRecords(np.array(sensors, dtype=str)[valid], T[valid], RH[valid], n_malformed)
@@ -0,0 +1,372 @@
+import os
+import io
+import re
+import csv
+import glob
+import gzip
+import logging
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from htmon.RunFile import RunFile
+from htmon.OnlineStats import DewPoint
+
+logger = logging.getLogger(__name__)
+
+# sensor_<id>.csv, rotated files sensor_<id>.<YYYYmmdd-HHMMSS>[-n].csv, optionally gzip-compressed
+CSV_PATTERN = re.compile(r'sensor_(.+?)(?:\.\d{8}-\d{6}(?:-\d+)?)?\.csv(?:\.gz)?')
+EVENTS_PATTERN = re.compile(r'events(?:\.\d{8}-\d{6}(?:-\d+)?)?\.csv(?:\.gz)?')
+COLUMNS = ("T", "RH")
+
+# Analysis settings, see ParseArguments; max_gap None means 3 steps
+Options = namedtuple("Options", ["step", "max_gap", "method", "before", "after", "plots", "event_plots"],
+        defaults=(60., None, "interp", 600., 600., True, False))
+
+SUMMARY_FIELDS = ["run", "sensor", "n", "start", "end",
+        "T_mean", "T_std", "T_min", "T_max", "RH_mean", "RH_std", "RH_min", "RH_max", "DP_mean", "DP_min", "DP_max"]
+EVENT_FIELDS = ["run", "time", "name", "description", "sensor", "n_before", "n_after",
+        "T_before", "T_after", "dT", "T_min", "T_max", "RH_before", "RH_after", "dRH", "RH_min", "RH_max"]
+
+def ReadBytes(path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            return f.read()
+    with open(path, "rb") as f:
+        return f.read()
+
+def ReadCsv(path):
+    """
+    (time, T, RH) arrays of a sensor CSV file, parsed in one call.
+    An incomplete last line, e.g. after a crash, is ignored.
+    """
+    data = ReadBytes(path)
+    start, end = data.find(b'\n') + 1, data.rfind(b'\n') + 1
+    if start == 0 or end <= start:
+        return np.array([]), np.array([]), np.array([])
+    try:
+        values = np.loadtxt(io.BytesIO(data[start:end]), delimiter=',', dtype=np.float64, ndmin=2)
+    except ValueError as error:
+        raise ValueError(f"{path}: {error}") from None
+    if values.shape[1] != 3:
+        raise ValueError(f"{path}: expected 3 columns, found {values.shape[1]}")
+    return values[:,0], values[:,1], values[:,2]
+
+def ReadEventsCsv(path):
+    """ (times, names, descriptions) of an events CSV file; descriptions may contain commas """
+    times, names, descriptions = [], [], []
+    for line in ReadBytes(path).decode('utf-8', errors='replace').splitlines()[1:]:
+        fields = line.split(',', 2)
+        if len(fields) < 2:
+            continue
+        try:
+            times.append(float(fields[0]))
+        except ValueError:
+            continue
+        names.append(fields[1])
+        descriptions.append(fields[2] if len(fields) > 2 else "")
+    return times, names, descriptions
+
+def IsRun(path):
+    return any(glob.glob(os.path.join(glob.escape(path), p_)) for p_ in ("sensor_*.htr", "sensor_*.csv*"))
+
+def FindRuns(paths):
+    """ Run directories among paths; a directory which is not a run itself contributes its run subdirectories """
+    runs = []
+    for path in paths:
+        if IsRun(path):
+            runs.append(path)
+        elif os.path.isdir(path):
+            runs += sorted(p_ for p_ in glob.glob(os.path.join(glob.escape(path), "*")) if os.path.isdir(p_) and IsRun(p_))
+        else:
+            logger.warning("%s is not a run directory", path)
+    return runs
+
+def LoadRun(run_dir):
+    """
+    Samples and events of a run directory: ({sensor:(time, T, RH)}, (times, names, descriptions)).
+    The binary files are used when they exist, otherwise the CSV files, including rotated ones.
+    Samples of each sensor are sorted by time.
+    """
+    try:
+        run = RunFile(run_dir)
+    except ValueError:
+        run = None
+    if run is not None and len(run.sensors) > 0:
+        data = {}
+        for sensor in run.sensors:
+            records = run.Samples(sensor)
+            data[sensor] = (records['time'].astype(np.float64), records['T'].astype(np.float64),
+                    records['RH'].astype(np.float64))
+        events = run.Events()
+    else:
+        files = {}
+        for path in sorted(glob.glob(os.path.join(glob.escape(run_dir), "sensor_*.csv*"))):
+            match = CSV_PATTERN.fullmatch(os.path.basename(path))
+            if match is not None:
+                files.setdefault(match.group(1), []).append(path)
+        data = {}
+        for sensor, paths in files.items():
+            data[sensor] = tuple(np.concatenate(c_) for c_ in zip(*(ReadCsv(p_) for p_ in paths)))
+        events = [], [], []
+        for path in sorted(glob.glob(os.path.join(glob.escape(run_dir), "events*.csv*"))):
+            if EVENTS_PATTERN.fullmatch(os.path.basename(path)):
+                events = tuple(a_ + b_ for a_, b_ in zip(events, ReadEventsCsv(path)))
+    for sensor, (times, T, RH) in data.items():
+        if np.any(np.diff(times) < 0):
+            order = np.argsort(times, kind='stable')
+            data[sensor] = times[order], T[order], RH[order]
+    order = np.argsort(events[0], kind='stable').tolist()
+    events = tuple([e_[i] for i in order] for e_ in events)
+    return data, events
+
+def TimeGrid(data, step):
+    """ Grid covering all sensors, aligned to multiples of step """
+    starts = [t_[0] for t_, T, RH in data.values() if len(t_) > 0]
+    ends = [t_[-1] for t_, T, RH in data.values() if len(t_) > 0]
+    if len(starts) == 0:
+        return np.array([])
+    start = np.floor(min(starts)/step)*step
+    return start + step*np.arange(int(np.floor((max(ends) - start)/step)) + 1)
+
+def Resample(times, values, grid, max_gap, method="interp"):
+    """
+    Columns of values (n, k) on the grid: linear interpolation ("interp") or the mean of the
+    samples closest to each grid point ("mean"). Interpolated grid points in a gap longer than
+    max_gap are NaN, as are averages without any sample.
+    """
+    result = np.full((len(grid), values.shape[1]), np.nan)
+    if len(times) == 0 or len(grid) == 0:
+        return result
+    if method == "mean":
+        step = grid[1] - grid[0] if len(grid) > 1 else 1.
+        bins = np.floor((times - grid[0])/step + 0.5).astype(np.int64)
+        inside = (bins >= 0) & (bins < len(grid))
+        for k in range(values.shape[1]):
+            valid = inside & ~np.isnan(values[:,k])
+            counts = np.bincount(bins[valid], minlength=len(grid))
+            sums = np.bincount(bins[valid], weights=values[valid, k], minlength=len(grid))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[:,k] = np.where(counts > 0, sums/counts, np.nan)
+        return result
+    right = np.clip(np.searchsorted(times, grid, side='right'), 1, len(times) - 1)
+    left_time, right_time = times[right - 1], times[right]
+    covered = (grid >= times[0]) & (grid <= times[-1]) & ((right_time - left_time <= max_gap) | (grid == left_time))
+    for k in range(values.shape[1]):
+        result[:,k] = np.where(covered, np.interp(grid, times, values[:,k]), np.nan)
+    return result
+
+def WindowStats(times, values, starts, ends):
+    """
+    Count, mean, minimum and maximum of the columns of values in the time windows [starts, ends),
+    for all windows at once with cumulative sums and reduceat. NaN values are skipped.
+    """
+    first, last = np.searchsorted(times, starts), np.searchsorted(times, ends)
+    valid = ~np.isnan(values)
+    counts = np.vstack([np.zeros((1, values.shape[1]), dtype=np.int64), np.cumsum(valid, axis=0)])
+    sums = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(np.where(valid, values, 0.), axis=0)])
+    n = counts[last] - counts[first]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (sums[last] - sums[first])/n
+    # reduceat over [first, last) pairs, with a padding row so that last may point past the end
+    indices = np.ravel([first, last], order='F')
+    low = np.vstack([np.where(valid, values, np.inf), np.full((1, values.shape[1]), np.inf)])
+    high = np.vstack([np.where(valid, values, -np.inf), np.full((1, values.shape[1]), -np.inf)])
+    minimum = np.minimum.reduceat(low, indices, axis=0)[::2] if len(indices) else np.empty((0, values.shape[1]))
+    maximum = np.maximum.reduceat(high, indices, axis=0)[::2] if len(indices) else np.empty((0, values.shape[1]))
+    empty = n == 0
+    return n, mean, np.where(empty, np.nan, minimum), np.where(empty, np.nan, maximum)
+
+def SensorSummary(times, T, RH):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        DP = DewPoint(T, RH)
+    stats = {"n":len(times), "start":times[0] if len(times) else np.nan, "end":times[-1] if len(times) else np.nan}
+    for name, values, functions in (("T", T, ("mean", "std", "min", "max")), ("RH", RH, ("mean", "std", "min", "max")),
+            ("DP", DP, ("mean", "min", "max"))):
+        valid = values[~np.isnan(values)]
+        for f_ in functions:
+            stats[f"{name}_{f_}"] = getattr(np, f_)(valid) if len(valid) else np.nan
+    return stats
+
+def WriteGrid(path, grid, data, resampled):
+    columns = [resampled[s_][:,k] for s_ in data for k in range(len(COLUMNS))]
+    values = np.column_stack([grid] + columns) if len(grid) else np.empty((0, 1 + len(columns)))
+    with open(path, "w") as f:
+        f.write(",".join(["time"] + [f"{s_}_{c_}" for s_ in data for c_ in COLUMNS]) + "\n")
+        row_format = ",".join(["%0.2f"]*values.shape[1]) + "\n"
+        chunk = 100000
+        for i in range(0, len(values), chunk):
+            v_ = values[i:i+chunk]
+            f.write((row_format*len(v_)) % tuple(v_.ravel().tolist()))
+
+def Envelope(x, y, max_points):
+    """ Minimum and maximum of y in max_points/2 buckets, interleaved, so that long series plot quickly without losing peaks """
+    bucket = int(np.ceil(2*len(x)/max_points))
+    if bucket <= 1:
+        return x, y
+    n_buckets = int(np.ceil(len(x)/bucket))
+    padded = np.full(n_buckets*bucket, np.nan)
+    padded[:len(y)] = y
+    padded = padded.reshape(n_buckets, bucket)
+    x_, y_ = np.empty(2*n_buckets), np.empty(2*n_buckets)
+    x_[0::2] = x[::bucket]
+    x_[1::2] = x[np.minimum(np.arange(n_buckets)*bucket + bucket//2, len(x) - 1)]
+    # fmin/fmax skip NaN, a bucket with NaN only stays NaN, leaving a gap in the line
+    y_[0::2] = np.fmin.reduce(padded, axis=1)
+    y_[1::2] = np.fmax.reduce(padded, axis=1)
+    return x_, y_
+
+def PlotRun(path, grid, resampled, events):
+    """ T and RH of all sensors on the grid, with the manual events, in hours from the start """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from htmon.SnapshotRenderer import EventMarkers, SetEventMarkers, EventLegend
+    fig = Figure(figsize=(8, 6), dpi=100)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(2, 1, sharex=True)
+    hours = (grid - grid[0])/3600.
+    for k, (ax, ylabel) in enumerate(zip(axes, ("Temperature [C]", "Relative humidity [%]"))):
+        for sensor, values in resampled.items():
+            ax.plot(*Envelope(hours, values[:,k], 2*fig.get_figwidth()*fig.dpi), label=f"Sensor {sensor}", linewidth=0.8)
+        markers = EventMarkers(ax)
+        SetEventMarkers(markers, (np.asarray(events[0]) - grid[0])/3600.)
+        EventLegend(ax, markers, events[1], fontsize=6)
+        ax.set_ylabel(ylabel, fontsize=9)
+    axes[1].set_xlabel("Time since start [h]", fontsize=9)
+    fig.savefig(path)
+
+def PlotEvent(path, time_, name, data, before, after):
+    """ Raw samples of all sensors around one event, in minutes from the event """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=(6, 5), dpi=100)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(2, 1, sharex=True)
+    for sensor, (times, T, RH) in data.items():
+        first, last = np.searchsorted(times, [time_ - before, time_ + after])
+        for ax, values in zip(axes, (T, RH)):
+            ax.plot((times[first:last] - time_)/60., values[first:last], label=f"Sensor {sensor}", linewidth=0.8)
+    for ax, ylabel in zip(axes, ("Temperature [C]", "Relative humidity [%]")):
+        ax.axvline(0., color='k', linestyle='--')
+        ax.set_ylabel(ylabel, fontsize=9)
+    axes[0].set_title(name, fontsize=9)
+    if len(data) > 0:
+        axes[0].legend(fontsize=6)
+    axes[1].set_xlabel("Time since event [min]", fontsize=9)
+    fig.savefig(path)
+
+def AnalyzeRun(run_dir, outdir, options):
+    """
+    Analysis of one run, meant to run in a worker process: writes the resampled data
+    (grid.csv) and plots to outdir, and returns the summary and event rows,
+    which are small, so that the large arrays never travel between processes.
+    """
+    name = os.path.basename(os.path.normpath(run_dir))
+    data, events = LoadRun(run_dir)
+    os.makedirs(outdir, exist_ok=True)
+    max_gap = 3*options.step if options.max_gap is None else options.max_gap
+    grid = TimeGrid(data, options.step)
+    resampled = {s_:Resample(t_, np.column_stack([T, RH]), grid, max_gap, options.method) for s_, (t_, T, RH) in data.items()}
+    WriteGrid(os.path.join(outdir, "grid.csv"), grid, data, resampled)
+    summary = [dict(run=name, sensor=s_, **SensorSummary(*d_)) for s_, d_ in data.items()]
+    event_times = np.asarray(events[0], dtype=np.float64)
+    event_rows = []
+    for sensor, (times, T, RH) in data.items():
+        values = np.column_stack([T, RH])
+        # Windows before, after and around all events in one pass
+        starts = np.concatenate([event_times - options.before, event_times, event_times - options.before])
+        ends = np.concatenate([event_times, event_times + options.after, event_times + options.after])
+        n, mean, minimum, maximum = WindowStats(times, values, starts, ends)
+        (n_before, n_after, _), (mean_before, mean_after, _) = np.split(n, 3), np.split(mean, 3)
+        minimum, maximum = np.split(minimum, 3)[2], np.split(maximum, 3)[2]
+        for i, (time_, event, description) in enumerate(zip(*events)):
+            row = dict(run=name, time=time_, name=event, description=description, sensor=sensor,
+                    n_before=n_before[i, 0], n_after=n_after[i, 0])
+            for k, c_ in enumerate(COLUMNS):
+                row.update({f"{c_}_before":mean_before[i, k], f"{c_}_after":mean_after[i, k],
+                        f"d{c_}":mean_after[i, k] - mean_before[i, k], f"{c_}_min":minimum[i, k], f"{c_}_max":maximum[i, k]})
+            event_rows.append(row)
+    if options.plots and len(grid) > 0:
+        PlotRun(os.path.join(outdir, "overview.png"), grid, resampled, events)
+    if options.event_plots:
+        for i, (time_, event) in enumerate(zip(events[0], events[1])):
+            label = re.sub(r'[^A-Za-z0-9_.-]+', '_', event)[:40]
+            PlotEvent(os.path.join(outdir, f"event_{i:04d}_{label}.png"), time_, event, data, options.before, options.after)
+    return summary, event_rows
+
+def AnalyzeRunSafe(run_dir, outdir, options):
+    """ AnalyzeRun which reports errors instead of raising them, so one bad run does not stop the others """
+    try:
+        return AnalyzeRun(run_dir, outdir, options), None
+    except (OSError, ValueError) as error:
+        return ([], []), str(error)
+
+def OutputNames(runs):
+    """ Output subdirectory of each run: its name, made unique """
+    names, seen = [], {}
+    for run in runs:
+        name = os.path.basename(os.path.normpath(run)) or "run"
+        seen[name] = seen.get(name, 0) + 1
+        names.append(name if seen[name] == 1 else f"{name}-{seen[name]}")
+    return names
+
+def WriteTable(path, fields, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k_:(f"{v_:0.3f}" if isinstance(v_, (float, np.floating)) else v_) for k_, v_ in row.items()})
+
+def AnalyzeRuns(runs, outdir, options=Options(), jobs=None):
+    """
+    Analyzes the runs in parallel, one process per run, and writes summary.csv and
+    events.csv with the rows of all runs. Returns the number of runs which failed.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    outdirs = [os.path.join(outdir, n_) for n_ in OutputNames(runs)]
+    summary, event_rows, n_failed = [], [], 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(AnalyzeRunSafe, runs, outdirs, [options]*len(runs))
+        for run, ((run_summary, run_events), error) in zip(runs, results):
+            if error is not None:
+                logger.error("Could not analyze %s: %s", run, error)
+                n_failed += 1
+                continue
+            logger.info("Analyzed %s: %d sensors, %d events", run, len(run_summary), len(run_events))
+            summary += run_summary
+            event_rows += run_events
+    WriteTable(os.path.join(outdir, "summary.csv"), SUMMARY_FIELDS, summary)
+    WriteTable(os.path.join(outdir, "events.csv"), EVENT_FIELDS, event_rows)
+    return n_failed
+
+def ParseArguments(argv=None):
+    parser = argparse.ArgumentParser(prog="htmon", description="Tools for recorded humidity/temperature runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    analyze = commands.add_parser("analyze", help="summarize run directories, resample them on a common time grid "
+            "and slice them around the manual events")
+    analyze.add_argument("runs", nargs="+", help="run directories, or directories containing run directories")
+    analyze.add_argument("-o", "--outdir", required=True, help="output directory")
+    analyze.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: number of CPUs)")
+    analyze.add_argument("--step", type=float, default=60., help="time grid step [s]")
+    analyze.add_argument("--max-gap", type=float, default=None, help="longest gap bridged on the grid [s] (default: 3 steps)")
+    analyze.add_argument("--method", choices=("interp", "mean"), default="interp",
+            help="interpolate to the grid points or average the samples around them")
+    analyze.add_argument("--before", type=float, default=600., help="window before each event [s]")
+    analyze.add_argument("--after", type=float, default=600., help="window after each event [s]")
+    analyze.add_argument("--no-plots", action="store_true", help="do not plot the runs")
+    analyze.add_argument("--event-plots", action="store_true", help="plot the data around every event")
+    analyze.add_argument("--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR"))
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = ParseArguments(argv)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    runs = FindRuns(args.runs)
+    if len(runs) == 0:
+        logger.error("No run directories found")
+        return 1
+    options = Options(step=args.step, max_gap=args.max_gap, method=args.method, before=args.before, after=args.after,
+            plots=not args.no_plots, event_plots=args.event_plots)
+    n_failed = AnalyzeRuns(runs, args.outdir, options, jobs=args.jobs)
+    logger.info("Analyzed %d runs, %d failed; results in %s", len(runs) - n_failed, n_failed, args.outdir)
+    return 1 if n_failed > 0 else 0
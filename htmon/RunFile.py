@@ -0,0 +1,143 @@
+import os
+import glob
+import numpy as np
+
+# Fixed-width records; every file starts with a 16 byte header
+SAMPLE_DTYPE = np.dtype([('time', '<f8'), ('T', '<f4'), ('RH', '<f4')])
+EVENT_DTYPE = np.dtype([('time', '<f8'), ('name', 'S64'), ('description', 'S256')])
+MAGIC = b'HTMONRUN'
+VERSION = 1
+HEADER_SIZE = 16
+
+def Header(dtype):
+    return MAGIC + np.array([VERSION, dtype.itemsize], dtype='<u4').tobytes()
+
+def SampleFileName(run_dir, sensor):
+    return os.path.join(run_dir, f"sensor_{sensor}.htr")
+
+def EventFileName(run_dir):
+    return os.path.join(run_dir, "events.htr")
+
+class BinaryFile:
+    """
+    Append-only file of fixed-width records, written in chunks.
+    When an existing file is reopened (e.g. after a crash), an incomplete
+    trailing record is cut off, so that writing continues at a record boundary.
+    """
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = dtype
+        self.file = None
+        self.Open()
+    def Open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER_SIZE:
+            size = os.path.getsize(self.path)
+            n_records = (size - HEADER_SIZE)//self.dtype.itemsize
+            self.file = open(self.path, "r+b")
+            self.file.truncate(HEADER_SIZE + n_records*self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(self.path, "wb")
+            self.file.write(Header(self.dtype))
+    def Write(self, records):
+        self.file.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+    def Flush(self, fsync=False):
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+    def Close(self):
+        self.file.close()
+
+def SampleRecords(times, T, RH):
+    records = np.empty(len(times), dtype=SAMPLE_DTYPE)
+    records['time'] = times
+    records['T'] = T
+    records['RH'] = RH
+    return records
+
+def EventRecords(times, names, descriptions):
+    records = np.zeros(len(times), dtype=EVENT_DTYPE)
+    records['time'] = times
+    # Strings longer than the field are cut at the field width
+    records['name'] = [str(n_).encode('utf-8')[:64] for n_ in names]
+    records['description'] = [str(d_).encode('utf-8')[:256] for d_ in descriptions]
+    return records
+
+def ReadRecords(path, dtype):
+    """ Read-only memory map of the complete records of a file """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if header[:8] != MAGIC:
+        raise ValueError(f"{path} is not a run file")
+    version, itemsize = np.frombuffer(header[8:], dtype='<u4')
+    if version != VERSION or itemsize != dtype.itemsize:
+        raise ValueError(f"{path}: unsupported version {version} or record size {itemsize}")
+    n_records = (os.path.getsize(path) - HEADER_SIZE)//dtype.itemsize
+    if n_records == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(n_records,))
+
+class RunFile:
+    """
+    Reader of a run directory written by DataWriter in the binary format:
+    one ``sensor_<id>.htr`` file per sensor and ``events.htr``.
+    Data is accessed through memory maps, so opening a run costs almost nothing
+    regardless of its length.
+    """
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.sensors = sorted(os.path.basename(p_)[len("sensor_"):-len(".htr")]
+                for p_ in glob.glob(os.path.join(run_dir, "sensor_*.htr")))
+        if len(self.sensors) == 0 and not os.path.exists(EventFileName(run_dir)):
+            raise ValueError(f"No run files found in {run_dir}")
+    def Samples(self, sensor):
+        """ Structured array with fields time, T and RH """
+        return ReadRecords(SampleFileName(self.run_dir, sensor), SAMPLE_DTYPE)
+    def Events(self):
+        """ Returns (time, name, description) lists """
+        if not os.path.exists(EventFileName(self.run_dir)):
+            return [], [], []
+        records = ReadRecords(EventFileName(self.run_dir), EVENT_DTYPE)
+        return (records['time'].tolist(),
+                [n_.decode('utf-8', errors='replace') for n_ in records['name']],
+                [d_.decode('utf-8', errors='replace') for d_ in records['description']])
+    def Timeline(self):
+        """ All samples of all sensors sorted by time, as (sensors, time, T, RH) arrays """
+        sensors, times, T, RH = [], [], [], []
+        for sensor in self.sensors:
+            records = self.Samples(sensor)
+            sensors.append(np.full(len(records), sensor))
+            times.append(records['time'])
+            T.append(records['T'])
+            RH.append(records['RH'])
+        if len(times) == 0:
+            return np.array([], dtype=str), np.array([]), np.array([]), np.array([])
+        times = np.concatenate(times)
+        order = np.argsort(times, kind='stable')
+        return np.concatenate(sensors)[order], times[order], np.concatenate(T)[order], np.concatenate(RH)[order]
+
+def ExportCsv(run_dir, outdir=None):
+    """ Converts a binary run into the CSV files written by the monitor """
+    from htmon.DataWriter import FormatRows
+    outdir = run_dir if outdir is None else outdir
+    run = RunFile(run_dir)
+    for sensor in run.sensors:
+        records = run.Samples(sensor)
+        with open(os.path.join(outdir, f"sensor_{sensor}.csv"), "w") as f:
+            f.write("time,T,RH\n")
+            chunk = 100000
+            for i in range(0, len(records), chunk):
+                r_ = records[i:i+chunk]
+                f.write(FormatRows(r_['time'], r_['T'], r_['RH']))
+    with open(os.path.join(outdir, "events.csv"), "w") as f:
+        f.write("time,name,description\n")
+        for event in zip(*run.Events()):
+            f.write("%0.2f,%s,%s\n" % event)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert a binary run directory to CSV files")
+    parser.add_argument("run_dir")
+    parser.add_argument("outdir", nargs="?", default=None)
+    args = parser.parse_args()
+    ExportCsv(args.run_dir, args.outdir)
@@ -0,0 +1,156 @@
+import numpy as np
+
+class ColumnBuffer:
+    """
+    Set of equally long NumPy columns kept in contiguous memory.
+    Columns grow geometrically until ``capacity`` rows are stored. After that the
+    buffer behaves like a ring: the oldest rows are dropped, but the data lives in
+    a backing array twice the capacity, so the retained rows always form one
+    contiguous slice and ``View`` never has to copy.
+    Rows are addressed by absolute index, counted from the first row ever added.
+    """
+    def __init__(self, dtypes, capacity=None, initial_size=1024):
+        self.dtypes = dict(dtypes)
+        self.capacity = capacity
+        if capacity is not None:
+            initial_size = max(1, min(initial_size, 2*capacity))
+        self.columns = {name:np.empty(initial_size, dtype=dt) for name, dt in self.dtypes.items()}
+        self.start = 0 # position of the oldest retained row in the backing arrays
+        self.stop = 0  # position after the newest row in the backing arrays
+        self.first_index = 0 # absolute index of the oldest retained row
+    def __len__(self):
+        return self.stop - self.start
+    @property
+    def total(self):
+        """ Number of rows ever appended, including dropped ones """
+        return self.first_index + len(self)
+    def nbytes(self):
+        return sum(c.nbytes for c in self.columns.values())
+    def Append(self, keep_dropped=False, **values):
+        """
+        Appends rows given as keyword arguments (scalars or arrays of equal length).
+        If the capacity is exceeded, the oldest rows are dropped. With keep_dropped=True
+        they are returned as a dict of arrays, so that the caller can spill them; otherwise
+        None is returned.
+        """
+        arrays = {name:np.atleast_1d(np.asarray(values[name], dtype=dt)) for name, dt in self.dtypes.items()}
+        n_new = len(next(iter(arrays.values())))
+        dropped = None
+        if self.capacity is not None and n_new > self.capacity:
+            # Only the newest ``capacity`` rows can be kept
+            n_skip = n_new - self.capacity
+            if keep_dropped:
+                dropped = {name:np.concatenate([self.View(name), arrays[name][:n_skip]]) for name in arrays}
+            self.first_index += len(self) + n_skip
+            self.start = self.stop = 0
+            arrays = {name:a[n_skip:] for name, a in arrays.items()}
+            n_new = self.capacity
+        elif self.capacity is not None and len(self) + n_new > self.capacity:
+            dropped = self._Drop(len(self) + n_new - self.capacity, keep_dropped)
+        if self.stop + n_new > len(next(iter(self.columns.values()))):
+            self._Grow(n_new)
+        for name, a in arrays.items():
+            self.columns[name][self.stop:self.stop+n_new] = a
+        self.stop += n_new
+        return dropped
+    def _Drop(self, n_drop, keep_dropped=False):
+        """ Drops n_drop oldest rows, returning copies of them if requested """
+        dropped = None
+        if keep_dropped:
+            dropped = {name:c[self.start:self.start+n_drop].copy() for name, c in self.columns.items()}
+        self.start += n_drop
+        self.first_index += n_drop
+        return dropped
+    def _Grow(self, n_new):
+        """ Makes room for n_new rows after self.stop, either by reallocating or by compacting """
+        size = len(next(iter(self.columns.values())))
+        n_keep = len(self) + n_new
+        new_size = max(size*2, n_keep)
+        if self.capacity is not None:
+            new_size = max(min(new_size, 2*self.capacity), n_keep)
+        for name, old in self.columns.items():
+            if new_size != size:
+                column = np.empty(new_size, dtype=self.dtypes[name])
+            else:
+                # Backing array is at its final size: compact retained rows to the front.
+                # This happens at most once per ``capacity`` appended rows.
+                column = old
+            column[:len(self)] = old[self.start:self.stop]
+            self.columns[name] = column
+        self.stop = len(self)
+        self.start = 0
+    def View(self, name, first=None, last=None):
+        """
+        Zero-copy view of a column between absolute indices [first, last).
+        Rows that were already dropped are silently skipped.
+        """
+        first = self.first_index if first is None else max(first, self.first_index)
+        last = self.total if last is None else min(last, self.total)
+        first = min(first, last)
+        offset = self.start - self.first_index
+        return self.columns[name][first+offset:last+offset]
+
+class SampleStore:
+    """
+    Stores temperature and humidity samples of all sensors.
+    Every sensor has its own ColumnBuffer with float64 time and float32 T/RH columns.
+    Memory is bounded by ``max_samples`` per sensor (None means unbounded).
+    When a sensor reaches the limit, the oldest samples are evicted; with
+    policy = "spill" they are passed to ``spill_callback(sensor, first, time, T, RH)`` first,
+    where ``first`` is the absolute index of the first dropped sample, e.g. to write
+    them to disk before they are forgotten.
+    """
+    dtypes = {'time':np.float64, 'T':np.float32, 'RH':np.float32}
+    def __init__(self, max_samples=1000000, policy="evict", spill_callback=None):
+        if policy not in ("evict", "spill"):
+            raise ValueError(f"Unknown policy {policy}")
+        self.max_samples = max_samples
+        self.policy = policy
+        self.spill_callback = spill_callback
+        self.buffers = {}
+    def __len__(self):
+        return len(self.buffers)
+    def __contains__(self, sensor):
+        return sensor in self.buffers
+    def __iter__(self):
+        return iter(self.buffers)
+    def Sensors(self):
+        return list(self.buffers)
+    def Append(self, sensor, time, T, RH):
+        """ Appends one or many samples of a single sensor """
+        if sensor not in self.buffers:
+            self.buffers[sensor] = ColumnBuffer(self.dtypes, capacity=self.max_samples)
+        spill = self.policy == "spill" and self.spill_callback is not None
+        dropped = self.buffers[sensor].Append(keep_dropped=spill, time=time, T=T, RH=RH)
+        if spill and dropped is not None and len(dropped['time']) > 0:
+            first = self.buffers[sensor].first_index - len(dropped['time'])
+            self.spill_callback(sensor, first, dropped['time'], dropped['T'], dropped['RH'])
+    def AppendBatch(self, sensors, time, T, RH):
+        """
+        Appends a batch of samples of possibly different sensors.
+        ``sensors`` is a sequence of sensor IDs, ``time`` is either a scalar or an array.
+        """
+        sensors = np.asarray(sensors)
+        time = np.broadcast_to(np.asarray(time, dtype=np.float64), sensors.shape)
+        T = np.asarray(T)
+        RH = np.asarray(RH)
+        for sensor in dict.fromkeys(sensors.tolist()):
+            mask = sensors == sensor
+            self.Append(sensor, time[mask], T[mask], RH[mask])
+    def Get(self, sensor, column, first=None, last=None):
+        """ Zero-copy view of a column of a sensor, see ColumnBuffer.View """
+        return self.buffers[sensor].View(column, first, last)
+    def Count(self, sensor):
+        """ Total number of samples ever stored for a sensor """
+        return self.buffers[sensor].total
+    def TimeRange(self):
+        """ (first, last) time over all sensors, None if the store is empty """
+        t_min = [b.View('time')[0] for b in self.buffers.values() if len(b) > 0]
+        t_max = [b.View('time')[-1] for b in self.buffers.values() if len(b) > 0]
+        if len(t_min) == 0:
+            return None
+        return min(t_min), max(t_max)
+    def nbytes(self):
+        return sum(b.nbytes() for b in self.buffers.values())
+    def Clear(self):
+        self.buffers = {}
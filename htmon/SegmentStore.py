@@ -0,0 +1,207 @@
+import os
+import shutil
+import tempfile
+from bisect import bisect_left, bisect_right
+import numpy as np
+from htmon.RunFile import BinaryFile, ReadRecords, SampleRecords, SAMPLE_DTYPE
+
+COLUMNS = ('T', 'RH')
+# Min/max bin, as in MinMaxPyramid: start and end time, and the extremes of every column with their times
+BIN_DTYPE = np.dtype([('t', '<f8'), ('t_end', '<f8')] + [(f'{c}_{side}{suffix}', '<f8' if suffix else '<f4')
+        for c in COLUMNS for side in ('lo', 'hi') for suffix in ('', '_t')])
+
+def RawBins(records):
+    """ Samples (SAMPLE_DTYPE) as bins of one sample each """
+    bins = np.empty(len(records), dtype=BIN_DTYPE)
+    bins['t'] = bins['t_end'] = records['time']
+    for c in COLUMNS:
+        for side in ('lo', 'hi'):
+            bins[f'{c}_{side}'] = records[c]
+            bins[f'{c}_{side}_t'] = records['time']
+    return bins
+
+def ReduceBins(bins, factor):
+    """ Merges groups of factor consecutive bins (the last group may be shorter). NaN values are skipped """
+    n = len(bins)
+    n_groups = -(-n//factor)
+    starts = np.arange(n_groups)*factor
+    reduced = np.empty(n_groups, dtype=BIN_DTYPE)
+    reduced['t'] = bins['t'][starts]
+    reduced['t_end'] = bins['t_end'][np.minimum(starts + factor, n) - 1]
+    for c in COLUMNS:
+        for side, fill, reduce_ in (('lo', np.inf, np.argmin), ('hi', -np.inf, np.argmax)):
+            values = np.full(n_groups*factor, fill, dtype=np.float32)
+            values[:n] = np.where(np.isnan(bins[f'{c}_{side}']), fill, bins[f'{c}_{side}'])
+            # Padding is never selected: real values come first and argmin/argmax return the first extreme
+            index = starts + reduce_(values.reshape(n_groups, factor), axis=1)
+            reduced[f'{c}_{side}'] = bins[f'{c}_{side}'][index]
+            reduced[f'{c}_{side}_t'] = bins[f'{c}_{side}_t'][index]
+    return reduced
+
+def BinPoints(bins, column):
+    """ Bins as (time, value) points, minimum and maximum of every bin in the order they occurred """
+    lo, lo_t, hi, hi_t = (bins[f'{column}_{n_}'] for n_ in ('lo', 'lo_t', 'hi', 'hi_t'))
+    lo_first = lo_t <= hi_t
+    times = np.empty(2*len(bins), dtype=np.float64)
+    values = np.empty(2*len(bins), dtype=np.float32)
+    times[0::2] = np.where(lo_first, lo_t, hi_t)
+    times[1::2] = np.where(lo_first, hi_t, lo_t)
+    values[0::2] = np.where(lo_first, lo, hi)
+    values[1::2] = np.where(lo_first, hi, lo)
+    return times, values
+
+class SensorHistory:
+    """
+    Samples of one sensor on disk, in segments of segment_size samples. Every segment is
+    written once as a raw file and one min/max summary file per factor, and read back
+    through memory maps. Only the segment boundaries are kept in memory, plus the samples
+    which do not fill a segment yet.
+    """
+    oversample = 16 # bins read per bin shown at most, the stored levels are far apart
+    initial_pending = 1024
+    def __init__(self, prefix, segment_size, factors):
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.factors = factors
+        self.starts = [] # first time of every segment
+        self.ends = [] # last time of every segment
+        self.raw = []
+        self.summaries = [[] for f_ in factors]
+        # Samples which do not fill a segment yet, in a buffer which grows up to the segment size
+        self.pending = np.empty(min(self.initial_pending, segment_size), dtype=SAMPLE_DTYPE)
+        self.n_pending = 0
+        self.pending_range = (np.inf, -np.inf)
+        self.cache = {}
+    def __len__(self):
+        return len(self.starts)*self.segment_size + self.n_pending
+    def Append(self, records):
+        while len(records) > 0:
+            n = min(len(records), self.segment_size - self.n_pending)
+            if self.n_pending + n > len(self.pending):
+                pending = np.empty(min(max(2*len(self.pending), self.n_pending + n), self.segment_size), dtype=SAMPLE_DTYPE)
+                pending[:self.n_pending] = self.Pending()
+                self.pending = pending
+            chunk, records = records[:n], records[n:]
+            self.pending[self.n_pending:self.n_pending + n] = chunk
+            self.n_pending += n
+            self.pending_range = (min(self.pending_range[0], chunk['time'].min()), max(self.pending_range[1], chunk['time'].max()))
+            if self.n_pending == self.segment_size:
+                self.WriteSegment(self.pending)
+                self.n_pending = 0
+                self.pending_range = (np.inf, -np.inf)
+        self.cache = {}
+    def Pending(self):
+        return self.pending[:self.n_pending]
+    def WriteSegment(self, records):
+        # Samples arrive in time order per sensor, but a segment is sorted in case they do not
+        # (np.sort copies, the pending buffer is reused)
+        records = np.sort(records, order='time', kind='stable')
+        n = len(self.starts)
+        paths = [f"{self.prefix}_{n:06d}.htr"] + [f"{self.prefix}_{n:06d}.{f_}.htr" for f_ in self.factors]
+        contents = [records] + [ReduceBins(RawBins(records), f_) for f_ in self.factors]
+        for path, content in zip(paths, contents):
+            file = BinaryFile(path, content.dtype)
+            file.Write(content)
+            file.Close()
+        self.raw.append(ReadRecords(paths[0], SAMPLE_DTYPE))
+        for summaries, path in zip(self.summaries, paths[1:]):
+            summaries.append(ReadRecords(path, BIN_DTYPE))
+        self.starts.append(records['time'][0])
+        self.ends.append(records['time'][-1])
+    def TimeRange(self):
+        times = self.starts[:1] + self.ends[-1:]
+        if self.n_pending > 0:
+            times += list(self.pending_range)
+        return (min(times), max(times)) if times else None
+    def Bins(self, t_min, t_max, max_points):
+        """
+        Bins covering [t_min, t_max], at the finest resolution that gives at most about max_points
+        points: one per raw sample, two per min/max bin. Returns (bins, raw), raw is True if every
+        bin is a single sample.
+        """
+        max_bins = max(1, max_points//2)
+        key = (t_min, t_max, max_points)
+        if key in self.cache:
+            return self.cache[key]
+        # Segments overlapping the window, found by bisection on their boundaries
+        i0, i1 = bisect_left(self.ends, t_min), bisect_right(self.starts, t_max)
+        pending = self.Pending()
+        pending = pending[(pending['time'] >= t_min) & (pending['time'] <= t_max)]
+        n = (i1 - i0)*self.segment_size + len(pending)
+        if i1 > i0:
+            # Only the first and last segment can be partly outside of the window
+            n -= np.searchsorted(self.raw[i0]['time'], t_min)
+            n -= self.segment_size - np.searchsorted(self.raw[i1 - 1]['time'], t_max, side='right')
+        # Raw samples or the finest summary level which is not much larger than needed
+        level = None
+        if n > self.oversample*max_bins:
+            level = len(self.factors) - 1
+            for k, f_ in enumerate(self.factors):
+                if n/f_ <= self.oversample*max_bins:
+                    level = k
+                    break
+        pieces = []
+        for s_ in range(i0, i1):
+            if level is None:
+                records = self.raw[s_]
+                times = records['time']
+                pieces.append(RawBins(records[np.searchsorted(times, t_min):np.searchsorted(times, t_max, side='right')]))
+            else:
+                bins = self.summaries[level][s_]
+                pieces.append(np.array(bins[np.searchsorted(bins['t_end'], t_min):np.searchsorted(bins['t'], t_max, side='right')]))
+        pending = RawBins(pending)
+        pieces.append(pending if level is None or len(pending) == 0 else ReduceBins(pending, self.factors[level]))
+        bins = np.concatenate(pieces)
+        raw = level is None and len(bins) <= max_points
+        if not raw and len(bins) > max_bins:
+            bins = ReduceBins(bins, -(-len(bins)//max_bins))
+            raw = False
+        self.cache = {key:(bins, raw)}
+        return bins, raw
+
+class SegmentStore:
+    """
+    History of samples evicted from memory (e.g. by SampleStore with the "spill" policy),
+    paged out to segment files in a temporary directory created in ``directory``.
+    Render() gives the samples of any time window with a bounded number of points:
+    the segments in the window are found by bisection over their time boundaries and
+    read at the resolution needed, raw or from a min/max summary, through memory maps.
+    Memory use does not grow with the length of the history.
+    """
+    def __init__(self, directory=None, segment_size=65536, factors=(64, 4096)):
+        self.directory = tempfile.mkdtemp(prefix="htmon-history-", dir=directory)
+        self.segment_size = segment_size
+        self.factors = factors
+        self.sensors = {}
+    def __contains__(self, sensor):
+        return sensor in self.sensors
+    def Append(self, sensor, times, T, RH):
+        if sensor not in self.sensors:
+            prefix = os.path.join(self.directory, f"sensor{len(self.sensors):04d}")
+            self.sensors[sensor] = SensorHistory(prefix, self.segment_size, self.factors)
+        self.sensors[sensor].Append(SampleRecords(times, T, RH))
+    def Count(self, sensor):
+        return len(self.sensors[sensor]) if sensor in self.sensors else 0
+    def TimeRange(self):
+        """ (first, last) time over all sensors, None if the history is empty """
+        ranges = [r_ for r_ in (h_.TimeRange() for h_ in self.sensors.values()) if r_ is not None]
+        if len(ranges) == 0:
+            return None
+        return min(r_[0] for r_ in ranges), max(r_[1] for r_ in ranges)
+    def Render(self, sensor, column, t_min=-np.inf, t_max=np.inf, max_points=2000):
+        """ (time, value) arrays of a column within [t_min, t_max] with at most about max_points points """
+        if sensor not in self.sensors:
+            return np.array([]), np.array([], dtype=np.float32)
+        bins, raw = self.sensors[sensor].Bins(t_min, t_max, max_points)
+        if raw:
+            return bins['t'], bins[f'{column}_lo']
+        return BinPoints(bins, column)
+    def Clear(self):
+        for history in self.sensors.values():
+            history.raw, history.summaries = [], []
+        self.sensors = {}
+        for name in os.listdir(self.directory):
+            os.unlink(os.path.join(self.directory, name))
+    def Close(self):
+        self.sensors = {}
+        shutil.rmtree(self.directory, ignore_errors=True)
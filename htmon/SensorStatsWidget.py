@@ -0,0 +1,51 @@
+from PyQt5.QtWidgets import (
+            QWidget, QTableWidget, QTableWidgetItem, QVBoxLayout
+            )
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QColor
+
+class SensorStatsWidget(QWidget):
+    """
+    Window with the running statistics of every sensor from an OnlineStats.
+    It is refreshed every second while it is visible; sensors with an active alarm are highlighted.
+    """
+    columns = [("T", "last"), ("T", "mean"), ("T", "std"), ("T", "min"), ("T", "max"), ("T", "rate"),
+            ("RH", "last"), ("RH", "mean"), ("RH", "std"), ("RH", "min"), ("RH", "max"),
+            ("DP", "last"), ("AH", "last")]
+    def __init__(self, online_stats, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Sensor statistics")
+        self.online_stats = online_stats
+        self.layout = QVBoxLayout()
+        self.table = QTableWidget()
+        self.table.setColumnCount(len(self.columns) + 2)
+        self.table.setHorizontalHeaderLabels(["Sensor"] + [f"{q_} {s_}" if s_ != "rate" else f"d{q_}/dt [1/min]"
+                for q_, s_ in self.columns] + ["Alarms"])
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.layout.addWidget(self.table)
+        self.setLayout(self.layout)
+        self.resize(1100, 400)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.Refresh)
+    def Refresh(self):
+        summary = self.online_stats.Summary()
+        alarms = {}
+        for sensor, alarm in self.online_stats.ActiveAlarms():
+            alarms.setdefault(sensor, []).append(alarm)
+        self.table.setRowCount(len(summary))
+        for row, (sensor, stats) in enumerate(summary.items()):
+            cells = [sensor] + [f"{stats[q_][s_]:0.2f}" for q_, s_ in self.columns] + [", ".join(alarms.get(sensor, []))]
+            for column, text in enumerate(cells):
+                item = self.table.item(row, column)
+                if item is None:
+                    item = QTableWidgetItem()
+                    self.table.setItem(row, column, item)
+                item.setText(text)
+                item.setBackground(QColor(255, 200, 200) if sensor in alarms else QColor(255, 255, 255))
+    def showEvent(self, event):
+        self.Refresh()
+        self.timer.start(1000)
+        super().showEvent(event)
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
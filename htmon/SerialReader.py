@@ -0,0 +1,213 @@
+import os
+import queue
+import selectors
+import threading
+from collections import namedtuple
+from time import time
+import numpy as np
+
+# lines and latency are dicts keyed by device label
+Measurement = namedtuple("Measurement", ["request_time", "lines", "latency", "complete"])
+
+def DeviceLabels(addresses):
+    """ Short unique labels of the devices, used to tag their sensors """
+    labels = []
+    for i, address in enumerate(addresses):
+        label = os.path.basename(address)
+        if label in labels or address == "dummy":
+            label = f"{label}{i}"
+        labels.append(label)
+    return labels
+
+def SensorKey(device, sensors, n_devices):
+    """ With several devices, sensor IDs (an array) are prefixed by the device label """
+    if n_devices == 1:
+        return sensors
+    return np.char.add(f"{device}-", sensors)
+
+def OpenDevice(address, baud):
+    """ Opens a serial device, or a DummySerial for the address "dummy". pyserial is imported only when needed """
+    if address == "dummy":
+        from htmon.DummySerial import DummySerial
+        return DummySerial()
+    import serial
+    # Reads are driven by the SerialReader, so they must not block
+    return serial.Serial(address, baud, timeout = 0)
+
+class DeviceState:
+    """ Framing and bookkeeping of one device within a SerialReader """
+    def __init__(self, label, serial, separator=b';'):
+        self.label = label
+        self.serial = serial
+        self.separator = separator
+        self.expected_records = None
+        self.Reset()
+    def Reset(self):
+        self.buffer = b''
+        self.lines = []
+        self.n_records = 0
+        self.last_data = None
+        self.complete = False
+    def ReadLines(self):
+        """ Reads whatever is available and returns the newly completed lines """
+        data = self.serial.read(max(1, self.serial.in_waiting))
+        if not data:
+            return []
+        self.buffer += data
+        if b'\n' not in data:
+            return []
+        *lines, self.buffer = self.buffer.split(b'\n')
+        return [l_ + b'\n' for l_ in lines]
+    def AddLines(self, lines):
+        self.last_data = time()
+        self.lines += lines
+        self.n_records += sum(len(l_.strip().split(self.separator)) for l_ in lines if l_.strip())
+    def CheckComplete(self, now, settle):
+        """
+        A device is complete once the expected number of records arrived. The expected number is
+        learned from the first readout, which ends after the device stays quiet for ``settle`` seconds.
+        """
+        if self.complete:
+            return True
+        if self.expected_records is not None:
+            self.complete = self.n_records >= self.expected_records
+        elif self.last_data is not None and now >= self.last_data + settle:
+            self.expected_records = self.n_records
+            self.complete = True
+        return self.complete
+    def Deadline(self, request_time, timeout, settle):
+        """ Time at which the device has to be checked again """
+        if self.expected_records is None and self.last_data is not None:
+            return self.last_data + settle
+        return request_time + timeout
+
+class SerialReader:
+    """
+    Long-lived reader of one or many serial devices, running in a single thread.
+    All devices are multiplexed with a selector (devices without fileno() are polled).
+    Incoming bytes are framed into lines on b'\\n' as they arrive. A poll sends the
+    command to all devices at the same moment, and the measurement is finished as soon as
+    every device delivered all its expected records (records are separated by ``separator``),
+    or at the timeout.
+    Finished measurements are put in the thread-safe ``results`` queue and
+    ``on_received`` is called from the reader thread.
+    """
+    poll_interval = 0.01
+    def __init__(self, devices, on_received=None, command=b'r', timeout=5., settle=0.2, separator=b';'):
+        if not isinstance(devices, dict):
+            devices = {'0':devices}
+        self.devices = {label:DeviceState(label, serial, separator) for label, serial in devices.items()}
+        self.on_received = on_received
+        self.command = command
+        self.timeout = timeout
+        self.settle = settle
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self._status = "idle"
+        self.requested = threading.Event()
+        self.running = False
+        self.thread = None
+        self.selector = None
+        self.wakeup = None
+    @property
+    def status(self):
+        with self.lock:
+            return self._status
+    def SetStatus(self, status):
+        with self.lock:
+            self._status = status
+    def Start(self):
+        self.running = True
+        filenos = {}
+        for device in self.devices.values():
+            try:
+                filenos[device.label] = device.serial.fileno()
+            except (AttributeError, OSError):
+                filenos = None
+                break
+        if filenos is not None:
+            self.selector = selectors.DefaultSelector()
+            for label, fileno in filenos.items():
+                self.selector.register(fileno, selectors.EVENT_READ, self.devices[label])
+            self.wakeup = os.pipe()
+            os.set_blocking(self.wakeup[0], False)
+            self.selector.register(self.wakeup[0], selectors.EVENT_READ, None)
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+    def Stop(self):
+        self.running = False
+        self.Wake()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.selector is not None:
+            self.selector.close()
+            os.close(self.wakeup[0])
+            os.close(self.wakeup[1])
+            self.selector = None
+            self.wakeup = None
+    def Wake(self):
+        if self.wakeup is not None:
+            os.write(self.wakeup[1], b'x')
+    def Request(self):
+        """ Asks for a new measurement. Returns False if the previous one is still running """
+        with self.lock:
+            if self._status != "idle" or self.requested.is_set():
+                return False
+            self.requested.set()
+        self.Wake()
+        return True
+    def Wait(self, timeout):
+        """ Waits until some device or a request needs attention. Returns the readable devices """
+        if self.selector is None:
+            self.requested.wait(min(timeout, self.poll_interval))
+            return list(self.devices.values())
+        readable = []
+        for key, _ in self.selector.select(timeout):
+            if key.data is None:
+                try:
+                    os.read(self.wakeup[0], 4096)
+                except BlockingIOError:
+                    pass
+            else:
+                readable.append(key.data)
+        return readable
+    def Run(self):
+        request_time = None
+        while self.running:
+            if request_time is None:
+                timeout = 1.
+            else:
+                deadline = min(d.Deadline(request_time, self.timeout, self.settle) for d in self.devices.values() if not d.complete)
+                timeout = max(0., deadline - time())
+            for device in self.Wait(timeout):
+                new_lines = device.ReadLines()
+                if request_time is not None and new_lines:
+                    device.AddLines(new_lines)
+            if request_time is None:
+                # Anything received while idle was unsolicited and is dropped
+                if self.requested.is_set():
+                    self.SetStatus("measuring")
+                    self.requested.clear()
+                    request_time = time()
+                    for device in self.devices.values():
+                        device.Reset()
+                        device.serial.write(self.command)
+                continue
+            now = time()
+            complete = [d.CheckComplete(now, self.settle) for d in self.devices.values()]
+            if not all(complete) and now < request_time + self.timeout:
+                continue
+            for device in self.devices.values():
+                if not device.complete and device.n_records > 0:
+                    # Some sensor stopped answering: do not wait for it on every measurement
+                    device.expected_records = device.n_records
+            measurement = Measurement(request_time,
+                    {d.label:d.lines for d in self.devices.values()},
+                    {d.label:(now if d.last_data is None else d.last_data) - request_time for d in self.devices.values()},
+                    all(complete))
+            request_time = None
+            self.SetStatus("idle")
+            self.results.put(measurement)
+            if self.on_received is not None:
+                self.on_received()
@@ -1,24 +1,39 @@
 from PyQt5.QtCore import QObject, pyqtSignal
-from copy import deepcopy
+from htmon.SerialReader import SerialReader
+import queue
+
 class SerialThreadHandler(QObject):
     """
     This class is used to handle the serial communication with the Arduino.
-    Once response is received, it emits a signal (in a thread), which can be detected by the main thread.
+    It owns a long-lived SerialReader; once a response is received, it emits a signal (in the reader thread),
+    which can be detected by the main thread.
     """
     received = pyqtSignal()
     def __init__(self, parent = None):
         super().__init__(parent = parent)
-        self.status = "idle"
-    def ListenForRepsonce(self, serial):
-        self.status = "measuring"
-        serial.write(b'r')
-        self.newlines = serial.readlines()
-        self.status = "received"
-        self.received.emit()
+        self.reader = None
+    def Start(self, serial, **kwargs):
+        self.Stop()
+        self.reader = SerialReader(serial, on_received=self.received.emit, **kwargs)
+        self.reader.Start()
+    def Stop(self):
+        if self.reader is not None:
+            self.reader.Stop()
+            self.reader = None
+    def RequestMeasurement(self):
+        """ Returns False if the reader is not running or still busy with the previous measurement """
+        if self.reader is None:
+            return False
+        return self.reader.Request()
     def GetStatus(self):
-        return self.status
+        if self.reader is None:
+            return "idle"
+        return self.reader.status
     def GetResponce(self):
-        responce = deepcopy(self.newlines)
-        self.newlines = []
-        self.status = "idle"
-        return responce
\ No newline at end of file
+        """ Returns the next finished Measurement, or None if there is none """
+        if self.reader is None:
+            return None
+        try:
+            return self.reader.results.get_nowait()
+        except queue.Empty:
+            return None
@@ -0,0 +1,136 @@
+import os
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('T', '<f4'), ('RH', '<f4'), ('sensor', '<i4'), ('pad', '<i4')])
+NAME_DTYPE = np.dtype('S64')
+MAGIC = 0x48544d4f4e52494e # "HTMONRIN"
+VERSION = 2
+# Header fields, int64 each. H_RESERVED_INDEX is the index up to which the writer may be overwriting records
+(H_MAGIC, H_VERSION, H_CAPACITY, H_MAX_SENSORS, H_N_SENSORS, H_WRITE_INDEX, H_WRITER_PID, H_CLOSED,
+        H_RESERVED_INDEX) = range(9)
+N_HEADER = 16
+HEADER_SIZE = 8*N_HEADER
+
+class SharedRing:
+    """
+    Ring buffer of samples in shared memory, written by one acquisition process and read
+    by any number of viewer processes.
+    The writer reserves the records it is about to write, stores them and then advances the
+    write index (the total number of records ever written), so everything below the index
+    is complete, and records a reader copied are intact if they were not reserved meanwhile. Sensor names are kept
+    in a table in the same block and referenced by index from the records.
+    Readers get views of the shared block, without copies. A reader which falls behind by
+    more than ``capacity`` records loses the oldest ones; Read() reports how many.
+    Use Create() in the writer and Attach() in readers.
+    """
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray(N_HEADER, dtype='<i8', buffer=shm.buf)
+        self.capacity = int(self.header[H_CAPACITY])
+        self.max_sensors = int(self.header[H_MAX_SENSORS])
+        self.names = np.ndarray(self.max_sensors, dtype=NAME_DTYPE, buffer=shm.buf, offset=HEADER_SIZE)
+        self.records = np.ndarray(self.capacity, dtype=RECORD_DTYPE, buffer=shm.buf,
+                offset=HEADER_SIZE + self.max_sensors*NAME_DTYPE.itemsize)
+        self.sensor_index = {}
+        self.sensor_names = np.array([], dtype=str)
+    @classmethod
+    def Create(cls, name, capacity=1000000, max_sensors=4096):
+        size = HEADER_SIZE + max_sensors*NAME_DTYPE.itemsize + capacity*RECORD_DTYPE.itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray(N_HEADER, dtype='<i8', buffer=shm.buf)
+        header[:] = 0
+        header[[H_MAGIC, H_VERSION, H_CAPACITY, H_MAX_SENSORS, H_WRITER_PID]] = [MAGIC, VERSION, capacity, max_sensors, os.getpid()]
+        del header
+        return cls(shm, owner=True)
+    @classmethod
+    def Attach(cls, name):
+        """ Raises FileNotFoundError if no acquisition publishes under this name """
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 every process attaching registers the block, and removes it when it exits
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        header = np.ndarray(N_HEADER, dtype='<i8', buffer=shm.buf)
+        valid = header[H_MAGIC] == MAGIC and header[H_VERSION] == VERSION
+        del header
+        if not valid:
+            shm.close()
+            raise ValueError(f"Shared memory {name} is not an htmon ring buffer")
+        return cls(shm, owner=False)
+    @property
+    def write_index(self):
+        return int(self.header[H_WRITE_INDEX])
+    @property
+    def closed(self):
+        """ True once the writer has stopped """
+        return bool(self.header[H_CLOSED])
+    def Write(self, sensors, times, T, RH):
+        """ Appends samples; sensors is an array of sensor IDs (str), times may be a scalar """
+        n = len(sensors)
+        if n == 0:
+            return
+        unique, inverse = np.unique(sensors, return_inverse=True)
+        indices = np.array([self.SensorIndex(s_) for s_ in unique], dtype=np.int32)[inverse]
+        start = self.write_index
+        if n > self.capacity:
+            # Only the last capacity records survive anyway
+            start += n - self.capacity
+            indices, times, T, RH = (np.broadcast_to(a_, n)[-self.capacity:] for a_ in (indices, times, T, RH))
+            n = self.capacity
+        self.header[H_RESERVED_INDEX] = start + n
+        positions = (start + np.arange(n)) % self.capacity
+        self.records['time'][positions] = times
+        self.records['T'][positions] = T
+        self.records['RH'][positions] = RH
+        self.records['sensor'][positions] = indices
+        self.header[H_WRITE_INDEX] = start + n
+    def SensorIndex(self, sensor):
+        """ Index of a sensor in the name table, adding it if needed (writer only) """
+        if sensor not in self.sensor_index:
+            n_sensors = int(self.header[H_N_SENSORS])
+            if n_sensors >= self.max_sensors:
+                raise ValueError(f"More than {self.max_sensors} sensors")
+            self.names[n_sensors] = str(sensor).encode('utf-8')[:NAME_DTYPE.itemsize]
+            self.header[H_N_SENSORS] = n_sensors + 1
+            self.sensor_index[sensor] = n_sensors
+        return self.sensor_index[sensor]
+    def SensorNames(self):
+        """ Array of the sensor IDs, indexed by the 'sensor' field of the records """
+        n_sensors = int(self.header[H_N_SENSORS])
+        if len(self.sensor_names) != n_sensors:
+            self.sensor_names = np.array([n_.decode('utf-8') for n_ in self.names[:n_sensors]])
+        return self.sensor_names
+    def Read(self, start):
+        """
+        Records from absolute index start up to the current write index.
+        Returns (segments, end, n_lost): one or two views of the ring in order, the index to
+        continue from, and the number of records which were overwritten before they were read.
+        """
+        end = self.write_index
+        n_lost = max(0, end - self.capacity - start)
+        start += n_lost
+        if start >= end:
+            return [], end, n_lost
+        first, last = start % self.capacity, end % self.capacity
+        if first < last or last == 0:
+            segments = [self.records[first:last if last > 0 else self.capacity]]
+        else:
+            segments = [self.records[first:], self.records[:last]]
+        return segments, end, n_lost
+    def Overwritten(self, start):
+        """
+        Number of records from start which were overwritten by now or are being overwritten,
+        e.g. while a reader copied its views
+        """
+        return max(0, int(self.header[H_RESERVED_INDEX]) - self.capacity - start)
+    def Close(self):
+        """ Detaches; the writer marks the ring as closed and removes it """
+        if self.owner:
+            self.header[H_CLOSED] = 1
+        del self.header, self.names, self.records
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,134 @@
+import os
+import logging
+import tempfile
+import threading
+from collections import namedtuple
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+import matplotlib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Everything needed to draw one plot, with copies of the (decimated) data
+PlotSnapshot = namedtuple("PlotSnapshot", ["name", "lines", "events", "xlabel", "ylabel"])
+
+MAX_EVENT_LABELS = 10 # with more events the legend has one entry for all of them
+
+def EventMarkers(axes):
+    """ Single artist for all event markers of axes: vertical lines spanning the axes height """
+    markers = LineCollection([], linestyles='--', linewidths=matplotlib.rcParams['lines.linewidth'],
+            transform=axes.get_xaxis_transform())
+    axes.add_collection(markers, autolim=False)
+    return markers
+
+def SetEventMarkers(markers, positions):
+    """ Moves the markers to positions (data x coordinates), coloured along the property cycle """
+    positions = np.asarray(positions, dtype=np.float64)
+    segments = np.zeros((len(positions), 2, 2))
+    segments[:, :, 0] = positions[:, None]
+    segments[:, 1, 1] = 1.
+    colors = matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+    markers.set_segments(segments)
+    markers.set_color([colors[i % len(colors)] for i in range(len(positions))])
+
+def EventLegend(axes, markers, labels, **kwargs):
+    """ Legend of the labelled artists of axes, plus the event markers """
+    handles, texts = axes.get_legend_handles_labels()
+    colors = markers.get_colors()
+    if 0 < len(labels) <= MAX_EVENT_LABELS:
+        handles += [Line2D([], [], linestyle='--', color=c_) for c_ in colors]
+        texts += list(labels)
+    elif len(labels) > 0:
+        handles.append(Line2D([], [], linestyle='--', color=colors[0]))
+        texts.append(f"{len(labels)} events")
+    if len(handles) == 0:
+        if axes.get_legend() is not None:
+            axes.get_legend().remove()
+        return None
+    return axes.legend(handles, texts, **kwargs)
+
+class SnapshotRenderer:
+    """
+    Renders plot snapshots to image files in a background thread.
+    Only the latest request is kept: requests arriving while a render is running
+    replace the pending one and are counted in ``n_skipped``.
+    Files are written to a temporary file first and renamed, so readers never see
+    a partially written image.
+    """
+    def __init__(self, formats=("png", "pdf"), dpi=300, width=6, height=4):
+        self.formats = formats
+        self.dpi = dpi
+        self.width = width
+        self.height = height
+        self.pending = None
+        self.n_rendered = 0
+        self.n_skipped = 0
+        self.error = None
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+    def MaxPoints(self):
+        """ Points per line worth drawing at the export resolution """
+        return 2*int(self.width*self.dpi)
+    def Start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+    def Stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+    def Request(self, outdir, snapshots):
+        """ snapshots is a list of PlotSnapshot, each of them is saved as outdir/plot_<name>.<format> """
+        with self.condition:
+            if self.pending is not None:
+                self.n_skipped += 1
+            self.pending = (outdir, snapshots)
+            self.condition.notify()
+    def Run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                outdir, snapshots = self.pending
+                self.pending = None
+            try:
+                for snapshot in snapshots:
+                    self.Render(outdir, snapshot)
+                self.n_rendered += 1
+            except Exception as error:
+                # Reported to the GUI through self.error; the next request is rendered again
+                logger.exception("Could not save plots to %s", outdir)
+                self.error = error
+    def Render(self, outdir, snapshot):
+        fig = Figure(figsize=(self.width, self.height), dpi=100)
+        FigureCanvasAgg(fig)
+        axes = fig.add_axes([0.12, 0.12, 0.85, 0.85])
+        axes.xaxis.set_tick_params(labelsize=8)
+        axes.yaxis.set_tick_params(labelsize=8)
+        for label, x, y in snapshot.lines:
+            axes.plot(x, y, label=label)
+        positions, labels = snapshot.events
+        markers = EventMarkers(axes)
+        SetEventMarkers(markers, positions)
+        EventLegend(axes, markers, labels, fontsize=6)
+        axes.set_xlabel(snapshot.xlabel, fontsize=9)
+        axes.set_ylabel(snapshot.ylabel, fontsize=9)
+        for fmt in self.formats:
+            path = os.path.join(outdir, f"plot_{snapshot.name}.{fmt}")
+            fd, tmp_path = tempfile.mkstemp(dir=outdir, prefix=f".plot_{snapshot.name}.", suffix=f".{fmt}")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    fig.savefig(f, format=fmt, dpi=self.dpi)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
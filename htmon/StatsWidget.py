@@ -0,0 +1,67 @@
+from PyQt5.QtWidgets import (
+            QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
+            QCheckBox, QPlainTextEdit, QFileDialog
+            )
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QFontDatabase
+import os
+
+class StatsWidget(QWidget):
+    """
+    Window showing the stage timings and counters of an Instrumentation.
+    It is refreshed every second while it is visible; timing and profiling are switched on here.
+    """
+    def __init__(self, instrumentation, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Statistics")
+        self.instrumentation = instrumentation
+        self.layout = QVBoxLayout()
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.text.setMinimumWidth(600)
+        self.layout.addWidget(self.text)
+        self.timingCheckBox = QCheckBox("Time stages")
+        self.timingCheckBox.setChecked(self.instrumentation.enabled)
+        self.timingCheckBox.toggled.connect(self.SetTiming)
+        self.resetButton = QPushButton("Reset")
+        self.resetButton.clicked.connect(self.Reset)
+        self.logButton = QPushButton("Write to log")
+        self.logButton.clicked.connect(lambda: self.instrumentation.LogSummary())
+        self.profileButton = QPushButton("Start profiling")
+        self.profileButton.clicked.connect(self.ToggleProfiling)
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.timingCheckBox)
+        buttons.addWidget(self.resetButton)
+        buttons.addWidget(self.logButton)
+        buttons.addWidget(self.profileButton)
+        self.layout.addLayout(buttons)
+        self.setLayout(self.layout)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.Refresh)
+    def SetTiming(self, enabled):
+        self.instrumentation.enabled = enabled
+        self.Refresh()
+    def Reset(self):
+        self.instrumentation.Reset()
+        self.Refresh()
+    def ToggleProfiling(self):
+        if not self.instrumentation.profiling:
+            self.instrumentation.StartProfiling()
+            self.profileButton.setText("Stop profiling")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Save profile", os.path.join(os.getcwd(), "htmon.prof"))
+        report = self.instrumentation.StopProfiling(path if path != "" else None)
+        self.profileButton.setText("Start profiling")
+        self.text.setPlainText(report)
+        # Keep the report on screen until the window is reopened
+        self.timer.stop()
+    def Refresh(self):
+        self.text.setPlainText(self.instrumentation.FormatSummary())
+    def showEvent(self, event):
+        self.Refresh()
+        self.timer.start(1000)
+        super().showEvent(event)
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
@@ -0,0 +1,97 @@
+import queue
+import selectors
+import threading
+from time import time, sleep
+from htmon.SerialReader import DeviceState
+
+class StreamReader:
+    """
+    Reader of devices which send readouts continuously instead of answering polls.
+    ``start_command`` is sent to every device when reading starts and ``stop_command``
+    when it stops (None for devices which stream by themselves).
+    Each chunk of complete lines is timestamped when it arrives and put in the bounded
+    ``results`` queue as (device label, arrival time, lines). If the consumer falls behind
+    and the queue is full, chunks are dropped and counted (``on_full="drop"``), or the
+    reader waits for the consumer (``on_full="block"``), leaving the data in the OS buffers.
+    """
+    poll_interval = 0.01
+    def __init__(self, devices, start_command=b's', stop_command=b'x', max_queue=1000, on_full="drop", separator=b';'):
+        if not isinstance(devices, dict):
+            devices = {'0':devices}
+        if on_full not in ("drop", "block"):
+            raise ValueError(f"on_full must be 'drop' or 'block', not {on_full}")
+        self.devices = {label:DeviceState(label, serial, separator) for label, serial in devices.items()}
+        self.start_command = start_command
+        self.stop_command = stop_command
+        self.on_full = on_full
+        self.results = queue.Queue(maxsize=max_queue)
+        self.n_lines = 0
+        self.n_dropped = 0
+        self.running = False
+        self.thread = None
+    def Start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+    def Stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+    def Put(self, item):
+        if self.on_full == "drop":
+            try:
+                self.results.put_nowait(item)
+            except queue.Full:
+                self.n_dropped += len(item[2])
+            return
+        while self.running:
+            try:
+                self.results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+    def Drain(self):
+        """ All chunks received so far, without waiting """
+        items = []
+        while True:
+            try:
+                items.append(self.results.get_nowait())
+            except queue.Empty:
+                return items
+    def Run(self):
+        selector = None
+        try:
+            selector = selectors.DefaultSelector()
+            for device in self.devices.values():
+                selector.register(device.serial.fileno(), selectors.EVENT_READ, device)
+        except (AttributeError, OSError):
+            # Devices without fileno() are polled
+            if selector is not None:
+                selector.close()
+            selector = None
+        if self.start_command is not None:
+            for device in self.devices.values():
+                device.serial.write(self.start_command)
+        try:
+            while self.running:
+                if selector is None:
+                    sleep(self.poll_interval)
+                    readable = list(self.devices.values())
+                else:
+                    # Short timeout, so that Stop() is noticed without a wakeup pipe
+                    readable = [key.data for key, _ in selector.select(0.1)]
+                for device in readable:
+                    lines = device.ReadLines()
+                    if lines:
+                        self.n_lines += len(lines)
+                        self.Put((device.label, time(), lines))
+        finally:
+            if self.stop_command is not None:
+                for device in self.devices.values():
+                    try:
+                        device.serial.write(self.stop_command)
+                    except OSError:
+                        pass
+            if selector is not None:
+                selector.close()
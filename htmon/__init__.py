@@ -1 +1,24 @@
-from .HTMonitorWidget    import HTMonitorWidget
\ No newline at end of file
+import sys
+import importlib
+from types import ModuleType
+
+# The GUI pulls in Qt and matplotlib, so it is only imported when it is used.
+# The acquisition modules (SerialReader, RecordParser, DataWriter, HeadlessMonitor, ...)
+# can be imported on their own.
+class LazyClass:
+    """ Package attribute resolving to the class of the same name in its submodule """
+    def __init__(self, name):
+        self.name = name
+    def __get__(self, package, owner=None):
+        if package is None:
+            return self
+        return getattr(importlib.import_module(f"{package.__name__}.{self.name}"), self.name)
+    def __set__(self, package, value):
+        # Importing the submodule binds the package attribute to the module; the class is kept
+        pass
+
+class Package(ModuleType):
+    HTMonitorWidget = LazyClass("HTMonitorWidget")
+    HeadlessMonitor = LazyClass("HeadlessMonitor")
+
+sys.modules[__name__].__class__ = Package
@@ -16,5 +16,6 @@ setuptools.setup(
     install_requires=requirements,
     scripts=[
         "bin/htmongui",
+        "bin/htmon",
     ]
 )
\ No newline at end of file
@@ -0,0 +1,23 @@
+import os
+import sys
+import subprocess
+import pytest
+
+def RunPython(code):
+    """ Fresh interpreter, the import order of the tests in this process does not matter """
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join([root] + [p_ for p_ in [env.get("PYTHONPATH")] if p_])
+    return subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout.split()
+
+def test_headless_does_not_import_gui():
+    assert RunPython("import htmon.HeadlessMonitor, sys; print('PyQt5' in sys.modules, 'matplotlib' in sys.modules)") == ["False", "False"]
+
+def test_headless_class_after_submodule_import():
+    assert RunPython("import htmon.HeadlessMonitor\nfrom htmon import HeadlessMonitor\nimport htmon\n"
+            "print(isinstance(HeadlessMonitor, type), htmon.HeadlessMonitor is HeadlessMonitor)") == ["True", "True"]
+
+def test_gui_class_after_submodule_import():
+    pytest.importorskip("PyQt5.QtWidgets")
+    assert RunPython("import htmon.HTMonitorWidget\nfrom htmon import HTMonitorWidget\n"
+            "print(HTMonitorWidget.__name__, isinstance(HTMonitorWidget, type))") == ["HTMonitorWidget", "True"]
@@ -0,0 +1,36 @@
+import os
+import numpy as np
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+
+@pytest.fixture(scope="module")
+def monitor():
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    from htmon.HTMonitorWidget import HTMonitorWidget
+    widget = HTMonitorWidget(max_samples=20000)
+    times = np.arange(300000, dtype=np.float64)
+    for start in range(0, len(times), 1000):
+        t = times[start:start + 1000]
+        widget.IngestSamples(np.full(len(t), "s"), t, np.sin(t/500.), np.cos(t/700.))
+        if start % 20000 == 0:
+            widget.UpdatePlots()
+    widget.UpdatePlots()
+    yield widget
+    widget.close()
+    del app
+
+@pytest.mark.parametrize("t_min, t_max", [(-np.inf, np.inf), (250000., 290000.), (279000., 281000.)])
+def test_render_is_monotonic_across_spill_boundary(monitor, t_min, t_max):
+    # Samples below the first one in memory are rendered from the disk history
+    assert monitor.history.Count("s") > 0
+    for column in ("T", "RH"):
+        times, values = monitor.RenderSensor("s", column, t_min, t_max, max_points=2000)
+        assert len(times) == len(values) > 0
+        assert np.all(np.diff(times) >= 0)
+
+def test_plotted_lines_are_monotonic(monitor):
+    for plot in (monitor.temperaturePlot, monitor.humidityPlot):
+        for line in plot.axes.get_lines():
+            assert np.all(np.diff(line.get_xdata()) >= 0)